@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import importlib.util
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+# Pruebas disponibles, en el orden en que se ejecutan
+PRUEBAS = ("interactivo", "lote", "imagenes", "exportacion")
+
+
+def _percentiles(valores):
+    from metricas import percentil
+    ordenados = sorted(valores)
+    return {f"p{p}": round(percentil(ordenados, p), 4) if ordenados else None for p in (50, 95, 99)}
+
+
+def medir_interactivo(peticiones, modelo):
+    """Preguntas con streaming una tras otra, como en main.py y chat.py (sin caché)"""
+    from cliente import generar
+    primeros, totales, errores = [], [], 0
+    inicio_prueba = time.perf_counter()
+    for i in range(peticiones):
+        marca = {}
+        inicio = time.perf_counter()
+
+        def al_recibir(fragmento):
+            marca.setdefault("primero", time.perf_counter() - inicio)
+
+        try:
+            generar(modelo, f"Pregunta interactiva número {i}", al_recibir, usar_cache=False)
+        except Exception:
+            errores += 1
+            continue
+        totales.append(time.perf_counter() - inicio)
+        primeros.append(marca.get("primero", totales[-1]))
+    segundos = time.perf_counter() - inicio_prueba
+    return {"peticiones": peticiones, "errores": errores, "segundos": round(segundos, 4),
+            "por_segundo": round(peticiones / segundos, 3),
+            "primer_token": _percentiles(primeros), "total": _percentiles(totales)}
+
+
+def medir_lote(prompts, concurrencia, modelo, directorio):
+    """procesar_lote() de principio a fin sobre un JSONL generado"""
+    from lote import procesar_lote
+    entrada = os.path.join(directorio, "lote.jsonl")
+    salida = os.path.join(directorio, "lote.resultados.jsonl")
+    with open(entrada, 'w', encoding='utf-8') as f:
+        for i in range(prompts):
+            f.write(json.dumps({"id": i, "prompt": f"Pregunta del lote número {i}"}) + "\n")
+    inicio = time.perf_counter()
+    contadores = procesar_lote(entrada, salida, modelo=modelo, concurrencia=concurrencia,
+                               por_minuto=prompts * 600, max_intentos=3, usar_cache=False)
+    segundos = time.perf_counter() - inicio
+    return {"prompts": prompts, "concurrencia": concurrencia, "errores": contadores["errores"],
+            "segundos": round(segundos, 4), "por_segundo": round(prompts / segundos, 3)}
+
+
+def medir_imagenes(cantidad, lado, directorio):
+    """Codificación de imágenes como en obtener_respuesta: en frío, en paralelo y ya en caché"""
+    try:
+        from PIL import Image
+        from imagenes import preparar_imagen, CacheCodificaciones
+    except ImportError as e:
+        return {"omitida": str(e)}
+
+    rutas = []
+    for i in range(cantidad):
+        ruta = os.path.join(directorio, f"imagen_{i}.jpg")
+        # Ruido gaussiano: el peor caso para el JPEG, como una foto con mucho detalle
+        imagen = Image.effect_noise((lado, lado * 3 // 4), 64 + i).convert("RGB")
+        imagen.save(ruta, quality=90)
+        rutas.append(ruta)
+
+    frio = []
+    for ruta in rutas:
+        inicio = time.perf_counter()
+        preparar_imagen(ruta)
+        frio.append(time.perf_counter() - inicio)
+
+    cache = CacheCodificaciones()
+    inicio = time.perf_counter()
+    cache.precargar(rutas)
+    bytes_totales = sum(len(parte["data"]) for ruta in rutas for parte in cache.obtener(ruta))
+    paralelo = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for ruta in rutas:
+        cache.obtener(ruta)
+    caliente = time.perf_counter() - inicio
+    return {"imagenes": cantidad, "lado": lado, "frio": _percentiles(frio),
+            "paralelo_segundos": round(paralelo, 4), "cache_segundos": round(caliente, 6),
+            "bytes": bytes_totales}
+
+
+def medir_exportacion(mensajes, directorio):
+    """exportar() de una conversación sintética en cada formato disponible"""
+    from historial import AlmacenMensajes
+    from exportar import exportar, ESCRITORES
+    almacen = AlmacenMensajes()
+    for i in range(mensajes // 2):
+        almacen.agregar("usuario", f"Pregunta {i} sobre <algo> & más")
+        almacen.agregar("modelo", f"Respuesta {i}. " * 30, modelo="gemini-2.0-flash", completo=True)
+
+    resultados = {"mensajes": len(almacen)}
+    for extension in ESCRITORES:
+        if extension == "pdf":
+            if importlib.util.find_spec("reportlab") is None:
+                resultados[extension] = {"omitida": "reportlab no está instalado"}
+                continue
+        inicio = time.perf_counter()
+        exportar(iter(almacen), os.path.join(directorio, f"exportacion.{extension}"), len(almacen))
+        resultados[extension] = {"segundos": round(time.perf_counter() - inicio, 4)}
+    return resultados
+
+
+def _version():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def _metricas_planas(datos, prefijo=""):
+    # Aplana el resultado a {"prueba.campo.p50": valor} para comparar dos ejecuciones
+    planas = {}
+    for clave, valor in datos.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planas.update(_metricas_planas(valor, nombre + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planas[nombre] = valor
+    return planas
+
+
+def comparar(anterior, actual, tolerancia):
+    """Lista de regresiones: tiempos que suben o ritmos que bajan más que la tolerancia"""
+    previas = _metricas_planas(anterior["resultados"])
+    nuevas = _metricas_planas(actual["resultados"])
+    regresiones = []
+    for nombre, valor in nuevas.items():
+        previo = previas.get(nombre)
+        if not previo or valor is None:
+            continue
+        ultimo = nombre.rsplit(".", 1)[-1]
+        if ultimo == "por_segundo":
+            empeora = valor < previo * (1 - tolerancia)
+        elif ultimo in ("segundos", "p50", "p95", "p99", "cache_segundos", "paralelo_segundos"):
+            empeora = valor > previo * (1 + tolerancia)
+        else:
+            continue
+        if empeora:
+            regresiones.append((nombre, previo, valor))
+    return regresiones
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmark sin red del Oráculo contra un servidor falso de Gemini")
+    parser.add_argument("--solo", nargs="+", choices=PRUEBAS, help="pruebas a ejecutar (por defecto todas)")
+    parser.add_argument("--modelo", default="gemini-2.0-flash")
+    parser.add_argument("--peticiones", type=int, default=20, help="preguntas de la prueba interactiva")
+    parser.add_argument("--lote", type=int, default=200, help="prompts de la prueba de lote")
+    parser.add_argument("--concurrencia", type=int, default=8, help="concurrencia del lote")
+    parser.add_argument("--imagenes", type=int, default=6, help="imágenes a codificar")
+    parser.add_argument("--lado", type=int, default=4000, help="ancho en píxeles de las imágenes generadas")
+    parser.add_argument("--mensajes", type=int, default=5000, help="mensajes de la conversación a exportar")
+    parser.add_argument("--latencia", type=float, default=0.05, help="latencia simulada hasta el primer fragmento")
+    parser.add_argument("--latencia-fragmento", type=float, default=0.005, help="latencia simulada entre fragmentos")
+    parser.add_argument("--fragmento", type=int, default=40, help="caracteres por fragmento")
+    parser.add_argument("--longitud", type=int, default=400, help="caracteres de cada respuesta")
+    parser.add_argument("--errores", type=float, default=0.0, help="fracción de peticiones que fallan")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", metavar="RESULTADOS.json", help="guardar los resultados en un archivo")
+    parser.add_argument("--comparar", metavar="ANTERIOR.json", help="resultados previos con los que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="empeoramiento relativo admitido")
+    return parser.parse_args()
+
+
+def main():
+    args = parsear_argumentos()
+    pruebas = args.solo or PRUEBAS
+
+    with tempfile.TemporaryDirectory(prefix="oraculo-bench-") as directorio:
+        # Todo lo persistente va a un directorio temporal para no tocar las cachés del usuario
+        os.environ["CACHE_RUTA"] = os.path.join(directorio, "respuestas.sqlite3")
+        os.environ["HISTORIAL_RUTA"] = os.path.join(directorio, "historial.sqlite3")
+        os.environ["METRICAS_RUTA"] = ""
+
+        from servidor_falso import ServidorFalso
+        servidor = ServidorFalso(latencia=args.latencia, latencia_fragmento=args.latencia_fragmento,
+                                 tamano_fragmento=args.fragmento, longitud=args.longitud,
+                                 tasa_errores=args.errores, semilla=args.semilla)
+        os.environ["GEMINI_API_ENDPOINT"] = servidor.iniciar()
+
+        resultados = {}
+        try:
+            for prueba in pruebas:
+                print(f"⏱ {prueba}...", file=sys.stderr)
+                if prueba == "interactivo":
+                    resultados[prueba] = medir_interactivo(args.peticiones, args.modelo)
+                elif prueba == "lote":
+                    resultados[prueba] = medir_lote(args.lote, args.concurrencia, args.modelo, directorio)
+                elif prueba == "imagenes":
+                    resultados[prueba] = medir_imagenes(args.imagenes, args.lado, directorio)
+                elif prueba == "exportacion":
+                    resultados[prueba] = medir_exportacion(args.mensajes, directorio)
+        finally:
+            servidor.detener()
+
+    informe = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": _version(),
+        "python": platform.python_version(),
+        "servidor": {"latencia": args.latencia, "latencia_fragmento": args.latencia_fragmento,
+                     "fragmento": args.fragmento, "longitud": args.longitud, "errores": args.errores},
+        "resultados": resultados
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + "\n")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        regresiones = comparar(anterior, informe, args.tolerancia)
+        for nombre, previo, valor in regresiones:
+            print(f"⚠️ Regresión en {nombre}: {previo} → {valor}", file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+        print(f"✓ Sin regresiones respecto a {args.comparar}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
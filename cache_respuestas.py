@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import pathlib
+import hashlib
+import sqlite3
+import threading
+
+# Ruta por defecto de la caché en disco
+cache_path = pathlib.Path('.') / '.cache' / 'respuestas.sqlite3'
+
+
+def _actualizar_hash(h, contenido):
+    # Recorre texto, imágenes y turnos {"role", "parts"} de una conversación
+    partes = [contenido] if isinstance(contenido, str) else contenido
+    for parte in partes:
+        if isinstance(parte, str):
+            h.update(b"T" + parte.encode('utf-8'))
+        elif isinstance(parte, dict) and "parts" in parte:
+            h.update(b"R" + parte.get("role", "").encode('utf-8'))
+            _actualizar_hash(h, parte["parts"])
+        elif isinstance(parte, dict):
+            # Imagen: se usa el resumen de sus bytes
+            h.update(b"I" + parte.get("mime_type", "").encode('utf-8'))
+            h.update(hashlib.sha256(parte["data"]).digest())
+        else:
+            h.update(b"O" + repr(parte).encode('utf-8'))
+        h.update(b"\0")
+
+
+class CacheRespuestas:
+    """Caché persistente de respuestas con caducidad (TTL) y expulsión LRU por número de entradas y tamaño"""
+
+    def __init__(self, ruta=cache_path, ttl=7 * 24 * 3600, max_entradas=5000, max_bytes=100 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        # Aciertos por pregunta parecida (incluidos en aciertos)
+        self.semanticos = 0
+        self.lock = threading.Lock()
+
+        pathlib.Path(ruta).parent.mkdir(parents=True, exist_ok=True)
+        self.conexion = sqlite3.connect(str(ruta), check_same_thread=False)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""
+            CREATE TABLE IF NOT EXISTS respuestas (
+                clave TEXT PRIMARY KEY,
+                modelo TEXT NOT NULL,
+                texto TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                creado REAL NOT NULL,
+                accedido REAL NOT NULL
+            )""")
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_accedido ON respuestas (accedido)")
+        self.conexion.commit()
+
+    @staticmethod
+    def clave(modelo, contenido, generation_config=None):
+        """Hash del modelo, el texto del prompt y los bytes de las imágenes adjuntas"""
+        h = hashlib.sha256()
+        h.update(modelo.encode('utf-8'))
+        h.update(b"\0")
+        if generation_config is not None:
+            h.update(json.dumps(generation_config, sort_keys=True, default=str).encode('utf-8'))
+        h.update(b"\0")
+        _actualizar_hash(h, contenido)
+        return h.hexdigest()
+
+    def obtener(self, clave, similar=False):
+        """Devuelve el texto guardado o None si no existe o ha caducado.
+
+        Con similar=True es la respuesta a una pregunta parecida (caché semántica) tras un fallo
+        exacto: si existe, ese fallo pasa a contar como acierto semántico.
+        """
+        ahora = time.time()
+        with self.lock:
+            fila = self.conexion.execute(
+                "SELECT texto, creado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None or (self.ttl and ahora - fila[1] > self.ttl):
+                if not similar:
+                    self.fallos += 1
+                return None
+            self.conexion.execute("UPDATE respuestas SET accedido = ? WHERE clave = ?", (ahora, clave))
+            self.conexion.commit()
+            self.aciertos += 1
+            if similar:
+                self.fallos -= 1
+                self.semanticos += 1
+            return fila[0]
+
+    def guardar(self, clave, modelo, texto):
+        ahora = time.time()
+        tamano = len(texto.encode('utf-8'))
+        with self.lock:
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, modelo, texto, tamano, creado, accedido) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (clave, modelo, texto, tamano, ahora, ahora))
+            self._expulsar(ahora)
+            self.conexion.commit()
+
+    def _expulsar(self, ahora):
+        # Primero las entradas caducadas, luego las menos usadas hasta respetar los límites
+        if self.ttl:
+            self.conexion.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl,))
+
+        entradas, total = self.conexion.execute(
+            "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()
+        if entradas <= self.max_entradas and total <= self.max_bytes:
+            return
+
+        sobrantes = []
+        cursor = self.conexion.execute("SELECT clave, tamano FROM respuestas ORDER BY accedido ASC")
+        for clave, tamano in cursor:
+            if entradas <= self.max_entradas and total <= self.max_bytes:
+                break
+            sobrantes.append((clave,))
+            entradas -= 1
+            total -= tamano
+        self.conexion.executemany("DELETE FROM respuestas WHERE clave = ?", sobrantes)
+
+    def estadisticas(self):
+        with self.lock:
+            entradas, total = self.conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "semanticos": self.semanticos,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos / consultas) if consultas else 0.0,
+            "entradas": entradas,
+            "bytes": total
+        }
+
+    def limpiar(self):
+        with self.lock:
+            self.conexion.execute("DELETE FROM respuestas")
+            self.conexion.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache():
+    """Devuelve la caché compartida del proceso, configurada con las variables CACHE_* del entorno"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheRespuestas(
+                    ruta=os.getenv('CACHE_RUTA', str(cache_path)),
+                    ttl=float(os.getenv('CACHE_TTL', 7 * 24 * 3600)),
+                    max_entradas=int(os.getenv('CACHE_MAX_ENTRADAS', 5000)),
+                    max_bytes=int(float(os.getenv('CACHE_MAX_MB', 100)) * 1024 * 1024)
+                )
+    return _cache
@@ -0,0 +1,414 @@
+import os
+import re
+import json
+import time
+import hashlib
+import array
+import threading
+from sentimiento import normalizar
+
+# Palabras que no cambian la pregunta: "¿qué es X?", "explícame X" y "dime qué es X" quedan en "X".
+# Las negaciones, los números y los interrogativos que cambian la pregunta (quién, cómo, cuál, dónde...) se conservan
+PALABRAS_VACIAS = {
+    "que", "es", "son", "era", "fue", "ser", "esta", "estan",
+    "el", "la", "los", "las", "lo", "un", "una", "unos", "unas", "de", "del", "al", "a", "en", "y", "e", "o",
+    "u", "por", "para", "con", "sobre", "acerca", "se", "me", "te", "nos", "le", "les", "mi", "tu", "su",
+    "sus", "favor", "porfa", "explica", "explicame", "explicanos", "explicar", "dime", "dinos", "decir",
+    "define", "definicion", "definir", "significa", "significado", "describe", "describeme", "cuentame",
+    "hablame", "puedes", "podrias", "quiero", "quisiera", "saber", "conocer", "sabes", "oraculo",
+    "what", "is", "are", "the", "of", "an", "explain", "tell", "about", "please"
+}
+
+# Interrogativos de dos palabras: se unen antes de quitar las vacías ("por", "para" y "que" lo son
+# por separado) para que "¿por qué es azul?" no sea lo mismo que "¿es azul?"
+INTERROGATIVOS_COMPUESTOS = {("por", "que"): "por_que", ("para", "que"): "para_que"}
+
+
+def consulta_de(contenido):
+    """Texto de una pregunta apta para la caché semántica, o None.
+
+    Solo lo son las preguntas de texto sin historial: con imágenes o con turnos anteriores la misma
+    frase puede necesitar otra respuesta.
+    """
+    if isinstance(contenido, str):
+        return contenido
+    partes = contenido
+    if len(partes) == 1 and isinstance(partes[0], dict) and "parts" in partes[0]:
+        if partes[0].get("role", "user") != "user":
+            return None
+        partes = partes[0]["parts"]
+        partes = [partes] if isinstance(partes, str) else partes
+    if not partes or not all(isinstance(parte, str) for parte in partes):
+        return None
+    return "\n".join(partes)
+
+
+class VectorizadorHash:
+    """Embeddings locales sin dependencias: palabras con significado y pares de palabras seguidas,
+    repartidos en `dimension` posiciones con signo por hashing y normalizados (coseno = producto).
+
+    El espacio es enorme (2^31) para que dos temas distintos casi nunca caigan en la misma posición:
+    una pregunta de un solo tema ("¿qué es X?") se reduce a un único rasgo y una colisión la haría
+    idéntica a otra. Los vectores son dispersos, así que el tamaño no cuesta memoria.
+    """
+
+    def __init__(self, dimension=2 ** 31):
+        self.dimension = dimension
+        self.nombre = f"hash-{dimension}"
+
+    @staticmethod
+    def palabras(texto):
+        palabras = []
+        tokens = re.findall(r"\w+", normalizar(texto))
+        unidos = []
+        for token in tokens:
+            compuesto = INTERROGATIVOS_COMPUESTOS.get((unidos[-1], token)) if unidos else None
+            if compuesto:
+                unidos[-1] = compuesto
+            else:
+                unidos.append(token)
+        for palabra in unidos:
+            if palabra in PALABRAS_VACIAS:
+                continue
+            # Plurales simples: "agujeros negros" = "agujero negro"
+            if len(palabra) > 3 and palabra.endswith("s") and not palabra.isdigit():
+                palabra = palabra[:-1]
+            palabras.append(palabra)
+        return palabras
+
+    def _sumar(self, vector, rasgo, peso):
+        # 64 bits: los de abajo dan la posición y el más alto el signo
+        h = int.from_bytes(hashlib.blake2b(rasgo.encode('utf-8'), digest_size=8).digest(), 'little')
+        indice = h % self.dimension
+        vector[indice] = vector.get(indice, 0.0) + (peso if h >> 63 else -peso)
+
+    def vectorizar(self, texto):
+        """Vector disperso {posición: valor} de norma 1, o None si no queda ninguna palabra con significado"""
+        palabras = self.palabras(texto)
+        vector = {}
+        for palabra in palabras:
+            self._sumar(vector, "p:" + palabra, 1.0)
+        # Los pares distinguen "el perro muerde al hombre" de "el hombre muerde al perro"
+        for anterior, siguiente in zip(palabras, palabras[1:]):
+            self._sumar(vector, "b:" + anterior + " " + siguiente, 0.5)
+        return _normalizar_vector(vector)
+
+
+class VectorizadorFrases:
+    """Embeddings de un modelo local de sentence-transformers (multilingüe por defecto)"""
+
+    def __init__(self, nombre_modelo=None):
+        # Importación diferida: sentence-transformers es una dependencia opcional
+        from sentence_transformers import SentenceTransformer
+        nombre_modelo = nombre_modelo or os.getenv('CACHE_SEMANTICA_MODELO',
+                                                   'paraphrase-multilingual-MiniLM-L12-v2')
+        self.modelo = SentenceTransformer(nombre_modelo)
+        self.dimension = self.modelo.get_sentence_embedding_dimension()
+        self.nombre = f"st-{nombre_modelo}"
+
+    def vectorizar(self, texto):
+        if not texto.strip():
+            return None
+        valores = self.modelo.encode(texto, normalize_embeddings=True)
+        return {indice: float(valor) for indice, valor in enumerate(valores)}
+
+
+def _normalizar_vector(vector):
+    norma = sum(valor * valor for valor in vector.values()) ** 0.5
+    if not norma:
+        return None
+    return {indice: valor / norma for indice, valor in vector.items()}
+
+
+# Backends de embeddings; se elige con CACHE_SEMANTICA_BACKEND en .env/config.env
+VECTORIZADORES = {
+    "hash": VectorizadorHash,
+    "sentence-transformers": VectorizadorFrases
+}
+
+
+def registrar_vectorizador(nombre, fabrica):
+    """Añade un backend; la fábrica debe devolver un objeto con nombre, dimension y vectorizar(texto)"""
+    VECTORIZADORES[nombre] = fabrica
+
+
+def crear_vectorizador(nombre=None):
+    """Crea el vectorizador configurado, usando el de hashing si el elegido no está disponible"""
+    nombre = nombre or os.getenv('CACHE_SEMANTICA_BACKEND', 'hash')
+    try:
+        return VECTORIZADORES[nombre]()
+    except Exception as e:
+        print(f"Error al crear el vectorizador '{nombre}', usando el de hashing: {str(e)}")
+        return VectorizadorHash()
+
+
+# Por encima de esta dimensión los vectores se consideran dispersos (hashing) y no caben en una matriz
+MAX_DIMENSION_DENSA = 4096
+
+
+class IndiceVectorial:
+    """Vectores normalizados de un ámbito y búsqueda del más parecido por producto escalar.
+
+    Los vectores densos de pocas dimensiones (sentence-transformers) se guardan con NumPy en una
+    matriz float32 que crece por duplicación (una sola multiplicación por búsqueda). Los dispersos
+    del hashing, o todos si no hay NumPy, van en un índice invertido {posición: {clave: valor}}:
+    cada búsqueda solo recorre las preguntas que comparten algún rasgo con la consulta.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.claves = []
+        self.filas = {}
+        self.np = None
+        if dimension <= MAX_DIMENSION_DENSA:
+            try:
+                import numpy
+                self.np = numpy
+                self.matriz = numpy.zeros((16, dimension), dtype=numpy.float32)
+            except ImportError:
+                pass
+        if self.np is None:
+            self.vectores = {}
+            self.invertido = {}
+
+    def __len__(self):
+        return len(self.claves) if self.np is not None else len(self.vectores)
+
+    def _denso(self, vector):
+        denso = self.np.zeros(self.dimension, dtype=self.np.float32)
+        denso[list(vector)] = list(vector.values())
+        return denso
+
+    def agregar(self, clave, vector):
+        if self.np is None:
+            self._quitar_disperso(clave)
+            self.vectores[clave] = vector
+            for indice, valor in vector.items():
+                self.invertido.setdefault(indice, {})[clave] = valor
+            return
+        fila = self.filas.get(clave)
+        if fila is None:
+            fila = len(self.claves)
+            self.claves.append(clave)
+            self.filas[clave] = fila
+            if fila >= len(self.matriz):
+                matriz = self.np.zeros((2 * len(self.matriz), self.dimension), dtype=self.np.float32)
+                matriz[:fila] = self.matriz[:fila]
+                self.matriz = matriz
+        self.matriz[fila] = self._denso(vector)
+
+    def _quitar_disperso(self, clave):
+        vector = self.vectores.pop(clave, None)
+        if vector is None:
+            return
+        for indice in vector:
+            claves = self.invertido[indice]
+            del claves[clave]
+            if not claves:
+                del self.invertido[indice]
+
+    def quitar(self, clave):
+        if self.np is None:
+            self._quitar_disperso(clave)
+            return
+        # La última fila ocupa el hueco para mantener la matriz compacta
+        fila = self.filas.pop(clave, None)
+        if fila is None:
+            return
+        ultima = len(self.claves) - 1
+        if fila != ultima:
+            self.claves[fila] = self.claves[ultima]
+            self.filas[self.claves[fila]] = fila
+            self.matriz[fila] = self.matriz[ultima]
+        self.claves.pop()
+
+    def buscar(self, vector):
+        """Devuelve (clave, similitud) del vector más parecido, o None si ninguno comparte rasgos con él"""
+        if self.np is not None:
+            if not self.claves:
+                return None
+            similitudes = self.matriz[:len(self.claves)] @ self._denso(vector)
+            fila = int(similitudes.argmax())
+            return self.claves[fila], float(similitudes[fila])
+        productos = {}
+        for indice, valor in vector.items():
+            for clave, otro in self.invertido.get(indice, {}).items():
+                productos[clave] = productos.get(clave, 0.0) + valor * otro
+        if not productos:
+            return None
+        clave = max(productos, key=productos.get)
+        return clave, productos[clave]
+
+
+def _empaquetar(vector):
+    # Índices uint32 seguidos de valores float32
+    return array.array('I', vector.keys()).tobytes() + array.array('f', vector.values()).tobytes()
+
+
+def _desempaquetar(datos):
+    mitad = len(datos) // 2
+    indices = array.array('I')
+    indices.frombytes(datos[:mitad])
+    valores = array.array('f')
+    valores.frombytes(datos[mitad:])
+    return dict(zip(indices, valores))
+
+
+class Consulta:
+    """Pregunta ya vectorizada: se calcula una vez al buscar y se reutiliza al guardar la respuesta"""
+
+    def __init__(self, ambito, vector):
+        self.ambito = ambito
+        self.vector = vector
+
+
+class CacheSemantica:
+    """Capa delante de la caché exacta que reconoce preguntas parecidas por similitud de embeddings.
+
+    Solo guarda vectores y la clave de la respuesta en la caché exacta, así que caducidad y expulsión
+    de los textos siguen siendo las de CacheRespuestas. Con ambito="modelo" cada modelo (y
+    configuración de generación) tiene su propio índice; con "global" se comparten respuestas.
+    """
+
+    def __init__(self, cache, vectorizador=None, umbral=0.9, max_entradas=5000, ambito="modelo"):
+        self.cache = cache
+        self.vectorizador = vectorizador
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.ambito = ambito
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.accesos = {}
+        self.cargado = False
+
+        with self.cache.lock:
+            self.cache.conexion.execute("""
+                CREATE TABLE IF NOT EXISTS semantica (
+                    clave TEXT PRIMARY KEY,
+                    ambito TEXT NOT NULL,
+                    vectorizador TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    accedido REAL NOT NULL
+                )""")
+            self.cache.conexion.commit()
+
+    def _cargar(self):
+        # El vectorizador (quizá un modelo pesado) y el índice se preparan en la primera consulta
+        if self.vectorizador is None:
+            self.vectorizador = crear_vectorizador()
+        with self.cache.lock:
+            # Los vectores de otro vectorizador no son comparables con los nuevos
+            self.cache.conexion.execute("DELETE FROM semantica WHERE vectorizador != ?", (self.vectorizador.nombre,))
+            self.cache.conexion.commit()
+            filas = self.cache.conexion.execute(
+                "SELECT clave, ambito, vector, accedido FROM semantica WHERE vectorizador = ?",
+                (self.vectorizador.nombre,)).fetchall()
+        for clave, ambito, vector, accedido in filas:
+            self._indice(ambito).agregar(clave, _desempaquetar(vector))
+            self.accesos[clave] = (ambito, accedido)
+        self.cargado = True
+
+    def _indice(self, ambito):
+        indice = self.indices.get(ambito)
+        if indice is None:
+            indice = self.indices[ambito] = IndiceVectorial(self.vectorizador.dimension)
+        return indice
+
+    def preparar(self, modelo, contenido, generation_config=None):
+        """Consulta para buscar y guardar, o None si la pregunta no es apta (imágenes, historial...)"""
+        texto = consulta_de(contenido)
+        if texto is None:
+            return None
+        with self.lock:
+            if not self.cargado:
+                self._cargar()
+        vector = self.vectorizador.vectorizar(texto)
+        if vector is None:
+            return None
+        ambito = json.dumps([modelo if self.ambito == "modelo" else "", generation_config],
+                            sort_keys=True, default=str)
+        return Consulta(ambito, vector)
+
+    def buscar(self, consulta):
+        """Devuelve (texto, similitud) de la respuesta a la pregunta más parecida, o None por debajo del umbral"""
+        with self.lock:
+            indice = self.indices.get(consulta.ambito)
+            encontrado = indice.buscar(consulta.vector) if indice is not None else None
+        if encontrado is None or encontrado[1] < self.umbral:
+            return None
+        clave, similitud = encontrado
+        texto = self.cache.obtener(clave, similar=True)
+        if texto is None:
+            # La respuesta caducó o se expulsó de la caché exacta
+            self.quitar([clave])
+            return None
+        ahora = time.time()
+        with self.lock:
+            if clave in self.accesos:
+                self.accesos[clave] = (consulta.ambito, ahora)
+        with self.cache.lock:
+            self.cache.conexion.execute("UPDATE semantica SET accedido = ? WHERE clave = ?", (ahora, clave))
+            self.cache.conexion.commit()
+        return texto, similitud
+
+    def guardar(self, consulta, clave):
+        """Indexa la pregunta con la clave de su respuesta en la caché exacta"""
+        ahora = time.time()
+        with self.lock:
+            self._indice(consulta.ambito).agregar(clave, consulta.vector)
+            self.accesos[clave] = (consulta.ambito, ahora)
+            sobrantes = self._sobrantes()
+        with self.cache.lock:
+            self.cache.conexion.execute(
+                "INSERT OR REPLACE INTO semantica (clave, ambito, vectorizador, vector, accedido) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (clave, consulta.ambito, self.vectorizador.nombre, _empaquetar(consulta.vector), ahora))
+            self.cache.conexion.commit()
+        if sobrantes:
+            self.quitar(sobrantes)
+
+    def _sobrantes(self):
+        # Al pasarse del límite se expulsa de golpe el 10% menos usado, para no ordenar en cada inserción
+        if len(self.accesos) <= self.max_entradas:
+            return []
+        exceso = len(self.accesos) - self.max_entradas + max(1, self.max_entradas // 10)
+        return sorted(self.accesos, key=lambda clave: self.accesos[clave][1])[:exceso]
+
+    def quitar(self, claves):
+        with self.lock:
+            for clave in claves:
+                ambito, _ = self.accesos.pop(clave, (None, None))
+                if ambito in self.indices:
+                    self.indices[ambito].quitar(clave)
+        with self.cache.lock:
+            self.cache.conexion.executemany("DELETE FROM semantica WHERE clave = ?", [(c,) for c in claves])
+            self.cache.conexion.commit()
+
+    def limpiar(self):
+        with self.lock:
+            self.indices = {}
+            self.accesos = {}
+        with self.cache.lock:
+            self.cache.conexion.execute("DELETE FROM semantica")
+            self.cache.conexion.commit()
+
+
+_semantica = None
+_semantica_lock = threading.Lock()
+
+
+def obtener_cache_semantica():
+    """Devuelve la caché semántica compartida del proceso, o None si CACHE_SEMANTICA=0"""
+    global _semantica
+    if os.getenv('CACHE_SEMANTICA', '1') == '0':
+        return None
+    if _semantica is None:
+        with _semantica_lock:
+            if _semantica is None:
+                from cache_respuestas import obtener_cache
+                _semantica = CacheSemantica(
+                    obtener_cache(),
+                    umbral=float(os.getenv('CACHE_SEMANTICA_UMBRAL', 0.9)),
+                    max_entradas=int(os.getenv('CACHE_SEMANTICA_MAX', 5000)),
+                    ambito=os.getenv('CACHE_SEMANTICA_AMBITO', 'modelo'))
+    return _semantica
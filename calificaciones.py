@@ -0,0 +1,200 @@
+import os
+import csv
+import json
+import time
+import pathlib
+import threading
+
+# Registro de calificaciones (una línea JSON por cambio) y resumen con los agregados ya calculados
+calificaciones_path = pathlib.Path('.') / '.cache' / 'calificaciones.jsonl'
+
+# Dimensiones por las que se agregan las calificaciones
+DIMENSIONES = ("modelo", "sentimiento", "dia")
+SIN_SENTIMIENTO = "SIN CLASIFICAR"
+
+
+def satisfaccion(likes, dislikes):
+    """Porcentaje de calificaciones positivas, o None si no hay ninguna"""
+    total = likes + dislikes
+    return likes / total * 100 if total else None
+
+
+class RegistroCalificaciones:
+    """Calificaciones de las respuestas en un registro en disco con agregados incrementales.
+
+    Cada cambio se añade al registro como {"t", "c" (respuesta), "v" (1/0), "m", "s", "d"} y, si
+    sustituye a otra calificación, con "a" = [valor, modelo, sentimiento, día] de la anterior; así
+    cada línea basta para actualizar los totales por modelo, por sentimiento y por día. El resumen
+    guarda los totales y hasta qué byte del registro incluyen: al abrir solo se leen las líneas
+    posteriores, nunca el historial completo.
+    """
+
+    def __init__(self, ruta=calificaciones_path, cada=10):
+        self.ruta = pathlib.Path(ruta)
+        self.ruta_resumen = pathlib.Path(str(ruta) + ".resumen.json")
+        # Cambios entre una escritura del resumen y la siguiente
+        self.cada = cada
+        self.lock = threading.Lock()
+        self.totales = [0, 0]
+        self.agregados = {dimension: {} for dimension in DIMENSIONES}
+        self.posicion = 0
+        self.pendientes = 0
+        # Calificación vigente de las respuestas calificadas en esta ejecución
+        self.activas = {}
+        self._cargar()
+
+    def _cargar(self):
+        try:
+            with open(self.ruta_resumen, encoding='utf-8') as f:
+                resumen = json.load(f)
+            self.totales = resumen["totales"]
+            self.agregados = {dimension: resumen["agregados"][dimension] for dimension in DIMENSIONES}
+            self.posicion = resumen["posicion"]
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            tamano = self.ruta.stat().st_size
+        except OSError:
+            tamano = 0
+        if tamano < self.posicion:
+            # El registro se borró o se sustituyó: el resumen ya no le corresponde
+            self.totales = [0, 0]
+            self.agregados = {dimension: {} for dimension in DIMENSIONES}
+            self.posicion = 0
+        if tamano == self.posicion:
+            return
+
+        with open(self.ruta, 'rb') as f:
+            f.seek(self.posicion)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                try:
+                    self._aplicar(json.loads(linea))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Error en el registro de calificaciones: {str(e)}")
+                self.posicion += len(linea)
+        if self.posicion < tamano:
+            # Última línea a medio escribir (cierre inesperado): se descarta para poder seguir añadiendo
+            with open(self.ruta, 'r+b') as f:
+                f.truncate(self.posicion)
+        self._guardar_resumen()
+
+    def _sumar(self, valor, modelo, sentimiento, dia, signo):
+        indice = 0 if valor else 1
+        self.totales[indice] += signo
+        for dimension, clave in zip(DIMENSIONES, (modelo, sentimiento, dia)):
+            contadores = self.agregados[dimension].setdefault(clave, [0, 0])
+            contadores[indice] += signo
+            # Un grupo que se queda vacío (p. ej. "sin clasificar" al llegar el sentimiento) desaparece
+            if contadores == [0, 0]:
+                del self.agregados[dimension][clave]
+
+    def _aplicar(self, evento):
+        if evento.get("a"):
+            self._sumar(*evento["a"], -1)
+        self._sumar(evento["v"], evento["m"], evento["s"], evento["d"], 1)
+
+    def calificar(self, respuesta, modelo, positiva, sentimiento=None):
+        """Registra la calificación de una respuesta (o su cambio) y actualiza los agregados.
+
+        respuesta identifica la respuesta; volver a llamar con otro valor o sentimiento la cambia de grupo.
+        """
+        ahora = time.time()
+        sentimiento = sentimiento or SIN_SENTIMIENTO
+        with self.lock:
+            anterior = self.activas.get(respuesta)
+            # El día es el de la primera calificación: los cambios no la mueven de día
+            dia = anterior[3] if anterior else time.strftime("%Y-%m-%d", time.localtime(ahora))
+            actual = [int(positiva), modelo, sentimiento, dia]
+            if actual == anterior:
+                return
+            evento = {"t": round(ahora, 3), "c": respuesta, "v": actual[0], "m": modelo, "s": sentimiento, "d": dia}
+            if anterior:
+                evento["a"] = anterior
+            linea = (json.dumps(evento, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+            try:
+                self.ruta.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.ruta, 'ab') as f:
+                    f.write(linea)
+            except OSError as e:
+                print(f"Error al guardar la calificación: {str(e)}")
+                return
+            self.posicion += len(linea)
+            self._aplicar(evento)
+            self.activas[respuesta] = actual
+            self.pendientes += 1
+            if self.pendientes >= self.cada:
+                self._guardar_resumen()
+
+    def reclasificar(self, respuesta, sentimiento):
+        """Mueve una respuesta ya calificada en esta ejecución al sentimiento que llegó después"""
+        with self.lock:
+            anterior = self.activas.get(respuesta)
+        if anterior is not None:
+            self.calificar(respuesta, anterior[1], anterior[0], sentimiento)
+
+    def _guardar_resumen(self):
+        try:
+            self.ruta_resumen.parent.mkdir(parents=True, exist_ok=True)
+            temporal = str(self.ruta_resumen) + ".tmp"
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump({"posicion": self.posicion, "totales": self.totales, "agregados": self.agregados},
+                          f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temporal, self.ruta_resumen)
+            self.pendientes = 0
+        except OSError as e:
+            print(f"Error al guardar el resumen de calificaciones: {str(e)}")
+
+    def resumen(self, modelo=None):
+        """Likes, dislikes y satisfacción en total o de un modelo, sin recorrer el registro"""
+        with self.lock:
+            likes, dislikes = self.totales if modelo is None else self.agregados["modelo"].get(modelo, [0, 0])
+        return {"likes": likes, "dislikes": dislikes, "satisfaccion": satisfaccion(likes, dislikes)}
+
+    def por(self, dimension, ultimos=None):
+        """{clave: resumen} de una dimensión; con ultimos, solo las últimas claves en orden (p. ej. días)"""
+        with self.lock:
+            agregados = {clave: list(contadores) for clave, contadores in self.agregados[dimension].items()}
+        claves = sorted(agregados)[-ultimos:] if ultimos else sorted(agregados)
+        return {clave: {"likes": agregados[clave][0], "dislikes": agregados[clave][1],
+                        "satisfaccion": satisfaccion(*agregados[clave])} for clave in claves}
+
+    def exportar(self, ruta):
+        """Exporta los agregados a .json (estructura completa) o .csv (dimensión, clave, likes, dislikes, %)"""
+        datos = {"totales": self.resumen()}
+        for dimension in DIMENSIONES:
+            datos[dimension] = self.por(dimension)
+        if str(ruta).lower().endswith(".json"):
+            with open(ruta, 'w', encoding='utf-8') as f:
+                json.dump(datos, f, ensure_ascii=False, indent=1)
+            return
+        with open(ruta, 'w', encoding='utf-8', newline='') as f:
+            escritor = csv.writer(f)
+            escritor.writerow(["dimension", "clave", "likes", "dislikes", "satisfaccion"])
+            filas = [("total", "", datos["totales"])]
+            filas += [(dimension, clave, valores) for dimension in DIMENSIONES
+                      for clave, valores in datos[dimension].items()]
+            for dimension, clave, valores in filas:
+                porcentaje = valores["satisfaccion"]
+                escritor.writerow([dimension, clave, valores["likes"], valores["dislikes"],
+                                   f"{porcentaje:.1f}" if porcentaje is not None else ""])
+
+    def cerrar(self):
+        with self.lock:
+            if self.pendientes:
+                self._guardar_resumen()
+
+
+_calificaciones = None
+_calificaciones_lock = threading.Lock()
+
+
+def obtener_calificaciones():
+    """Devuelve el registro de calificaciones compartido del proceso, en CALIFICACIONES_RUTA si está definida"""
+    global _calificaciones
+    if _calificaciones is None:
+        with _calificaciones_lock:
+            if _calificaciones is None:
+                _calificaciones = RegistroCalificaciones(os.getenv('CALIFICACIONES_RUTA', str(calificaciones_path)))
+    return _calificaciones
@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import time
+import pathlib
+import threading
+
+# Archivo donde se guarda la última lista de modelos descargada
+catalogo_path = pathlib.Path('.') / '.cache' / 'modelos.json'
+
+# La API no dice qué modelos aceptan imágenes: todos los Gemini desde la 1.5 son multimodales
+PATRON_VISION = re.compile(r"^gemini-(1\.5|[2-9])|vision")
+
+# Modelos que se ofrecen mientras no hay catálogo (primer arranque sin red) y que van primero en la lista
+MODELOS_POR_DEFECTO = [
+    {"nombre": "gemini-2.0-flash", "vision": True, "tokens_entrada": 1048576, "tokens_salida": 8192,
+     "streaming": True},
+    {"nombre": "gemini-2.5-flash", "vision": True, "tokens_entrada": 1048576, "tokens_salida": 65536,
+     "streaming": True},
+    {"nombre": "gemini-2.5-pro", "vision": True, "tokens_entrada": 1048576, "tokens_salida": 65536,
+     "streaming": True},
+    {"nombre": "gemini-2.0-flash-lite", "vision": True, "tokens_entrada": 1048576, "tokens_salida": 8192,
+     "streaming": True}
+]
+
+
+def describir_modelo(modelo):
+    """Capacidades de un modelo de genai.list_models() como diccionario serializable"""
+    nombre = modelo.name.split("/", 1)[-1]
+    metodos = list(getattr(modelo, 'supported_generation_methods', None) or [])
+    return {
+        "nombre": nombre,
+        "vision": bool(PATRON_VISION.search(nombre)),
+        "tokens_entrada": getattr(modelo, 'input_token_limit', None),
+        "tokens_salida": getattr(modelo, 'output_token_limit', None),
+        "streaming": "generateContent" in metodos or "streamGenerateContent" in metodos
+    }
+
+
+def descargar_modelos():
+    """Consulta la API y devuelve los modelos que generan texto (sin embeddings ni otros servicios)"""
+    from cliente import configurar
+    configurar()
+    import google.generativeai as genai
+    return [describir_modelo(modelo) for modelo in genai.list_models()
+            if "generateContent" in (getattr(modelo, 'supported_generation_methods', None) or [])]
+
+
+def _ordenar(modelos):
+    # Los modelos por defecto primero y en su orden; el resto por nombre
+    preferidos = [m["nombre"] for m in MODELOS_POR_DEFECTO]
+    return sorted(modelos, key=lambda m: (preferidos.index(m["nombre"]) if m["nombre"] in preferidos
+                                          else len(preferidos), m["nombre"]))
+
+
+class CatalogoModelos:
+    """Modelos disponibles con sus capacidades, guardados en disco y refrescados en segundo plano.
+
+    Un catálogo caducado se sigue usando hasta que llega el nuevo, así que nunca se espera a la red
+    para mostrar la lista.
+    """
+
+    def __init__(self, ruta=catalogo_path, ttl=24 * 3600):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.modelos = {m["nombre"]: m for m in MODELOS_POR_DEFECTO}
+        self.actualizado = 0
+        self.hilo = None
+        self._leer()
+
+    def _leer(self):
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            modelos = datos["modelos"]
+        except (OSError, ValueError, KeyError):
+            return
+        if modelos:
+            self.modelos = {m["nombre"]: m for m in _ordenar(modelos)}
+            self.actualizado = datos.get("actualizado", 0)
+
+    def _guardar(self):
+        try:
+            pathlib.Path(self.ruta).parent.mkdir(parents=True, exist_ok=True)
+            temporal = str(self.ruta) + ".tmp"
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump({"actualizado": self.actualizado, "modelos": list(self.modelos.values())},
+                          f, ensure_ascii=False, indent=1)
+            os.replace(temporal, self.ruta)
+        except OSError as e:
+            print(f"Error al guardar el catálogo de modelos: {str(e)}")
+
+    def caducado(self):
+        return time.time() - self.actualizado > self.ttl
+
+    def refrescar(self, forzar=False, al_terminar=None):
+        """Descarga la lista en un hilo si caducó (o si se fuerza) y devuelve el hilo, o None si está al día.
+
+        al_terminar(error) se llama desde ese hilo, con None si el catálogo se actualizó.
+        """
+        with self.lock:
+            if not forzar and not self.caducado():
+                return None
+            if self.hilo is not None and self.hilo.is_alive():
+                return self.hilo
+            self.hilo = threading.Thread(target=self._descargar, args=(al_terminar,),
+                                         name="catalogo-modelos", daemon=True)
+            self.hilo.start()
+            return self.hilo
+
+    def _descargar(self, al_terminar):
+        error = None
+        try:
+            modelos = descargar_modelos()
+            if not modelos:
+                raise ValueError("la API no devolvió ningún modelo")
+            with self.lock:
+                self.modelos = {m["nombre"]: m for m in _ordenar(modelos)}
+                self.actualizado = time.time()
+                self._guardar()
+        except Exception as e:
+            error = e
+            print(f"Error al actualizar el catálogo de modelos: {str(e)}")
+        if al_terminar is not None:
+            al_terminar(error)
+
+    def nombres(self, vision=None):
+        """Nombres de los modelos; con vision=True solo los que aceptan imágenes"""
+        with self.lock:
+            return [nombre for nombre, modelo in self.modelos.items()
+                    if vision is None or modelo["vision"] == vision]
+
+    def info(self, nombre):
+        with self.lock:
+            return self.modelos.get(nombre)
+
+    def admite_imagenes(self, nombre):
+        # Un modelo fuera del catálogo (p. ej. escrito a mano) se juzga por su nombre
+        modelo = self.info(nombre)
+        return modelo["vision"] if modelo is not None else bool(PATRON_VISION.search(nombre))
+
+    def modelo_para_imagenes(self, nombre):
+        """El propio modelo si acepta imágenes; si no, el primero del catálogo que las acepte (o None)"""
+        if self.admite_imagenes(nombre):
+            return nombre
+        candidatos = self.nombres(vision=True)
+        return candidatos[0] if candidatos else None
+
+
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+
+def obtener_catalogo():
+    """Devuelve el catálogo compartido del proceso, en CATALOGO_RUTA y con CATALOGO_TTL si están definidas"""
+    global _catalogo
+    if _catalogo is None:
+        with _catalogo_lock:
+            if _catalogo is None:
+                _catalogo = CatalogoModelos(os.getenv('CATALOGO_RUTA', str(catalogo_path)),
+                                            int(os.getenv('CATALOGO_TTL', 24 * 3600)))
+    return _catalogo
@@ -1,21 +1,21 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-import pathlib
+from cliente import cargar_entorno, precalentar
+from conversacion import Conversacion
+from historial import SesionHistorial
 import tkinter as tk
 from tkinter import ttk
 from tkinter import scrolledtext
 import threading
+import queue
+import time
 
-# Cargar variables de entorno
-env_path = pathlib.Path('.') / '.env' / 'config.env'
-load_dotenv(env_path)
+# Cargar variables de entorno; el SDK se importa en segundo plano tras abrir la ventana
+cargar_entorno()
 
-# Configurar la API key
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Modelo de chat
+MODELO_CHAT = 'gemini-2.0-flash'
 
-# Crear modelo de chat
-chat_model = genai.GenerativeModel('gemini-2.0-flash')
+# Intervalo (ms) con el que se vuelcan los fragmentos recibidos en el área de respuesta
+INTERVALO_STREAM_MS = 50
 
 class OracleGUI:
     def __init__(self, root):
@@ -23,6 +23,18 @@ class OracleGUI:
         self.root.title("🔮 Oráculo de Gemini")
         self.root.geometry("600x400")
         
+        # Conversación multi-turno: cada pregunta lleva el contexto de las anteriores
+        self.conversacion = Conversacion(MODELO_CHAT)
+        
+        # Historial persistente de los turnos de esta ventana
+        self.sesion = SesionHistorial("chat")
+        self.inicio_pregunta = None
+        
+        # Variables para el streaming de respuestas
+        self.cola_stream = queue.Queue()
+        self.after_stream = None
+        self.texto_mostrado = ""
+        
         # Estilo
         style = ttk.Style()
         style.configure("Custom.TButton", padding=5)
@@ -41,10 +53,15 @@ class OracleGUI:
                                     command=self.hacer_pregunta, style="Custom.TButton")
         self.enviar_btn.grid(row=1, column=2, padx=5, pady=5)
         
+        # Botón para empezar una conversación nueva
+        self.nueva_btn = ttk.Button(main_frame, text="🆕", 
+                                   command=self.nueva_conversacion, style="Custom.TButton")
+        self.nueva_btn.grid(row=1, column=3, padx=5, pady=5)
+        
         # Área de respuesta
         ttk.Label(main_frame, text="Respuesta:").grid(row=2, column=0, sticky="w", pady=5)
         self.respuesta_text = scrolledtext.ScrolledText(main_frame, width=60, height=15, wrap=tk.WORD)
-        self.respuesta_text.grid(row=3, column=0, columnspan=3, sticky="ew", pady=5)
+        self.respuesta_text.grid(row=3, column=0, columnspan=4, sticky="ew", pady=5)
         
         # Configurar el evento Enter
         self.pregunta_entry.bind('<Return>', lambda e: self.hacer_pregunta())
@@ -59,10 +76,9 @@ class OracleGUI:
         self.respuesta_text.insert(tk.END, "Haz tus preguntas y obtén respuestas instantáneas.\n\n")
         self.respuesta_text.configure(state='disabled')
 
-    def obtener_respuesta(self, prompt):
+    def obtener_respuesta(self, prompt, al_recibir=None):
         try:
-            response = chat_model.generate_content(prompt)
-            return response.text
+            return self.conversacion.preguntar(prompt, al_recibir=al_recibir, medicion={"origen": "chat"})
         except Exception as e:
             return f"Error al generar respuesta: {str(e)}"
 
@@ -79,11 +95,19 @@ class OracleGUI:
         
         # Mostrar la pregunta en el área de respuesta
         self.respuesta_text.insert(tk.END, f"\n❓ Tú: {pregunta}\n")
+        self.respuesta_text.insert(tk.END, "\n🤖 Gemini: ")
         self.respuesta_text.see(tk.END)
         
+        self.sesion.agregar("usuario", pregunta, modelo=MODELO_CHAT)
+        self.inicio_pregunta = time.perf_counter()
+        
+        # Volcar periódicamente los fragmentos que vayan llegando
+        self.texto_mostrado = ""
+        self.after_stream = self.root.after(INTERVALO_STREAM_MS, self.vaciar_stream)
+        
         # Función para procesar la respuesta en un hilo separado
         def procesar_respuesta():
-            respuesta = self.obtener_respuesta(pregunta)
+            respuesta = self.obtener_respuesta(pregunta, self.cola_stream.put)
             
             # Actualizar la GUI en el hilo principal
             self.root.after(0, self.actualizar_respuesta, respuesta)
@@ -91,21 +115,59 @@ class OracleGUI:
         # Iniciar el procesamiento en un hilo separado
         threading.Thread(target=procesar_respuesta, daemon=True).start()
 
+    def vaciar_stream(self):
+        """Inserta de una vez los fragmentos acumulados para no saturar Tk"""
+        fragmentos = []
+        while True:
+            try:
+                fragmentos.append(self.cola_stream.get_nowait())
+            except queue.Empty:
+                break
+        
+        if fragmentos:
+            texto = "".join(fragmentos)
+            self.respuesta_text.insert(tk.END, texto)
+            self.respuesta_text.see(tk.END)
+            self.texto_mostrado += texto
+        
+        if self.after_stream is not None:
+            self.after_stream = self.root.after(INTERVALO_STREAM_MS, self.vaciar_stream)
+
     def actualizar_respuesta(self, respuesta):
-        # Mostrar la respuesta
-        self.respuesta_text.insert(tk.END, f"\n🤖 Gemini: {respuesta}\n\n")
+        # Detener el volcado periódico y mostrar lo que quede pendiente
+        if self.after_stream is not None:
+            self.root.after_cancel(self.after_stream)
+            self.after_stream = None
+        self.vaciar_stream()
+        
+        # Mostrar la respuesta (o el error) que no haya llegado por streaming
+        if respuesta.startswith(self.texto_mostrado):
+            resto = respuesta[len(self.texto_mostrado):]
+        else:
+            resto = "\n" + respuesta
+        self.respuesta_text.insert(tk.END, f"{resto}\n\n")
+        self.sesion.agregar("modelo", respuesta, modelo=MODELO_CHAT, completo=True,
+                            latencia=round(time.perf_counter() - self.inicio_pregunta, 3))
         self.respuesta_text.see(tk.END)
         
         # Limpiar y rehabilitar la entrada
-        self.pregunta_entry.delete(0, tk.END)
         self.pregunta_entry.configure(state='normal')
+        self.pregunta_entry.delete(0, tk.END)
         self.enviar_btn.configure(state='normal')
         self.respuesta_text.configure(state='disabled')
         self.pregunta_entry.focus()
 
+    def nueva_conversacion(self):
+        self.conversacion = Conversacion(MODELO_CHAT)
+        self.respuesta_text.configure(state='normal')
+        self.respuesta_text.insert(tk.END, "\n🆕 Nueva conversación\n\n")
+        self.respuesta_text.see(tk.END)
+        self.respuesta_text.configure(state='disabled')
+
 def main():
     root = tk.Tk()
     app = OracleGUI(root)
+    root.after_idle(precalentar, MODELO_CHAT)
     root.mainloop()
 
 if __name__ == "__main__":
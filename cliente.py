@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import pathlib
+import threading
+from collections import OrderedDict
+from cache_respuestas import obtener_cache, CacheRespuestas
+from coalescencia import Coalescedor
+from resiliencia import obtener_resiliencia
+from cache_semantica import obtener_cache_semantica
+from metricas import obtener_metricas
+
+# Ruta del archivo de variables de entorno
+env_path = pathlib.Path('.') / '.env' / 'config.env'
+
+# Registro compartido por main.py, chat.py y gui.py
+_lock = threading.RLock()
+_entorno_cargado = False
+_configurado = False
+_modelos = {}
+
+# Recuentos de tokens ya pedidos a la API: clave del contenido -> tokens
+_recuentos = OrderedDict()
+MAX_RECUENTOS = 256
+
+# Llamadas idénticas en curso (mismo modelo, prompt e imágenes) que comparten una sola petición
+_vuelos = Coalescedor()
+
+
+def cargar_entorno():
+    """Carga las variables de entorno una sola vez por proceso, sin importar el SDK"""
+    global _entorno_cargado
+    if _entorno_cargado:
+        return
+    with _lock:
+        if not _entorno_cargado:
+            from dotenv import load_dotenv
+            load_dotenv(env_path)
+            _entorno_cargado = True
+
+
+def configurar():
+    """Carga las variables de entorno y configura el SDK una sola vez por proceso"""
+    global _configurado
+    if _configurado:
+        return
+    with _lock:
+        if _configurado:
+            return
+        cargar_entorno()
+        # El SDK tarda en importarse: se carga aquí, en la primera llamada, y no al importar este módulo
+        import google.generativeai as genai
+        endpoint = os.getenv('GEMINI_API_ENDPOINT')
+        if endpoint:
+            # Endpoint alternativo (p. ej. servidor_falso.py); http:// solo funciona con el transporte REST
+            genai.configure(api_key=os.getenv('GEMINI_API_KEY') or 'local', transport='rest',
+                            client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+        _configurado = True
+
+
+def _clave_config(config):
+    # Las configuraciones son diccionarios: se serializan de forma estable para usarlas como clave
+    if config is None:
+        return None
+    if not isinstance(config, dict):
+        config = {k: v for k, v in vars(config).items() if v is not None}
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def obtener_modelo(nombre, generation_config=None):
+    """Devuelve el GenerativeModel configurado para ese nombre y configuración, creándolo solo la primera vez.
+
+    Todos los modelos comparten el cliente por defecto del SDK, así que reutilizan la conexión.
+    """
+    clave = (nombre, _clave_config(generation_config))
+    modelo = _modelos.get(clave)
+    if modelo is not None:
+        return modelo
+
+    configurar()
+    with _lock:
+        modelo = _modelos.get(clave)
+        if modelo is None:
+            import google.generativeai as genai
+            modelo = genai.GenerativeModel(nombre, generation_config=generation_config)
+            _modelos[clave] = modelo
+        return modelo
+
+
+def abrir_conexion(nombre, plazo=10):
+    """Abre (o refresca) la conexión con la API haciendo una llamada gratuita a countTokens.
+
+    Todos los GenerativeModel comparten el cliente del SDK: la conexión que queda abierta es la que usará
+    la siguiente generate_content, que así no paga el establecimiento de TLS. Devuelve el error o None.
+    """
+    try:
+        obtener_modelo(nombre).count_tokens(".", request_options={"retry": None, "timeout": plazo})
+    except Exception as e:
+        # No es un fallo del modelo: la petición real informará del error si persiste
+        print(f"Aviso: no se pudo abrir la conexión con {nombre}: {str(e)}")
+        return e
+    return None
+
+
+def precalentar(nombre=None, al_terminar=None, conectar=None):
+    """Importa y configura el SDK (y crea el modelo) en un hilo, para que la primera pregunta no espere.
+
+    al_terminar(error) se llama desde ese hilo, con None si todo fue bien, en cuanto el modelo está creado;
+    después, salvo con PRECONEXION=0, se abre la conexión con la API para ese modelo.
+    """
+    if conectar is None:
+        conectar = os.getenv('PRECONEXION', '1') != '0'
+
+    def tarea():
+        error = None
+        try:
+            if nombre:
+                obtener_modelo(nombre)
+            else:
+                configurar()
+        except Exception as e:
+            error = e
+            print(f"Error al preparar el SDK: {str(e)}")
+        if al_terminar is not None:
+            al_terminar(error)
+        if nombre and conectar and error is None:
+            abrir_conexion(nombre)
+
+    hilo = threading.Thread(target=tarea, name="precalentar-sdk", daemon=True)
+    hilo.start()
+    return hilo
+
+
+def contar_tokens(nombre_modelo, contenido, plazo=10):
+    """Tokens que ocupa el contenido en ese modelo según la API, recordando los ya contados"""
+    clave = CacheRespuestas.clave(nombre_modelo, contenido)
+    with _lock:
+        if clave in _recuentos:
+            _recuentos.move_to_end(clave)
+            return _recuentos[clave]
+    respuesta = obtener_modelo(nombre_modelo).count_tokens(contenido,
+                                                           request_options={"retry": None, "timeout": plazo})
+    with _lock:
+        _recuentos[clave] = respuesta.total_tokens
+        while len(_recuentos) > MAX_RECUENTOS:
+            _recuentos.popitem(last=False)
+    return respuesta.total_tokens
+
+
+def limpiar_modelos():
+    """Vacía el registro (útil tras cambiar la API key)"""
+    with _lock:
+        _modelos.clear()
+
+
+def _registrar_uso(response, uso):
+    # Copia los contadores de tokens que devuelve la API, si los hay
+    if uso is None:
+        return
+    metadatos = getattr(response, 'usage_metadata', None)
+    if metadatos is None:
+        return
+    uso["prompt"] = getattr(metadatos, 'prompt_token_count', 0) or 0
+    uso["respuesta"] = getattr(metadatos, 'candidates_token_count', 0) or 0
+
+
+def _generar_modelo(modelo, contenido, al_recibir=None, cancelado=None, uso=None, plazo=None):
+    # Devuelve el texto y si la respuesta llegó completa (no interrumpida)
+    # Sin los reintentos propios del SDK (hasta 600 s ante un 503): de eso se encarga resiliencia
+    opciones = {"retry": None, "timeout": plazo} if plazo else {"retry": None}
+    if al_recibir is None:
+        response = modelo.generate_content(contenido, request_options=opciones)
+        _registrar_uso(response, uso)
+        return response.text, True
+
+    partes = []
+    response = modelo.generate_content(contenido, stream=True, request_options=opciones)
+    for chunk in response:
+        if cancelado is not None and cancelado.is_set():
+            partes.append("\n⏹ Respuesta interrumpida")
+            return "".join(partes), False
+        try:
+            fragmento = chunk.text
+        except ValueError:
+            # Fragmentos sin texto (p. ej. solo con metadatos de finalización)
+            continue
+        partes.append(fragmento)
+        al_recibir(fragmento)
+    # Tras consumir el stream, la respuesta agregada trae el uso de tokens
+    _registrar_uso(response, uso)
+    return "".join(partes), True
+
+
+def generar(nombre_modelo, contenido, al_recibir=None, cancelado=None, usar_cache=True, generation_config=None,
+            uso=None, modelo=None, medicion=None, reintentar=True, similares=True):
+    """Genera la respuesta pasando por la caché persistente; con al_recibir la entrega fragmento a fragmento.
+    Si se pasa un diccionario en uso, se rellena con los tokens de prompt y respuesta que informe la API.
+    Con modelo se puede usar una instancia concreta (p. ej. con contexto cacheado) en vez del registro.
+    Cada llamada queda en las métricas con el tiempo hasta el primer fragmento, el total, los tokens,
+    si vino de la caché y la clase del error; medicion añade campos propios (origen, espera...).
+    Los errores de la API llegan como resiliencia.ErrorGemini, tras los reintentos y el respaldo;
+    con reintentar=False no se reintenta (p. ej. el modo por lotes, que reintenta por su cuenta).
+    Las preguntas de texto sin historial también se buscan en la caché semántica, que reconoce
+    preguntas parecidas a otras ya respondidas por el mismo modelo (la similitud queda en las métricas);
+    similares=False la evita en prompts hechos con una plantilla fija, que se parecen aunque el texto no.
+    """
+    registro = dict(medicion or {})
+    registro["modelo"] = nombre_modelo
+    uso = uso if uso is not None else {}
+    inicio = time.perf_counter()
+
+    def al_recibir_medido(fragmento):
+        if "primer_token" not in registro:
+            registro["primer_token"] = time.perf_counter() - inicio
+        al_recibir(fragmento)
+
+    try:
+        cache = obtener_cache() if usar_cache else None
+        if cache is not None:
+            clave = cache.clave(nombre_modelo, contenido, generation_config)
+            texto = cache.obtener(clave)
+            # Si no está la misma pregunta, la respuesta a una muy parecida (solo preguntas de texto)
+            semantica = obtener_cache_semantica() if texto is None and similares else None
+            consulta = semantica.preparar(nombre_modelo, contenido, generation_config) if semantica else None
+            if consulta is not None:
+                encontrado = semantica.buscar(consulta)
+                if encontrado is not None:
+                    texto, registro["similitud"] = encontrado
+            if texto is not None:
+                registro["cache"] = True
+                if al_recibir is not None:
+                    al_recibir(texto)
+                return texto
+
+        texto, completo, usado = _generar_unico(nombre_modelo, contenido, al_recibir_medido if al_recibir else None,
+                                                cancelado, generation_config, uso, modelo, registro, reintentar)
+        # Una respuesta del modelo de respaldo no se guarda como si fuera del modelo pedido
+        if cache is not None and completo and usado == nombre_modelo:
+            cache.guardar(clave, nombre_modelo, texto)
+            if consulta is not None:
+                semantica.guardar(consulta, clave)
+        return texto
+    except Exception as e:
+        registro["error"] = getattr(e, 'clase', None) or type(e).__name__
+        raise
+    finally:
+        _medir(registro, inicio, uso)
+
+
+def clave_vuelo(nombre_modelo, contenido, generation_config=None, modelo=None):
+    """Clave de coalescencia: la de la caché, más la instancia si se pasó un modelo concreto"""
+    return (CacheRespuestas.clave(nombre_modelo, contenido, generation_config),
+            id(modelo) if modelo is not None else None)
+
+
+def _generar_unico(nombre_modelo, contenido, al_recibir, cancelado, generation_config, uso, modelo, registro,
+                   reintentar=True):
+    # Una sola petición por clave en curso; las llamadas que se unen a otra comparten texto y uso
+    def intento(nombre, publicar, cancelacion, plazo):
+        instancia = modelo if modelo is not None else obtener_modelo(nombre, generation_config)
+        uso_intento = {}
+        texto, completo = _generar_modelo(instancia, contenido, publicar, cancelacion, uso_intento, plazo)
+        return texto, completo, uso_intento
+
+    def llamar(publicar, cancelado_comun):
+        # La petición hace streaming si lo pidió quien la lanza. Con un modelo concreto (p. ej. con
+        # contexto cacheado) no hay respaldo posible: solo reintentos y plazo
+        (texto, completo, uso_vuelo), usado, intentos = obtener_resiliencia().ejecutar(
+            nombre_modelo, intento, publicar if al_recibir else None, cancelado_comun,
+            con_respaldo=modelo is None, reintentar=reintentar)
+        return texto, completo, uso_vuelo, usado, intentos
+
+    recibidos = []
+
+    def recibir(fragmento):
+        # Tras cancelar, esta llamada deja de recibir fragmentos aunque la petición siga para otras
+        if cancelado is None or not cancelado.is_set():
+            recibidos.append(True)
+            al_recibir(fragmento)
+
+    suscriptor = None if al_recibir is None else recibir
+
+    try:
+        (texto, completo, uso_vuelo, usado, intentos), unida = _vuelos.ejecutar(
+            clave_vuelo(nombre_modelo, contenido, generation_config, modelo), llamar, suscriptor, cancelado)
+    except InterruptedError as e:
+        registro["coalescida"] = True
+        return e.args[0] + "\n⏹ Respuesta interrumpida", False, nombre_modelo
+    uso.update(uso_vuelo)
+    registro["intentos"] = intentos
+    if usado != nombre_modelo:
+        registro["respaldo"] = usado
+    if unida:
+        registro["coalescida"] = True
+        # Unida a una petición sin streaming: el texto llega entero, como desde la caché
+        if suscriptor is not None and not recibidos and texto:
+            al_recibir(texto)
+    return texto, completo, usado
+
+
+async def generar_async(nombre_modelo, contenido, usar_cache=True, generation_config=None, medicion=None):
+    """Versión asíncrona de generar(), basada en generate_content_async y sin streaming"""
+    registro = dict(medicion or {})
+    registro["modelo"] = nombre_modelo
+    uso = {}
+    inicio = time.perf_counter()
+    try:
+        cache = obtener_cache() if usar_cache else None
+        if cache is not None:
+            clave = cache.clave(nombre_modelo, contenido, generation_config)
+            texto = cache.obtener(clave)
+            semantica = obtener_cache_semantica() if texto is None else None
+            consulta = semantica.preparar(nombre_modelo, contenido, generation_config) if semantica else None
+            if consulta is not None:
+                encontrado = semantica.buscar(consulta)
+                if encontrado is not None:
+                    texto, registro["similitud"] = encontrado
+            if texto is not None:
+                registro["cache"] = True
+                return texto
+
+        async def intento(nombre, plazo):
+            modelo = obtener_modelo(nombre, generation_config)
+            response = await modelo.generate_content_async(contenido, request_options={"retry": None, "timeout": plazo})
+            uso_intento = {}
+            _registrar_uso(response, uso_intento)
+            return response.text, uso_intento
+
+        async def llamar():
+            # Al comparar modelos cada columna debe ser de su modelo: sin respaldo
+            resultado, _, intentos = await obtener_resiliencia().ejecutar_async(nombre_modelo, intento,
+                                                                               con_respaldo=False)
+            return resultado, intentos
+
+        ((texto, uso_vuelo), intentos), unida = await _vuelos.ejecutar_async(
+            clave_vuelo(nombre_modelo, contenido, generation_config), llamar)
+        uso.update(uso_vuelo)
+        registro["intentos"] = intentos
+        if unida:
+            registro["coalescida"] = True
+        if cache is not None:
+            cache.guardar(clave, nombre_modelo, texto)
+            if consulta is not None:
+                semantica.guardar(consulta, clave)
+        return texto
+    except Exception as e:
+        registro["error"] = getattr(e, 'clase', None) or type(e).__name__
+        raise
+    finally:
+        _medir(registro, inicio, uso)
+
+
+def _medir(registro, inicio, uso):
+    # Completa la medición de una llamada y la entrega a las métricas del proceso
+    registro["total"] = time.perf_counter() - inicio
+    registro.setdefault("cache", False)
+    registro.setdefault("error", None)
+    registro.setdefault("coalescida", False)
+    if registro["error"] is None:
+        # Sin streaming, el primer token llega con la respuesta completa
+        registro.setdefault("primer_token", registro["total"])
+    # Una llamada unida a otra no gastó tokens: solo los cuenta la que hizo la petición
+    if not registro["coalescida"] and (uso.get("prompt") or uso.get("respuesta")):
+        registro["tokens_prompt"] = uso.get("prompt")
+        registro["tokens_respuesta"] = uso.get("respuesta")
+    try:
+        obtener_metricas().registrar(registro)
+    except Exception as e:
+        print(f"Error al registrar métricas: {str(e)}")
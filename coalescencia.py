@@ -0,0 +1,136 @@
+import asyncio
+import threading
+
+
+class CancelacionConjunta:
+    """Se da por cancelada solo cuando todos los interesados en la llamada la han cancelado.
+
+    Se comporta como un threading.Event para quien solo consulta is_set().
+    """
+
+    def __init__(self):
+        self.eventos = []
+
+    def agregar(self, cancelado):
+        self.eventos.append(cancelado)
+
+    def is_set(self):
+        # Un interesado sin evento de cancelación nunca renuncia a la respuesta
+        return bool(self.eventos) and all(e is not None and e.is_set() for e in self.eventos)
+
+
+class Vuelo:
+    """Una llamada en curso: guarda los fragmentos recibidos y los reparte entre sus suscriptores"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fragmentos = []
+        self.suscriptores = []
+        self.cancelado = CancelacionConjunta()
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+    def suscribir(self, al_recibir):
+        # Quien llega tarde recibe primero lo ya emitido; el lock mantiene el orden de los fragmentos
+        with self.lock:
+            for fragmento in self.fragmentos:
+                al_recibir(fragmento)
+            self.suscriptores.append(al_recibir)
+
+    def desuscribir(self, al_recibir):
+        with self.lock:
+            if al_recibir in self.suscriptores:
+                self.suscriptores.remove(al_recibir)
+
+    def publicar(self, fragmento):
+        with self.lock:
+            self.fragmentos.append(fragmento)
+            for al_recibir in self.suscriptores:
+                al_recibir(fragmento)
+
+
+class Coalescedor:
+    """Une las llamadas idénticas que están en curso a la vez en una sola llamada a la API.
+
+    La primera llamada con una clave la ejecuta (líder); las que llegan mientras tanto esperan su
+    resultado y, si hacen streaming, reciben los mismos fragmentos desde el principio.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vuelos = {}
+        self.tareas = {}
+        # Llamadas que se ahorraron al unirse a otra en curso
+        self.unidas = 0
+
+    def ejecutar(self, clave, funcion, al_recibir=None, cancelado=None):
+        """Ejecuta funcion(al_recibir, cancelado) una sola vez por clave en curso.
+
+        Devuelve (resultado, unida). La llamada solo se cancela si cancelan todos los que la esperan;
+        quien cancela antes recibe InterruptedError y deja de recibir fragmentos.
+        """
+        with self.lock:
+            vuelo = self.vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = Vuelo()
+                self.vuelos[clave] = vuelo
+            else:
+                self.unidas += 1
+            vuelo.cancelado.agregar(cancelado)
+            if al_recibir is not None:
+                vuelo.suscribir(al_recibir)
+
+        if lider:
+            try:
+                vuelo.resultado = funcion(vuelo.publicar, vuelo.cancelado)
+            except BaseException as e:
+                vuelo.error = e
+            finally:
+                with self.lock:
+                    del self.vuelos[clave]
+                vuelo.terminado.set()
+        else:
+            while not vuelo.terminado.wait(0.1):
+                if cancelado is not None and cancelado.is_set():
+                    if al_recibir is not None:
+                        vuelo.desuscribir(al_recibir)
+                    raise InterruptedError("".join(vuelo.fragmentos))
+
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.resultado, not lider
+
+    async def ejecutar_async(self, clave, funcion):
+        """Versión asíncrona: await funcion() una sola vez por clave en curso en el mismo bucle"""
+        bucle = asyncio.get_running_loop()
+        clave = (id(bucle), clave)
+        with self.lock:
+            futuro = self.tareas.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = bucle.create_future()
+                self.tareas[clave] = futuro
+            else:
+                self.unidas += 1
+        if not lider:
+            # shield: cancelar a quien espera no cancela la llamada del líder
+            return await asyncio.shield(futuro), True
+
+        try:
+            resultado = await funcion()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except BaseException as e:
+            futuro.set_exception(e)
+            # Marcar la excepción como consultada aunque no haya nadie esperando
+            futuro.exception()
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado, False
+        finally:
+            with self.lock:
+                del self.tareas[clave]
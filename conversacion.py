@@ -0,0 +1,290 @@
+import os
+import time
+import datetime
+import hashlib
+import threading
+from cliente import generar
+from imagenes import estimar_bytes, PRESUPUESTO_PETICION
+
+# Umbral (fracción del límite) a partir del cual se compacta el historial
+UMBRAL_COMPACTACION = 0.8
+
+# Tokens que la API cobra por cada imagen pequeña; sirve de estimación antes de conocer el uso real
+TOKENS_POR_IMAGEN = 258
+
+# Sustituye en el historial a las imágenes que ya no se reenvían
+IMAGEN_RETIRADA = "[imagen de un turno anterior]"
+
+PROMPT_RESUMEN = """Resume de forma concisa la siguiente conversación entre un usuario y un asistente.
+Conserva los datos, nombres, decisiones y preguntas abiertas que puedan hacer falta para continuarla.
+
+{transcripcion}"""
+
+
+def estimar_tokens(partes):
+    """Estimación local (unos 4 caracteres por token) para cuando la API aún no ha informado el uso"""
+    total = 0
+    for parte in partes:
+        if isinstance(parte, str):
+            total += max(1, len(parte) // 4)
+        else:
+            total += TOKENS_POR_IMAGEN
+    return total
+
+
+def texto_de(partes):
+    """Texto de un turno, sustituyendo las imágenes por una marca"""
+    return " ".join(parte if isinstance(parte, str) else "[imagen]" for parte in partes)
+
+
+class Conversacion:
+    """Sesión multi-turno al estilo start_chat con un presupuesto de tokens.
+
+    Los tokens se cuentan de forma incremental con el uso que devuelve cada respuesta, sin llamadas
+    extra a count_tokens. Cerca del límite, los turnos antiguos se resumen (o se descartan) y, si se
+    activa CACHE_CONTEXTO, el prefijo estable del historial se sube como contenido cacheado para no
+    reenviarlo en cada pregunta.
+    """
+
+    def __init__(self, nombre_modelo, limite_tokens=None, turnos_recientes=4, resumir=True,
+                 cache_contexto=None):
+        self.nombre_modelo = nombre_modelo
+        self.limite_tokens = limite_tokens or int(os.getenv('LIMITE_TOKENS_CONTEXTO', 32000))
+        self.turnos_recientes = turnos_recientes
+        self.resumir = resumir
+        if cache_contexto is None:
+            cache_contexto = os.getenv('CACHE_CONTEXTO', '0') == '1'
+        self.cache_contexto = cache_contexto
+        self.min_tokens_cache = int(os.getenv('MIN_TOKENS_CACHE_CONTEXTO', 4096))
+        # Bytes de imágenes que se reenvían con el historial; el resto de la petición queda para las nuevas
+        self.max_bytes_imagenes = int(float(os.getenv('CONTEXTO_MAX_IMAGENES_MB',
+                                                      PRESUPUESTO_PETICION / 2 / 1024 / 1024)) * 1024 * 1024)
+
+        # Cada turno: {"role": "user" | "model", "parts": [...], "tokens": n}
+        self.turnos = []
+        self.tokens_totales = 0
+
+        # Contenido cacheado en la API: (turnos que cubre, modelo en que se creó, CachedContent, GenerativeModel)
+        self.prefijo = None
+
+        # Turnos numerados para respetar el orden de llegada aunque haya varios hilos
+        self.condicion = threading.Condition()
+        self.proximo = 0
+        self.siguiente = 0
+        self.liberados = set()
+
+    def reservar(self):
+        """Reserva el siguiente turno; llamar en el orden en que el usuario hace las preguntas"""
+        with self.condicion:
+            turno = self.proximo
+            self.proximo += 1
+            return turno
+
+    def liberar(self, turno):
+        """Renuncia a un turno (pregunta cancelada o caducada) para no bloquear a las siguientes"""
+        with self.condicion:
+            if turno >= self.siguiente:
+                self._avanzar(turno)
+
+    def _avanzar(self, turno):
+        self.liberados.add(turno)
+        while self.siguiente in self.liberados:
+            self.liberados.discard(self.siguiente)
+            self.siguiente += 1
+        self.condicion.notify_all()
+
+    def reiniciar(self):
+        with self.condicion:
+            self.turnos = []
+            self.tokens_totales = 0
+            self._descartar_prefijo()
+
+    def historial(self):
+        return [{"role": t["role"], "parts": t["parts"]} for t in self.turnos]
+
+    def _reenviados(self):
+        # Turnos que viajan en línea con cada pregunta (los del prefijo cacheado ya están en la API)
+        return self.turnos[self.prefijo[0]:] if self.prefijo is not None else self.turnos
+
+    def bytes_historial(self, nuevas=()):
+        """Bytes que ocupará el historial en la próxima petición, sin las imágenes que repite `nuevas`
+        y con las demás limitadas a max_bytes_imagenes, como hará _retirar_imagenes"""
+        repetidas = {hashlib.sha256(parte["data"]).digest() for parte in nuevas if isinstance(parte, dict)}
+        texto = imagenes = 0
+        with self.condicion:
+            for turno in self._reenviados():
+                for parte in turno["parts"]:
+                    if not isinstance(parte, dict):
+                        texto += estimar_bytes(parte)
+                    elif hashlib.sha256(parte["data"]).digest() not in repetidas:
+                        imagenes += estimar_bytes(parte)
+        return texto + min(imagenes, self.max_bytes_imagenes)
+
+    def _retirar_imagenes(self, nuevas):
+        # Con la condición tomada: las imágenes que el nuevo mensaje vuelve a enviar y, de la más antigua
+        # a la más reciente, las que pasen de max_bytes_imagenes se sustituyen por una marca
+        repetidas = {hashlib.sha256(parte["data"]).digest() for parte in nuevas if isinstance(parte, dict)}
+        turnos = self._reenviados()
+        total = sum(estimar_bytes(parte) for turno in turnos for parte in turno["parts"] if isinstance(parte, dict))
+        for turno in turnos:
+            partes = []
+            for parte in turno["parts"]:
+                if isinstance(parte, dict) and (total > self.max_bytes_imagenes or
+                                                hashlib.sha256(parte["data"]).digest() in repetidas):
+                    total -= estimar_bytes(parte)
+                    turno["tokens"] += estimar_tokens([IMAGEN_RETIRADA]) - TOKENS_POR_IMAGEN
+                    self.tokens_totales += estimar_tokens([IMAGEN_RETIRADA]) - TOKENS_POR_IMAGEN
+                    parte = IMAGEN_RETIRADA
+                partes.append(parte)
+            turno["parts"] = partes
+
+    def preguntar(self, partes, nombre_modelo=None, al_recibir=None, cancelado=None, usar_cache=True, turno=None,
+                  medicion=None):
+        """Envía un mensaje con todo el contexto y lo añade al historial junto con la respuesta"""
+        medicion = dict(medicion or {})
+        llegada = time.perf_counter()
+        if isinstance(partes, str):
+            partes = [partes]
+        if turno is None:
+            turno = self.reservar()
+        nombre_modelo = nombre_modelo or self.nombre_modelo
+
+        # Esperar a que terminen las preguntas anteriores de esta conversación
+        with self.condicion:
+            while self.siguiente != turno:
+                if turno < self.siguiente or (cancelado is not None and cancelado.is_set()):
+                    self.liberar(turno)
+                    return "⏹ Respuesta interrumpida"
+                self.condicion.wait(0.1)
+            # Las mismas fotos no se reenvían una vez por cada pregunta que las adjunta
+            self._retirar_imagenes(partes)
+            historial = self.historial()
+        # La espera por el turno cuenta como espera en cola
+        medicion["espera"] = medicion.get("espera", 0) + time.perf_counter() - llegada
+
+        compactando = False
+        try:
+            mensaje = {"role": "user", "parts": partes}
+            modelo, contenido = self._preparar_contenido(nombre_modelo, historial, mensaje)
+            uso = {}
+            try:
+                texto = generar(nombre_modelo, contenido, al_recibir, cancelado,
+                                usar_cache=usar_cache and modelo is None, uso=uso, modelo=modelo,
+                                medicion=medicion)
+            except Exception:
+                if modelo is None:
+                    raise
+                # El contenido cacheado pudo caducar: repetir enviando el historial completo
+                self._descartar_prefijo()
+                texto = generar(nombre_modelo, historial + [mensaje], al_recibir, cancelado,
+                                usar_cache=usar_cache, uso=uso, medicion=medicion)
+
+            with self.condicion:
+                # Si el turno se liberó (p. ej. por tiempo agotado) la respuesta ya no cuenta
+                if self.siguiente != turno:
+                    return texto
+                self._registrar(partes, texto, uso)
+                compactando = self.tokens_totales > self.limite_tokens * UMBRAL_COMPACTACION
+
+            if compactando:
+                # Compactar sin retrasar esta respuesta; la siguiente pregunta esperará su turno
+                threading.Thread(target=self._compactar_y_avanzar, args=(nombre_modelo, turno),
+                                 daemon=True).start()
+            return texto
+        finally:
+            if not compactando:
+                self.liberar(turno)
+
+    def _registrar(self, partes, texto, uso):
+        # Tokens reales si la API los informó: el prompt incluye todo el historial anterior
+        prompt = uso.get("prompt") or 0
+        if prompt and self.prefijo is None:
+            tokens_usuario = max(1, prompt - self.tokens_totales)
+        else:
+            tokens_usuario = estimar_tokens(partes)
+        tokens_modelo = uso.get("respuesta") or estimar_tokens([texto])
+
+        self.turnos.append({"role": "user", "parts": partes, "tokens": tokens_usuario})
+        self.turnos.append({"role": "model", "parts": [texto], "tokens": tokens_modelo})
+        self.tokens_totales += tokens_usuario + tokens_modelo
+
+    def _compactar_y_avanzar(self, nombre_modelo, turno):
+        try:
+            self.compactar(nombre_modelo)
+        except Exception as e:
+            print(f"Error al compactar la conversación: {str(e)}")
+        finally:
+            self.liberar(turno)
+
+    def compactar(self, nombre_modelo=None):
+        """Resume (o descarta) los turnos antiguos, conservando los más recientes intactos"""
+        with self.condicion:
+            corte = len(self.turnos) - self.turnos_recientes * 2
+            if corte <= 0:
+                return
+            antiguos = self.turnos[:corte]
+            recientes = self.turnos[corte:]
+
+        cabecera = []
+        if self.resumir:
+            transcripcion = "\n".join(
+                f"{'Usuario' if t['role'] == 'user' else 'Asistente'}: {texto_de(t['parts'])}" for t in antiguos)
+            try:
+                resumen = generar(nombre_modelo or self.nombre_modelo,
+                                  PROMPT_RESUMEN.format(transcripcion=transcripcion), usar_cache=False,
+                                  medicion={"origen": "resumen"})
+                cabecera = [
+                    {"role": "user", "parts": [f"Resumen de la conversación hasta ahora:\n{resumen}"],
+                     "tokens": estimar_tokens([resumen])},
+                    {"role": "model", "parts": ["Entendido, continúo a partir de ese resumen."], "tokens": 12}
+                ]
+            except Exception as e:
+                # Sin resumen, los turnos antiguos simplemente se descartan
+                print(f"Error al resumir la conversación, se truncará: {str(e)}")
+
+        with self.condicion:
+            self.turnos = cabecera + recientes
+            self.tokens_totales = sum(t["tokens"] for t in self.turnos)
+            self._descartar_prefijo()
+
+    def _preparar_contenido(self, nombre_modelo, historial, mensaje):
+        """Devuelve (modelo, contenido): con prefijo cacheado solo se envía la parte nueva"""
+        if not self.cache_contexto:
+            return None, historial + [mensaje]
+
+        # Cachear todo menos los turnos recientes, que cambian con cada pregunta
+        cubiertos = len(historial) - self.turnos_recientes * 2
+        tokens_prefijo = sum(t["tokens"] for t in self.turnos[:max(cubiertos, 0)])
+        if self.prefijo is not None and self.prefijo[1] != nombre_modelo:
+            self._descartar_prefijo()
+        if self.prefijo is None and cubiertos > 0 and tokens_prefijo >= self.min_tokens_cache:
+            self._crear_prefijo(nombre_modelo, historial[:cubiertos])
+
+        if self.prefijo is None:
+            return None, historial + [mensaje]
+        return self.prefijo[3], historial[self.prefijo[0]:] + [mensaje]
+
+    def _crear_prefijo(self, nombre_modelo, contenidos):
+        try:
+            import google.generativeai as genai
+            from google.generativeai import caching
+            cacheado = caching.CachedContent.create(
+                model=nombre_modelo if nombre_modelo.startswith("models/") else f"models/{nombre_modelo}",
+                contents=contenidos,
+                ttl=datetime.timedelta(minutes=int(os.getenv('TTL_CACHE_CONTEXTO_MIN', 10))))
+            modelo = genai.GenerativeModel.from_cached_content(cached_content=cacheado)
+            self.prefijo = (len(contenidos), nombre_modelo, cacheado, modelo)
+        except Exception as e:
+            # El modelo no admite caché de contexto: seguir enviando el historial completo
+            print(f"Caché de contexto no disponible, se desactiva: {str(e)}")
+            self.cache_contexto = False
+
+    def _descartar_prefijo(self):
+        if self.prefijo is None:
+            return
+        cacheado = self.prefijo[2]
+        self.prefijo = None
+        try:
+            cacheado.delete()
+        except Exception:
+            pass
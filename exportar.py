@@ -0,0 +1,163 @@
+import os
+import json
+from xml.sax.saxutils import escape
+from historial import formatear_mensaje
+
+TITULO = "🔮 Conversación con Gemini 🔮"
+
+# Formatos para el diálogo de guardar
+FORMATOS = [
+    ("Archivo de texto", "*.txt"),
+    ("Markdown", "*.md"),
+    ("JSON Lines", "*.jsonl"),
+    ("Documento PDF", "*.pdf")
+]
+
+# Mensajes entre dos avisos de progreso
+PASO_PROGRESO = 100
+
+# Flowables que se mantienen preparados por delante de reportlab
+RESERVA_PDF = 64
+
+
+class ExportacionCancelada(Exception):
+    pass
+
+
+def exportar(mensajes, archivo, total=None, al_progresar=None, cancelado=None):
+    """Escribe los mensajes (un iterable, se recorre una sola vez) en el formato de la extensión.
+
+    Se escribe en un temporal que sustituye al destino solo si todo fue bien. Devuelve cuántos
+    mensajes se exportaron.
+    """
+    extension = os.path.splitext(archivo)[1].lower().lstrip('.')
+    escritor = ESCRITORES.get(extension)
+    if escritor is None:
+        raise ValueError(f"Formato no soportado: .{extension}")
+
+    contador = {"mensajes": 0}
+
+    def recorrer():
+        for mensaje in mensajes:
+            if cancelado is not None and cancelado.is_set():
+                raise ExportacionCancelada()
+            yield mensaje
+            contador["mensajes"] += 1
+            if al_progresar is not None and contador["mensajes"] % PASO_PROGRESO == 0:
+                al_progresar(contador["mensajes"], total)
+
+    temporal = archivo + ".tmp"
+    try:
+        escritor(recorrer(), temporal)
+        os.replace(temporal, archivo)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    if al_progresar is not None:
+        al_progresar(contador["mensajes"], total)
+    return contador["mensajes"]
+
+
+def escribir_txt(mensajes, archivo):
+    with open(archivo, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        f.write(TITULO + "\n")
+        f.write("=" * 40 + "\n\n")
+        for mensaje in mensajes:
+            f.write(formatear_mensaje(mensaje))
+
+
+def escribir_md(mensajes, archivo):
+    with open(archivo, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        f.write(f"# {TITULO}\n\n")
+        for mensaje in mensajes:
+            if mensaje["rol"] == "usuario":
+                f.write(f"### ❓ Tú\n\n{mensaje['texto']}\n\n")
+            elif mensaje["rol"] == "modelo":
+                detalles = [d for d in (mensaje.get("modelo"), mensaje.get("sentimiento")) if d]
+                if mensaje.get("evaluacion") is not None:
+                    detalles.append("👍" if mensaje["evaluacion"] else "👎")
+                cabecera = f" ({' · '.join(detalles)})" if detalles else ""
+                f.write(f"### 🤖 Gemini{cabecera}\n\n{mensaje['texto']}\n\n")
+            else:
+                f.write(f"> {mensaje['texto'].strip()}\n\n")
+
+
+def escribir_jsonl(mensajes, archivo):
+    campos = ("rol", "modelo", "texto", "creado", "latencia", "sentimiento", "evaluacion", "imagenes")
+    with open(archivo, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        for mensaje in mensajes:
+            if mensaje["rol"] == "sistema":
+                continue
+            f.write(json.dumps({campo: mensaje.get(campo) for campo in campos}, ensure_ascii=False) + "\n")
+
+
+_estilos_pdf = None
+
+
+def estilos_pdf():
+    """Estilos del PDF, creados una sola vez y compartidos por todas las líneas y exportaciones"""
+    global _estilos_pdf
+    if _estilos_pdf is None:
+        from reportlab.lib import colors
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        styles = getSampleStyleSheet()
+        _estilos_pdf = {
+            "titulo": ParagraphStyle('CustomTitle', parent=styles['Title'], fontSize=24, spaceAfter=30),
+            "usuario": ParagraphStyle('Pregunta', parent=styles['Normal'], textColor=colors.blue,
+                                      fontSize=12, spaceAfter=8),
+            "modelo": ParagraphStyle('Respuesta', parent=styles['Normal'], textColor=colors.black,
+                                     fontSize=11, spaceAfter=12, leftIndent=20),
+            "sistema": styles['Normal']
+        }
+    return _estilos_pdf
+
+
+class HistoriaPerezosa(list):
+    """Lista de flowables que se rellena desde un generador a medida que reportlab la consume.
+
+    doc.build() solo usa len(), [0], del e insert, así que nunca hay más de `reserva` párrafos
+    construidos a la vez en lugar de toda la conversación.
+    """
+
+    def __init__(self, flowables, reserva=RESERVA_PDF):
+        super().__init__()
+        self.flowables = flowables
+        self.reserva = reserva
+
+    def __len__(self):
+        while list.__len__(self) < self.reserva:
+            try:
+                self.append(next(self.flowables))
+            except StopIteration:
+                break
+        return list.__len__(self)
+
+
+def escribir_pdf(mensajes, archivo):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    estilos = estilos_pdf()
+
+    def historia():
+        yield Paragraph(escape(TITULO), estilos["titulo"])
+        yield Spacer(1, 12)
+        for mensaje in mensajes:
+            estilo = estilos.get(mensaje["rol"], estilos["sistema"])
+            for linea in formatear_mensaje(mensaje).split('\n'):
+                if linea.strip():
+                    # El texto se escapa: reportlab interpreta < y & como marcado
+                    yield Paragraph(escape(linea), estilo)
+                    yield Spacer(1, 6)
+
+    doc = SimpleDocTemplate(archivo, pagesize=A4)
+    doc.build(HistoriaPerezosa(historia()))
+
+
+ESCRITORES = {
+    "txt": escribir_txt,
+    "md": escribir_md,
+    "jsonl": escribir_jsonl,
+    "pdf": escribir_pdf
+}
@@ -1,33 +1,53 @@
 import os
 import sys
-import google.generativeai as genai
-from dotenv import load_dotenv
-import pathlib
+import hashlib
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinter import scrolledtext
-import threading
-from PIL import Image, ImageTk
-import io
-import speech_recognition as sr
 import time
+import queue
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from cliente import cargar_entorno, precalentar, generar, contar_tokens
+from cache_respuestas import obtener_cache
+from imagenes import CacheCodificaciones, crear_miniatura, preparar_contenido_imagenes
+from motor_async import MotorAsync
+from conversacion import Conversacion, estimar_tokens
+from planificador import Planificador, EN_COLA, CANCELADA, CADUCADA
+from sentimiento import crear_clasificador, SENTIMIENTO_NEUTRAL
+from transcripcion import Transcripcion
+from historial import SesionHistorial, obtener_historial
+from exportar import exportar, FORMATOS as FORMATOS_EXPORTACION
+from metricas import obtener_metricas
+from catalogo import obtener_catalogo
+from resiliencia import PERMISO, MENSAJES
+from calificaciones import obtener_calificaciones
 
-# Cargar variables de entorno
-env_path = pathlib.Path('.') / '.env' / 'config.env'
-load_dotenv(env_path)
+# Cargar variables de entorno; el SDK se importa y configura en segundo plano tras abrir la ventana
+cargar_entorno()
 
-# Configurar la API key
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Modelo seleccionado al abrir; la lista completa viene del catálogo de modelos
+MODELO_POR_DEFECTO = 'gemini-2.0-flash'
 
-# Lista de modelos disponibles
-MODELOS_DISPONIBLES = [
-    'gemini-2.0-flash',
-    'gemini-2.5-flash',
-    'gemini-2.5-pro',
-    'gemini-pro-vision',
-    'gemini-1.5-pro-latest',
-    'gemini-1.5-flash-latest'
-]
+# Intervalo (ms) de la bomba que vuelca fragmentos y resultados en la interfaz
+INTERVALO_STREAM_MS = 50
+
+# Pausa al teclear (ms) tras la que se adelanta el trabajo de la pregunta (ESPECULACION=0 lo desactiva)
+ESPERA_ESPECULACION_MS = 400
+
+# Campos del panel de rendimiento: (campo de la medición, etiqueta, unidad)
+PANEL_METRICAS = (
+    ("espera", "Espera en cola", "s"),
+    ("codificacion", "Codificar imgs", "s"),
+    ("primer_token", "Primer token", "s"),
+    ("total", "Total", "s"),
+    ("tokens_prompt", "Tokens prompt", ""),
+    ("tokens_respuesta", "Tokens resp.", "")
+)
+
+# Preguntas que se procesan a la vez y preguntas que pueden esperar en cola
+MAX_PREGUNTAS_SIMULTANEAS = 2
+MAX_PREGUNTAS_EN_COLA = 20
 
 class OracleGUI:
     def __init__(self, root):
@@ -35,21 +55,53 @@ class OracleGUI:
         self.root.title("🔮 Oráculo de Gemini")
         self.root.geometry("1024x768")
         
-        # Inicializar reconocedor de voz
-        self.recognizer = sr.Recognizer()
+        # Escucha por voz: el hilo de captura se crea al pulsar el micrófono por primera vez
+        self.voz = None
         self.is_recording = False
         
-        # Variables para el sistema de evaluación
-        self.respuestas_evaluadas = {}
-        self.ultima_respuesta_id = 0
-        self.calificaciones = {
-            "likes": 0,
-            "dislikes": 0
-        }
+        # Las calificaciones se guardan en disco con sus agregados (la de cada respuesta vive en la transcripción);
+        # las respuestas sin fila en el historial se identifican por ejecución
+        self.ejecucion = time.strftime("%Y%m%d%H%M%S")
         
-        # Variables para imágenes
+        # Variables para imágenes (rutas; las codificaciones se preparan en segundo plano)
         self.imagenes_cargadas = []
         self.miniaturas = []
+        self.codificaciones = CacheCodificaciones()
+        self.ejecutor_miniaturas = ThreadPoolExecutor(max_workers=4)
+        self.carga_id = 0
+        
+        # Detector de Almas: clasificador local por defecto, fuera del camino crítico.
+        # Se crea en su propio hilo (un modelo de transformers tarda en cargar); al ser un único
+        # hilo, ninguna clasificación empieza antes de que esté listo
+        self.clasificador = None
+        self.ejecutor_sentimiento = ThreadPoolExecutor(max_workers=1)
+        self.ejecutor_sentimiento.submit(self.crear_clasificador)
+        
+        # Planificador de preguntas: hilos acotados, cola visible y entrega única al hilo de Tk
+        self.planificador = Planificador(max_workers=MAX_PREGUNTAS_SIMULTANEAS,
+                                         max_cola=MAX_PREGUNTAS_EN_COLA)
+        self.version_cola = -1
+        self.ejecutor_exportacion = ThreadPoolExecutor(max_workers=1)
+        
+        # Trabajo especulativo mientras se escribe la pregunta: un único hilo y solo la última pausa cuenta
+        self.especulacion_activa = os.getenv('ESPECULACION', '1') != '0'
+        self.ejecutor_especulacion = ThreadPoolExecutor(max_workers=1)
+        self.especulacion_id = 0
+        self.especulacion_pendiente = None
+        
+        # Motor asyncio para comparar varios modelos en paralelo (se crea al usarlo)
+        self.motor = None
+        
+        # Catálogo de modelos: el guardado en disco al abrir, el de la API cuando llegue
+        self.catalogo = obtener_catalogo()
+        self.modelo_configurado = None
+        
+        # Conversación multi-turno con presupuesto de tokens
+        self.conversacion = Conversacion(MODELO_POR_DEFECTO)
+        
+        # Variables para el streaming de respuestas ((pregunta, respuesta) en la transcripción de cada solicitud abierta)
+        self.cola_stream = queue.Queue()
+        self.mensajes_abiertos = {}
         
         # Estilo
         style = ttk.Style()
@@ -77,6 +129,10 @@ class OracleGUI:
         self.pregunta_entry = ttk.Entry(main_frame, width=50)
         self.pregunta_entry.grid(row=3, column=0, columnspan=2, sticky="ew", pady=5)
         
+        # Tokens que ocupará la pregunta, contados mientras se escribe
+        self.tokens_status = ttk.Label(main_frame, text="", foreground="gray")
+        self.tokens_status.grid(row=2, column=1, sticky="e", pady=5)
+        
         # Frame para botones
         botones_frame = ttk.Frame(main_frame)
         botones_frame.grid(row=3, column=2, padx=5, pady=5)
@@ -96,14 +152,26 @@ class OracleGUI:
                                     command=self.toggle_grabacion, style="Custom.TButton")
         self.grabar_btn.grid(row=0, column=1, padx=2)
         
+        # Botón para detener la pregunta seleccionada en la cola (o la más antigua)
+        self.detener_btn = ttk.Button(botones_frame, text="⏹ Detener", 
+                                     command=self.detener_respuesta, style="Custom.TButton",
+                                     state='disabled')
+        self.detener_btn.grid(row=0, column=3, padx=2)
+        
+        # Botón para comparar la pregunta en varios modelos a la vez
+        self.comparar_btn = ttk.Button(botones_frame, text="⚖️ Comparar", 
+                                      command=self.comparar_modelos, style="Custom.TButton")
+        self.comparar_btn.grid(row=0, column=4, padx=2)
+        
         # Indicador de grabación
         self.indicador_grabacion = ttk.Label(main_frame, text="", foreground="red")
         self.indicador_grabacion.grid(row=2, column=2, sticky="w", pady=5)
         
         # Área de respuesta
         ttk.Label(main_frame, text="Respuesta:").grid(row=4, column=0, sticky="w", pady=5)
-        self.respuesta_text = scrolledtext.ScrolledText(main_frame, width=80, height=15, wrap=tk.WORD)
-        self.respuesta_text.grid(row=5, column=0, columnspan=3, sticky="ew", pady=5)
+        self.transcripcion = Transcripcion(main_frame, almacen=SesionHistorial("gui"),
+                                           al_evaluar=self.evaluar_respuesta, width=80, height=15)
+        self.transcripcion.grid(row=5, column=0, columnspan=3, sticky="ew", pady=5)
         
         # Separador
         ttk.Separator(main_frame, orient="horizontal").grid(row=6, column=0, columnspan=3, sticky="ew", pady=10)
@@ -116,10 +184,10 @@ class OracleGUI:
         ttk.Label(modelo_frame, text="Modelo:").pack(side="left", padx=(0,5))
         
         # Combobox para selección de modelo
-        self.modelo_var = tk.StringVar(value=MODELOS_DISPONIBLES[0])
+        self.modelo_var = tk.StringVar(value=MODELO_POR_DEFECTO)
         self.modelo_combo = ttk.Combobox(modelo_frame, 
                                        textvariable=self.modelo_var,
-                                       values=MODELOS_DISPONIBLES,
+                                       values=self.catalogo.nombres(),
                                        state="readonly",
                                        width=40)
         self.modelo_combo.pack(side="left", padx=5)
@@ -130,11 +198,65 @@ class OracleGUI:
                                      foreground="green")
         self.modelo_status.pack(side="left", padx=5)
         
+        # Casilla para mostrar la respuesta a medida que se genera
+        self.stream_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(modelo_frame, text="Streaming", 
+                       variable=self.stream_var).pack(side="left", padx=5)
+        
+        # Casilla para usar (o saltarse) la caché de respuestas
+        self.cache_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(modelo_frame, text="Usar caché", 
+                       variable=self.cache_var).pack(side="left", padx=5)
+        
+        # Label con los aciertos y fallos de la caché
+        self.cache_status = ttk.Label(modelo_frame, text="")
+        self.cache_status.pack(side="left", padx=5)
+        
+        # Progreso de la exportación en segundo plano (visible solo mientras exporta)
+        self.exportar_progreso = ttk.Progressbar(modelo_frame, length=120, mode='determinate')
+        
+        # Cola de preguntas pendientes
+        cola_frame = ttk.LabelFrame(main_frame, text="Cola de preguntas", padding="5")
+        cola_frame.grid(row=8, column=0, columnspan=3, sticky="ew", pady=5)
+        self.cola_list = tk.Listbox(cola_frame, height=3)
+        self.cola_list.pack(side="left", fill="x", expand=True)
+        self.cola_ids = []
+        
+        # Controles de la conversación
+        conversacion_frame = ttk.Frame(main_frame)
+        conversacion_frame.grid(row=9, column=0, columnspan=3, sticky="ew", pady=5)
+        self.contexto_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(conversacion_frame, text="Recordar contexto", 
+                       variable=self.contexto_var).pack(side="left", padx=5)
+        ttk.Button(conversacion_frame, text="🆕 Nueva conversación", 
+                  command=self.nueva_conversacion, style="Custom.TButton").pack(side="left", padx=5)
+        ttk.Button(conversacion_frame, text="👍 Calificaciones", 
+                  command=self.mostrar_calificaciones, style="Custom.TButton").pack(side="left", padx=5)
+        self.contexto_status = ttk.Label(conversacion_frame, text="")
+        self.contexto_status.pack(side="left", padx=5)
+        
+        # Panel de rendimiento con percentiles de las últimas peticiones
+        metricas_frame = ttk.LabelFrame(main_frame, text="📊 Rendimiento (últimas peticiones)", padding="5")
+        metricas_frame.grid(row=10, column=0, columnspan=3, sticky="ew", pady=5)
+        self.metricas_label = ttk.Label(metricas_frame, text="Sin peticiones todavía",
+                                        font=("Courier", 9), justify="left")
+        self.metricas_label.pack(anchor="w")
+        self.version_metricas = -1
+        self.ultimo_panel = 0.0
+        
+        # Búsqueda en todas las conversaciones guardadas
+        self.busqueda_entry = ttk.Entry(conversacion_frame, width=25)
+        self.busqueda_entry.pack(side="right", padx=5)
+        self.busqueda_entry.bind('<Return>', lambda e: self.buscar_historial())
+        ttk.Button(conversacion_frame, text="🔎 Buscar", 
+                  command=self.buscar_historial, style="Custom.TButton").pack(side="right", padx=5)
+        
         # Vincular evento de cambio de modelo
         self.modelo_combo.bind('<<ComboboxSelected>>', self.cambiar_modelo)
         
         # Configurar el evento Enter
         self.pregunta_entry.bind('<Return>', lambda e: self.hacer_pregunta())
+        self.pregunta_entry.bind('<KeyRelease>', self.al_escribir)
         
         # Hacer que la ventana sea responsive
         root.columnconfigure(0, weight=1)
@@ -142,89 +264,143 @@ class OracleGUI:
         main_frame.columnconfigure(1, weight=1)
         
         # Inicializar el mensaje de bienvenida
-        self.respuesta_text.insert(tk.END, "¡Bienvenido al Oráculo de Gemini! 🔮\n\n")
-        self.respuesta_text.insert(tk.END, "Modelo actual: " + self.modelo_var.get() + "\n")
-        self.respuesta_text.insert(tk.END, "Para cambiar el modelo, usa el menú desplegable en la parte inferior ⬇️\n\n")
-        self.respuesta_text.insert(tk.END, "Puedes:\n")
-        self.respuesta_text.insert(tk.END, "1. Hacer preguntas directamente\n")
-        self.respuesta_text.insert(tk.END, "2. Cargar imágenes y preguntar sobre ellas\n")
-        self.respuesta_text.insert(tk.END, "3. Usar el micrófono para hacer preguntas por voz 🎤\n")
-        self.respuesta_text.insert(tk.END, "4. Evaluar las respuestas usando 👍 o 👎\n")
-        self.respuesta_text.insert(tk.END, "5. Exportar la conversación a TXT o PDF 📝\n")
-        self.respuesta_text.insert(tk.END, "6. Ver el estado emocional de las respuestas 😊😢😠😮😐😏\n\n")
-        self.respuesta_text.configure(state='disabled')
+        self.transcripcion.agregar("sistema",
+            "¡Bienvenido al Oráculo de Gemini! 🔮\n\n"
+            "Modelo actual: " + self.modelo_var.get() + "\n"
+            "Para cambiar el modelo, usa el menú desplegable en la parte inferior ⬇️\n\n"
+            "Puedes:\n"
+            "1. Hacer preguntas directamente\n"
+            "2. Cargar imágenes y preguntar sobre ellas\n"
+            "3. Usar el micrófono para hacer preguntas por voz 🎤\n"
+            "4. Evaluar las respuestas usando 👍 o 👎\n"
+            "5. Exportar la conversación a TXT, Markdown, JSONL o PDF 📝\n"
+            "6. Ver el estado emocional de las respuestas 😊😢😠😮😐😏\n\n")
+        
+        # Iniciar la bomba de eventos
+        self.bombear_eventos()
+        
+        # Importar y configurar el SDK cuando la ventana ya se ha pintado
+        self.root.after_idle(self.cambiar_modelo)
+        self.root.after_idle(self.catalogo.refrescar, False, lambda error: self.planificador.entregar(
+            self.catalogo_actualizado, error))
 
     def cambiar_modelo(self, event=None):
-        try:
-            nuevo_modelo = genai.GenerativeModel(self.modelo_var.get())
-            self.modelo_status.config(text="✓ Modelo configurado", foreground="green")
-        except Exception as e:
+        # Deja el modelo listo en el registro para la próxima pregunta, sin bloquear la interfaz
+        nombre_modelo = self.modelo_var.get()
+        self.modelo_status.config(text="⏳ Preparando modelo...", foreground="gray")
+        # Satisfacción acumulada de todas las sesiones y la del modelo elegido
+        self.actualizar_titulo(nombre_modelo)
+        # Además de crear el modelo, deja abierta la conexión con la API para la primera pregunta
+        precalentar(nombre_modelo, lambda error: self.planificador.entregar(
+            self.modelo_preparado, nombre_modelo, error))
+        # Lo ya contado para la pregunta en curso correspondía al modelo anterior
+        self.al_escribir()
+
+    def modelo_preparado(self, nombre_modelo, error):
+        # Un cambio posterior de modelo ya tiene su propio aviso en curso
+        if nombre_modelo != self.modelo_var.get():
+            return
+        if error is None:
+            self.modelo_configurado = nombre_modelo
+            self.modelo_status.config(text=f"✓ Modelo configurado{self.describir_modelo(nombre_modelo)}",
+                                      foreground="green")
+        else:
             self.modelo_status.config(text="❌ Error al configurar modelo", foreground="red")
-            print(f"Error al cambiar modelo: {str(e)}")
+
+    def describir_modelo(self, nombre_modelo):
+        # Capacidades del catálogo para la etiqueta de estado
+        info = self.catalogo.info(nombre_modelo)
+        if info is None:
+            return ""
+        detalles = []
+        if info.get("tokens_entrada"):
+            detalles.append(f"{info['tokens_entrada']:,} tokens".replace(",", "."))
+        detalles.append("🖼️ imágenes" if info["vision"] else "solo texto")
+        return " · " + " · ".join(detalles)
+
+    def catalogo_actualizado(self, error):
+        if error is not None:
+            return
+        self.modelo_combo.configure(values=self.catalogo.nombres())
+        # Si el modelo ya estaba listo, mostrar sus capacidades recién descargadas
+        if self.modelo_configurado == self.modelo_var.get():
+            self.modelo_preparado(self.modelo_configurado, None)
+
+    def crear_clasificador(self):
+        self.clasificador = crear_clasificador()
 
     def analizar_sentimiento(self, texto):
-        """Analiza el sentimiento del texto y retorna un diccionario con la emoción y su emoji"""
-        prompt_sentimiento = f"""Analiza el sentimiento emocional del siguiente texto y responde SOLO con una de estas emociones:
-        - FELIZ 😊
-        - TRISTE 😢
-        - ENOJADO 😠
-        - SORPRENDIDO 😮
-        - NEUTRAL 😐
-        - SARCÁSTICO 😏
-        
-        Texto a analizar: {texto}
-        
-        Responde solo con la emoción y su emoji, nada más."""
-        
+        """Analiza el sentimiento del texto y retorna la emoción con su emoji"""
+        inicio = time.perf_counter()
+        error = None
         try:
-            modelo_actual = genai.GenerativeModel('gemini-pro')
-            response = modelo_actual.generate_content(prompt_sentimiento)
-            return response.text.strip()
-        except:
-            return "NEUTRAL 😐"
+            return self.clasificador.clasificar(texto)
+        except Exception as e:
+            error = type(e).__name__
+            print(f"Error al analizar sentimiento: {str(e)}")
+            return SENTIMIENTO_NEUTRAL
+        finally:
+            # Los clasificadores locales no pasan por cliente.generar(): medirlos aquí
+            if not getattr(self.clasificador, 'remoto', False):
+                obtener_metricas().registrar({"origen": "sentimiento", "modelo": type(self.clasificador).__name__,
+                                              "total": time.perf_counter() - inicio, "error": error})
 
-    def obtener_respuesta(self, prompt):
+    def analizar_sentimiento_async(self, mensaje_id, texto):
+        # Clasificar en segundo plano y mostrar la etiqueta cuando esté lista
+        def tarea():
+            sentimiento = self.analizar_sentimiento(texto)
+            self.planificador.entregar(self.mostrar_sentimiento, mensaje_id, sentimiento)
+        self.ejecutor_sentimiento.submit(tarea)
+
+    def mostrar_sentimiento(self, mensaje_id, sentimiento):
+        # La transcripción lo guarda y, si la respuesta está a la vista, lo pinta junto al encabezado
+        self.transcripcion.fijar_sentimiento(mensaje_id, sentimiento)
+        # Si ya estaba calificada, pasa del grupo "sin clasificar" al de su sentimiento
+        obtener_calificaciones().reclasificar(self.clave_respuesta(mensaje_id), sentimiento)
+
+    def obtener_respuesta(self, prompt, nombre_modelo, imagenes=(), al_recibir=None, cancelado=None, usar_cache=True,
+                          conversacion=None, turno=None, medicion=None):
+        medicion = dict(medicion or {})
         try:
-            modelo_actual = genai.GenerativeModel(self.modelo_var.get())
-            
-            if self.imagenes_cargadas:
+            if imagenes:
                 try:
-                    # Convertir las imágenes a bytes
-                    imagenes_bytes = []
-                    for img in self.imagenes_cargadas:
-                        # Convertir a RGB si la imagen está en modo RGBA
-                        if img.mode == 'RGBA':
-                            img = img.convert('RGB')
-                        
-                        img_byte_arr = io.BytesIO()
-                        img.save(img_byte_arr, format='JPEG', quality=95)
-                        img_byte_arr = img_byte_arr.getvalue()
-                        imagenes_bytes.append({
-                            "mime_type": "image/jpeg",
-                            "data": img_byte_arr
-                        })
+                    # Codificaciones ya preparadas al cargar las imágenes (se mide lo que aún haya que esperar)
+                    inicio = time.perf_counter()
+                    imagenes_partes = [self.codificaciones.obtener(ruta) for ruta in imagenes]
+                    medicion["codificacion"] = time.perf_counter() - inicio
                     
-                    # Preparar el contenido para el modelo de visión
-                    contenido = [prompt] + imagenes_bytes
-                    response = modelo_actual.generate_content(contenido)
-                    texto_respuesta = response.text
+                    # Preparar el contenido para el modelo de visión (repartido en subpeticiones si no cabe),
+                    # contando con el historial que la conversación enviará delante
+                    reservado = 0
+                    if conversacion is not None:
+                        reservado = conversacion.bytes_historial([p for partes in imagenes_partes for p in partes])
+                    contenido = preparar_contenido_imagenes(nombre_modelo, prompt, imagenes_partes, cancelado,
+                                                            usar_cache, medicion, reservado)
+                    if cancelado is not None and cancelado.is_set():
+                        return "⏹ Respuesta interrumpida", None
+                    if conversacion is not None:
+                        texto_respuesta = conversacion.preguntar(contenido, nombre_modelo, al_recibir, cancelado,
+                                                                 usar_cache, turno, medicion)
+                    else:
+                        texto_respuesta = generar(nombre_modelo, contenido, al_recibir, cancelado, usar_cache,
+                                                  medicion=medicion)
                     
-                    # Analizar sentimiento de la respuesta
-                    sentimiento = self.analizar_sentimiento(texto_respuesta)
-                    return texto_respuesta, sentimiento
+                    # El sentimiento se analiza después, sin retrasar la respuesta
+                    return texto_respuesta, None
                 except Exception as vision_error:
-                    if "PERMISSION_DENIED" in str(vision_error):
-                        return ("Error: Para usar el análisis de imágenes se requiere una cuenta de pago de Google AI Studio. "
-                               "Por favor, actualiza tu cuenta para usar esta funcionalidad.\n"
-                               "Más información: https://ai.google.dev/pricing", "NEUTRAL 😐")
+                    if getattr(vision_error, 'clase', None) == PERMISO:
+                        return f"Error: {MENSAJES[PERMISO]}", "NEUTRAL 😐"
                     else:
                         return f"Error al procesar las imágenes: {str(vision_error)}", "TRISTE 😢"
             else:
                 # Si no hay imágenes, usar el modelo directamente
-                response = modelo_actual.generate_content(prompt)
-                texto_respuesta = response.text
-                sentimiento = self.analizar_sentimiento(texto_respuesta)
-                return texto_respuesta, sentimiento
+                if conversacion is not None:
+                    texto_respuesta = conversacion.preguntar(prompt, nombre_modelo, al_recibir, cancelado,
+                                                             usar_cache, turno, medicion)
+                else:
+                    texto_respuesta = generar(nombre_modelo, prompt, al_recibir, cancelado, usar_cache,
+                                              medicion=medicion)
+                return texto_respuesta, None
         except Exception as e:
             return f"Error al generar respuesta: {str(e)}", "TRISTE 😢"
 
@@ -241,30 +417,45 @@ class OracleGUI:
         )
         
         # Limpiar imágenes anteriores
-        self.imagenes_cargadas.clear()
+        self.carga_id += 1
+        carga_id = self.carga_id
+        self.imagenes_cargadas = list(archivos)
         for widget in self.miniaturas_frame.winfo_children():
             widget.destroy()
         self.miniaturas.clear()
         
-        # Cargar nuevas imágenes
-        for archivo in archivos:
-            try:
-                # Cargar y redimensionar para miniatura
-                imagen = Image.open(archivo)
-                imagen_original = imagen.copy()
-                self.imagenes_cargadas.append(imagen_original)
-                
-                # Crear miniatura
-                imagen.thumbnail((100, 100))
-                foto = ImageTk.PhotoImage(imagen)
-                self.miniaturas.append(foto)  # Mantener referencia
-                
-                # Mostrar miniatura
-                label = ttk.Label(self.miniaturas_frame, image=foto)
-                label.grid(row=0, column=len(self.miniaturas)-1, padx=2)
-                
-            except Exception as e:
-                print(f"Error al cargar imagen {archivo}: {str(e)}")
+        # Decodificar las miniaturas en paralelo; cada una aparece en cuanto está lista
+        for indice, archivo in enumerate(archivos):
+            futuro = self.ejecutor_miniaturas.submit(crear_miniatura, archivo)
+            futuro.add_done_callback(
+                lambda f, i=indice, a=archivo: self.planificador.entregar(self.mostrar_miniatura, carga_id, i, a, f))
+        # Con una pregunta ya escrita, recontar sus tokens con las imágenes nuevas
+        self.al_escribir()
+
+    def mostrar_miniatura(self, carga_id, indice, archivo, futuro):
+        # Ignorar resultados de una selección anterior
+        if carga_id != self.carga_id:
+            return
+        
+        try:
+            imagen = futuro.result()
+        except Exception as e:
+            print(f"Error al cargar imagen {archivo}: {str(e)}")
+            if archivo in self.imagenes_cargadas:
+                self.imagenes_cargadas.remove(archivo)
+            return
+        
+        # PhotoImage debe crearse en el hilo de Tk
+        from PIL import ImageTk
+        foto = ImageTk.PhotoImage(imagen)
+        self.miniaturas.append(foto)  # Mantener referencia
+        
+        # Mostrar miniatura en la posición de la selección
+        label = ttk.Label(self.miniaturas_frame, image=foto)
+        label.grid(row=0, column=indice, padx=2)
+        
+        # Preparar la codificación para el modelo en segundo plano
+        self.codificaciones.precargar([archivo])
 
     def hacer_pregunta(self):
         # Obtener la pregunta
@@ -272,168 +463,503 @@ class OracleGUI:
         if not pregunta:
             return
         
-        # Deshabilitar la entrada y el botón mientras se procesa
-        self.pregunta_entry.configure(state='disabled')
-        self.enviar_btn.configure(state='disabled')
-        self.cargar_btn.configure(state='disabled')
-        self.grabar_btn.configure(state='disabled')
-        self.respuesta_text.configure(state='normal')
-        
-        # Mostrar la pregunta en el área de respuesta
-        self.respuesta_text.insert(tk.END, f"\n❓ Tú: {pregunta}\n")
-        self.respuesta_text.see(tk.END)
+        # Tomar la configuración actual: la pregunta puede esperar en cola mientras cambia
+        nombre_modelo = self.modelo_var.get()
+        imagenes = list(self.imagenes_cargadas)
+        streaming = self.stream_var.get()
+        usar_cache = self.cache_var.get()
+        
+        # Las imágenes solo van a modelos que las aceptan: otro modelo fallaría tras el viaje de ida y vuelta
+        if imagenes:
+            modelo_imagenes = self.catalogo.modelo_para_imagenes(nombre_modelo)
+            if modelo_imagenes is None:
+                self.mostrar_aviso("Ningún modelo disponible admite imágenes")
+                return
+            if modelo_imagenes != nombre_modelo:
+                self.transcripcion.agregar(
+                    "sistema", f"\nℹ️ {nombre_modelo} no admite imágenes: se pregunta a {modelo_imagenes}\n")
+                nombre_modelo = modelo_imagenes
+        
+        # Reservar el turno ahora para que las respuestas respeten el orden de las preguntas
+        conversacion = self.conversacion if self.contexto_var.get() else None
+        turno = conversacion.reservar() if conversacion is not None else None
+        
+        # Función que ejecuta el planificador en uno de sus hilos
+        def procesar_respuesta(solicitud):
+            al_recibir = None
+            if streaming:
+                al_recibir = lambda fragmento: self.cola_stream.put((solicitud.id, fragmento))
+            resultado = self.obtener_respuesta(pregunta, nombre_modelo, imagenes, al_recibir,
+                                               solicitud.cancelado, usar_cache, conversacion, turno,
+                                               {"origen": "gui", "espera": solicitud.espera})
+            if imagenes:
+                self.registrar_imagenes(solicitud, imagenes)
+            return resultado
+        
+        def al_fallar(solicitud, error):
+            # Ceder el turno para no bloquear las preguntas siguientes de la conversación
+            if conversacion is not None:
+                conversacion.liberar(turno)
+            self.respuesta_fallida(solicitud, error)
+        
+        solicitud = self.planificador.enviar(procesar_respuesta, descripcion=pregunta,
+                                             al_terminar=self.actualizar_respuesta,
+                                             al_fallar=al_fallar)
+        if solicitud is None:
+            if conversacion is not None:
+                conversacion.liberar(turno)
+            self.mostrar_aviso("Cola llena: espera a que terminen las preguntas en curso")
+            return
         
-        # Función para procesar la respuesta en un hilo separado
-        def procesar_respuesta():
-            respuesta = self.obtener_respuesta(pregunta)
-            
-            # Actualizar la GUI en el hilo principal
-            self.root.after(0, self.actualizar_respuesta, respuesta)
+        # La entrada queda libre para seguir escribiendo
+        self.pregunta_entry.delete(0, tk.END)
+        self.abrir_respuesta(solicitud.id, pregunta, nombre_modelo)
+        self.actualizar_cola()
+
+    def al_escribir(self, event=None):
+        # Se especula cuando el usuario hace una pausa, no con cada tecla
+        if not self.especulacion_activa:
+            return
+        if self.especulacion_pendiente is not None:
+            self.root.after_cancel(self.especulacion_pendiente)
+        self.especulacion_pendiente = self.root.after(ESPERA_ESPECULACION_MS, self.especular)
+
+    def especular(self):
+        # Adelanta lo que hará hacer_pregunta: codificar las imágenes y contar los tokens del mensaje.
+        # La llamada a countTokens, además, mantiene abierta la conexión que usará la pregunta
+        self.especulacion_pendiente = None
+        self.especulacion_id += 1
+        especulacion_id = self.especulacion_id
+        pregunta = self.pregunta_entry.get().strip()
+        if not pregunta:
+            self.tokens_status.config(text="")
+            return
         
-        # Iniciar el procesamiento en un hilo separado
-        threading.Thread(target=procesar_respuesta, daemon=True).start()
+        nombre_modelo = self.modelo_var.get()
+        imagenes = list(self.imagenes_cargadas)
+        if imagenes:
+            nombre_modelo = self.catalogo.modelo_para_imagenes(nombre_modelo) or nombre_modelo
+            # Relanza las codificaciones que la caché haya descartado o cuyo archivo haya cambiado
+            self.codificaciones.precargar(imagenes)
+        contexto = self.conversacion.tokens_totales if self.contexto_var.get() else 0
+        
+        def tarea():
+            # Una pausa posterior ya tiene su propia especulación en cola
+            if especulacion_id != self.especulacion_id:
+                return
+            try:
+                tokens = contar_tokens(nombre_modelo, pregunta, plazo=5)
+                exacto = True
+            except Exception:
+                tokens = estimar_tokens([pregunta])
+                exacto = False
+            for ruta in imagenes:
+                try:
+                    # Espera a que termine la codificación: al preguntar ya estará lista
+                    tokens += estimar_tokens(self.codificaciones.obtener(ruta))
+                    exacto = False
+                except Exception:
+                    # El error de la imagen lo informará la pregunta
+                    pass
+            self.planificador.entregar(self.mostrar_tokens, especulacion_id, nombre_modelo, contexto + tokens,
+                                       exacto)
+        self.ejecutor_especulacion.submit(tarea)
 
-    def actualizar_respuesta(self, respuesta_data):
+    def mostrar_tokens(self, especulacion_id, nombre_modelo, tokens, exacto):
+        if especulacion_id != self.especulacion_id:
+            return
+        texto = f"🧮 {'' if exacto else '≈'}{tokens} tokens"
+        info = self.catalogo.info(nombre_modelo)
+        if info and info.get("tokens_entrada") and tokens > info["tokens_entrada"]:
+            self.tokens_status.config(text=f"{texto} (máx. {info['tokens_entrada']})", foreground="red")
+        else:
+            self.tokens_status.config(text=texto, foreground="gray")
+
+    def abrir_respuesta(self, solicitud_id, pregunta, nombre_modelo):
+        # Mostrar la pregunta y abrir su respuesta vacía, que se irá completando con el streaming
+        pregunta_id = self.transcripcion.agregar("usuario", pregunta, modelo=nombre_modelo)
+        respuesta_id = self.transcripcion.agregar("modelo", modelo=nombre_modelo)
+        self.mensajes_abiertos[solicitud_id] = (pregunta_id, respuesta_id)
+    
+    def registrar_imagenes(self, solicitud, imagenes):
+        # Huella de cada imagen enviada para el historial (se calcula en el hilo de trabajo)
+        try:
+            solicitud.datos["imagenes"] = [
+                hashlib.sha256(b"".join(parte["data"] for parte in self.codificaciones.obtener(ruta))).hexdigest()
+                for ruta in imagenes]
+        except Exception:
+            # El error de la imagen lo informa obtener_respuesta
+            pass
+
+    def bombear_eventos(self):
+        """Único punto en el que los hilos de trabajo entregan resultados al hilo de Tk"""
+        self.vaciar_stream()
+        self.planificador.bombear()
+        if self.planificador.version != self.version_cola:
+            self.actualizar_cola()
+        self.actualizar_panel_metricas()
+        self.root.after(INTERVALO_STREAM_MS, self.bombear_eventos)
+
+    def vaciar_stream(self):
+        """Inserta de una vez los fragmentos acumulados para no saturar Tk"""
+        fragmentos = {}
+        while True:
+            try:
+                respuesta_id, fragmento = self.cola_stream.get_nowait()
+            except queue.Empty:
+                break
+            fragmentos.setdefault(respuesta_id, []).append(fragmento)
+        
+        for respuesta_id, partes in fragmentos.items():
+            # Ignorar fragmentos tardíos de respuestas ya cerradas
+            if respuesta_id not in self.mensajes_abiertos:
+                continue
+            self.transcripcion.anexar(self.mensajes_abiertos[respuesta_id][1], "".join(partes))
+
+    def actualizar_cola(self):
+        # Redibujar la lista de preguntas en cola y en curso
+        self.version_cola = self.planificador.version
+        pendientes = self.planificador.pendientes()
+        self.cola_list.delete(0, tk.END)
+        self.cola_ids = []
+        for solicitud in pendientes:
+            icono = "⏳" if solicitud.estado == EN_COLA else "⚙️"
+            self.cola_list.insert(tk.END, f"{icono} #{solicitud.id} {solicitud.descripcion[:80]}")
+            self.cola_ids.append(solicitud.id)
+        self.detener_btn.configure(state='normal' if pendientes else 'disabled')
+
+    def detener_respuesta(self):
+        # Cancelar la pregunta seleccionada o, si no hay selección, la más antigua
+        seleccion = self.cola_list.curselection()
+        if seleccion:
+            solicitud_id = self.cola_ids[seleccion[0]]
+        elif self.cola_ids:
+            solicitud_id = self.cola_ids[0]
+        else:
+            return
+        self.planificador.cancelar(solicitud_id)
+
+    def respuesta_fallida(self, solicitud, error):
+        # Cerrar la respuesta cancelada, caducada o fallida conservando lo ya mostrado
+        self.vaciar_stream()
+        mostrado = ""
+        if solicitud.id in self.mensajes_abiertos:
+            mostrado = self.transcripcion.almacen.obtener(self.mensajes_abiertos[solicitud.id][1])["texto"]
+        if solicitud.estado == CANCELADA:
+            self.actualizar_respuesta(solicitud, (mostrado + "\n⏹ Respuesta interrumpida", SENTIMIENTO_NEUTRAL))
+        elif solicitud.estado == CADUCADA:
+            self.actualizar_respuesta(solicitud, (f"{mostrado}\n⌛ {str(error)}", SENTIMIENTO_NEUTRAL))
+        else:
+            self.actualizar_respuesta(solicitud, (f"Error al generar respuesta: {str(error)}", "TRISTE 😢"))
+
+    def actualizar_respuesta(self, solicitud, respuesta_data):
         # Desempaquetar la respuesta y el sentimiento
         if isinstance(respuesta_data, tuple):
             respuesta, sentimiento = respuesta_data
         else:
             respuesta = respuesta_data
-            sentimiento = "NEUTRAL 😐"
-        
-        # Incrementar el ID de respuesta
-        self.ultima_respuesta_id += 1
-        respuesta_id = self.ultima_respuesta_id
-        
-        # Crear frame para la respuesta y botones
-        respuesta_frame = ttk.Frame(self.respuesta_text)
-        
-        # Mostrar la respuesta con el sentimiento
-        self.respuesta_text.configure(state='normal')
-        self.respuesta_text.insert(tk.END, f"\n🤖 Gemini [{sentimiento}]: {respuesta}\n")
-        
-        # Crear y mostrar los botones de evaluación
-        likes_btn = ttk.Button(respuesta_frame, text="👍", 
-                             command=lambda: self.evaluar_respuesta(respuesta_id, True))
-        likes_btn.pack(side=tk.LEFT, padx=2)
-        
-        dislikes_btn = ttk.Button(respuesta_frame, text="👎", 
-                                 command=lambda: self.evaluar_respuesta(respuesta_id, False))
-        dislikes_btn.pack(side=tk.LEFT, padx=2)
-        
-        # Etiqueta para mostrar la evaluación
-        eval_label = ttk.Label(respuesta_frame, text="")
-        eval_label.pack(side=tk.LEFT, padx=5)
-        
-        # Guardar referencias para actualización
-        self.respuestas_evaluadas[respuesta_id] = {
-            "texto": respuesta,
-            "frame": respuesta_frame,
-            "label": eval_label,
-            "evaluacion": None
-        }
-        
-        # Insertar el frame en el texto
-        self.respuesta_text.window_create(tk.END, window=respuesta_frame)
-        self.respuesta_text.insert(tk.END, "\n\n")
-        self.respuesta_text.see(tk.END)
-        self.respuesta_text.configure(state='disabled')
-        
-        # Limpiar y rehabilitar la entrada
-        self.pregunta_entry.delete(0, tk.END)
-        self.pregunta_entry.configure(state='normal')
-        self.enviar_btn.configure(state='normal')
-        self.cargar_btn.configure(state='normal')
-        self.grabar_btn.configure(state='normal')
-        self.pregunta_entry.focus()
-
-    def evaluar_respuesta(self, respuesta_id, es_positiva):
-        if respuesta_id in self.respuestas_evaluadas:
-            respuesta = self.respuestas_evaluadas[respuesta_id]
-            evaluacion_previa = respuesta["evaluacion"]
-            
-            # Actualizar contadores si hay cambio de evaluación
-            if evaluacion_previa is not None:
-                if evaluacion_previa:
-                    self.calificaciones["likes"] -= 1
-                else:
-                    self.calificaciones["dislikes"] -= 1
-            
-            # Actualizar con la nueva evaluación
-            respuesta["evaluacion"] = es_positiva
-            if es_positiva:
-                self.calificaciones["likes"] += 1
-                texto_eval = "¡Gracias por tu evaluación positiva! 🌟"
-            else:
-                self.calificaciones["dislikes"] += 1
-                texto_eval = "Gracias por tu retroalimentación 📝"
-            
-            # Actualizar la etiqueta
-            respuesta["label"].configure(text=texto_eval)
+            sentimiento = SENTIMIENTO_NEUTRAL
+        
+        # Mostrar lo que quede pendiente del streaming y cerrar la respuesta
+        self.vaciar_stream()
+        abiertos = self.mensajes_abiertos.pop(solicitud.id, None)
+        if abiertos is None:
+            return
+        pregunta_id, mensaje_id = abiertos
+        if solicitud.datos.get("imagenes"):
+            self.transcripcion.almacen.actualizar(pregunta_id, imagenes=solicitud.datos["imagenes"])
+        
+        # Completar la respuesta; los botones de evaluación aparecen al quedar completa
+        latencia = None
+        if solicitud.iniciada is not None and solicitud.terminada is not None:
+            latencia = round(solicitud.terminada - solicitud.iniciada, 3)
+        self.transcripcion.completar(mensaje_id, respuesta, latencia=latencia)
+        
+        # Los errores traen su sentimiento; el resto se analiza en segundo plano
+        if sentimiento is not None:
+            self.transcripcion.fijar_sentimiento(mensaje_id, sentimiento)
+        else:
+            self.analizar_sentimiento_async(mensaje_id, respuesta)
+        
+        self.actualizar_estado_cache()
+        self.actualizar_estado_contexto()
+
+    def actualizar_panel_metricas(self):
+        # Redibujar como mucho una vez por segundo y solo si hay mediciones nuevas
+        metricas = obtener_metricas()
+        ahora = time.monotonic()
+        if metricas.version == self.version_metricas or ahora - self.ultimo_panel < 1.0:
+            return
+        self.version_metricas = metricas.version
+        self.ultimo_panel = ahora
+        
+        def formatear(valor, unidad):
+            return f"{valor:6.2f} s" if unidad == "s" else f"{int(valor):6d}  "
+        
+        lineas = []
+        resumen = metricas.resumen("gui")
+        for campo, nombre, unidad in PANEL_METRICAS:
+            valores = resumen[campo]
+            if valores["n"]:
+                lineas.append(f"{nombre:<15} p50 {formatear(valores['p50'], unidad)} · "
+                              f"p95 {formatear(valores['p95'], unidad)} · p99 {formatear(valores['p99'], unidad)}")
+        sentimiento = metricas.resumen("sentimiento")["total"]
+        if sentimiento["n"]:
+            lineas.append(f"{'Sentimiento':<15} p50 {formatear(sentimiento['p50'], 's')} · "
+                          f"p95 {formatear(sentimiento['p95'], 's')} · p99 {formatear(sentimiento['p99'], 's')}")
+        errores = ", ".join(f"{clase}×{n}" for clase, n in resumen["errores"].items()) or "ninguno"
+        lineas.append(f"💾 Caché {resumen['tasa_cache'] * 100:.0f}% · 🔗 Unidas {resumen['tasa_coalescida'] * 100:.0f}% · ❌ Errores: {errores} · "
+                      f"{resumen['ventana']} de {resumen['peticiones']} peticiones")
+        self.metricas_label.config(text="\n".join(lineas))
+
+    def actualizar_estado_contexto(self):
+        self.contexto_status.config(
+            text=f"🧮 Contexto: {self.conversacion.tokens_totales} / {self.conversacion.limite_tokens} tokens")
+
+    def nueva_conversacion(self):
+        # Las preguntas en curso terminan sobre la conversación anterior
+        self.conversacion = Conversacion(self.modelo_var.get())
+        self.actualizar_estado_contexto()
+        self.transcripcion.agregar("sistema", "\n🆕 Nueva conversación: el oráculo ya no recuerda lo anterior\n\n")
+
+    def buscar_historial(self):
+        # Buscar en el índice de texto completo de todas las sesiones guardadas
+        consulta = self.busqueda_entry.get().strip()
+        if not consulta:
+            return
+        try:
+            resultados = obtener_historial().buscar(consulta)
+        except Exception as e:
+            self.mostrar_aviso(f"Error al buscar: {str(e)}")
+            return
+        
+        ventana = tk.Toplevel(self.root)
+        ventana.title(f"🔎 {consulta}")
+        ventana.geometry("800x400")
+        lista = tk.Listbox(ventana)
+        lista.pack(fill="both", expand=True, padx=10, pady=10)
+        if not resultados:
+            lista.insert(tk.END, "Sin resultados")
+        for resultado in resultados:
+            fecha = time.strftime("%Y-%m-%d %H:%M", time.localtime(resultado["creado"]))
+            icono = "❓" if resultado["rol"] == "usuario" else "🤖"
+            fragmento = " ".join(resultado["fragmento"].split())
+            lista.insert(tk.END, f"{fecha} · sesión {resultado['sesion']} · {icono} {fragmento}")
+
+    def actualizar_estado_cache(self):
+        estadisticas = obtener_cache().estadisticas()
+        self.cache_status.config(
+            text=f"💾 Caché: {estadisticas['aciertos']} aciertos ({estadisticas['semanticos']} por parecido) / {estadisticas['fallos']} fallos")
+
+    def comparar_modelos(self):
+        # Ventana para elegir los modelos y ver sus respuestas lado a lado
+        pregunta = self.pregunta_entry.get().strip()
+        if not pregunta:
+            self.mostrar_aviso("Escribe una pregunta para comparar modelos")
+            return
+        
+        ventana = tk.Toplevel(self.root)
+        ventana.title("⚖️ Comparar modelos")
+        ventana.geometry("1200x600")
+        
+        ttk.Label(ventana, text=f"❓ {pregunta}", wraplength=1150).pack(anchor="w", padx=10, pady=5)
+        
+        # Selección de modelos
+        seleccion_frame = ttk.Frame(ventana)
+        seleccion_frame.pack(fill="x", padx=10)
+        variables = {}
+        # Con imágenes cargadas solo se ofrecen los modelos que las aceptan
+        modelos = self.catalogo.nombres(vision=True if self.imagenes_cargadas else None)
+        for i, modelo in enumerate(modelos):
+            variables[modelo] = tk.BooleanVar(value=(i < 3))
+            ttk.Checkbutton(seleccion_frame, text=modelo, variable=variables[modelo]).pack(side="left", padx=2)
+        
+        resultados_frame = ttk.Frame(ventana)
+        resultados_frame.pack(fill="both", expand=True, padx=10, pady=5)
+        
+        def enviar():
+            modelos = [modelo for modelo, var in variables.items() if var.get()]
+            if not modelos:
+                return
+            enviar_btn.configure(state='disabled')
+            self.lanzar_comparacion(pregunta, modelos, resultados_frame)
+        
+        enviar_btn = ttk.Button(seleccion_frame, text="Comparar", command=enviar, style="Custom.TButton")
+        enviar_btn.pack(side="left", padx=10)
+
+    def lanzar_comparacion(self, pregunta, modelos, resultados_frame):
+        # Una columna por modelo; cada una se rellena cuando su modelo termina
+        columnas = {}
+        for i, modelo in enumerate(modelos):
+            columna = ttk.LabelFrame(resultados_frame, text=modelo, padding="5")
+            columna.grid(row=0, column=i, sticky="nsew", padx=2)
+            resultados_frame.columnconfigure(i, weight=1)
+            estado = ttk.Label(columna, text="⏳ Esperando respuesta...")
+            estado.pack(anchor="w")
+            texto = scrolledtext.ScrolledText(columna, width=30, height=20, wrap=tk.WORD)
+            texto.pack(fill="both", expand=True)
+            texto.configure(state='disabled')
+            columnas[modelo] = (estado, texto)
+        resultados_frame.rowconfigure(0, weight=1)
+        
+        imagenes = list(self.imagenes_cargadas)
+        usar_cache = self.cache_var.get()
+        
+        def preparar_contenido(modelo):
+            # Como en obtener_respuesta: si las imágenes no caben en una petición, se reparten en
+            # subpeticiones a ese modelo
+            if not imagenes:
+                return pregunta
+            return preparar_contenido_imagenes(modelo, pregunta, [self.codificaciones.obtener(ruta) for ruta in imagenes],
+                                               usar_cache=usar_cache, medicion={})
+        
+        def al_terminar_modelo(modelo, respuesta, error, segundos):
+            self.planificador.entregar(self.mostrar_comparacion, columnas, modelo, respuesta, error, segundos)
+        
+        if self.motor is None:
+            self.motor = MotorAsync()
+        self.motor.comparar(modelos, preparar_contenido, al_terminar_modelo, usar_cache)
+
+    def mostrar_comparacion(self, columnas, modelo, respuesta, error, segundos):
+        estado, texto = columnas[modelo]
+        # La ventana pudo cerrarse antes de que llegara la respuesta
+        if not texto.winfo_exists():
+            return
+        if error is not None:
+            estado.configure(text=f"❌ Error ({segundos:.1f} s)", foreground="red")
+            respuesta = str(error)
+        else:
+            estado.configure(text=f"✓ {segundos:.1f} s", foreground="green")
+        texto.configure(state='normal')
+        texto.insert(tk.END, respuesta)
+        texto.configure(state='disabled')
+
+    def clave_respuesta(self, mensaje_id):
+        # La fila del historial identifica la respuesta entre ejecuciones
+        fila = self.transcripcion.almacen.filas[mensaje_id]
+        return f"h{fila}" if fila is not None else f"{self.ejecucion}:{mensaje_id}"
+
+    def evaluar_respuesta(self, mensaje_id, es_positiva):
+        respuesta = self.transcripcion.almacen.obtener(mensaje_id)
+        if respuesta["rol"] == "modelo":
+            # Guardarla en el mensaje y actualizar la etiqueta si está a la vista
+            self.transcripcion.fijar_evaluacion(mensaje_id, es_positiva)
             
-            # Actualizar el título de la ventana con las estadísticas
-            total_evaluaciones = self.calificaciones["likes"] + self.calificaciones["dislikes"]
-            if total_evaluaciones > 0:
-                porcentaje_positivo = (self.calificaciones["likes"] / total_evaluaciones) * 100
-                self.root.title(f"🔮 Oráculo de Gemini - Satisfacción: {porcentaje_positivo:.1f}% 👍")
+            # Añadirla al registro persistente, que actualiza los agregados por modelo, sentimiento y día
+            modelo = respuesta["modelo"] or self.modelo_var.get()
+            obtener_calificaciones().calificar(self.clave_respuesta(mensaje_id), modelo, es_positiva,
+                                               respuesta["sentimiento"])
+            self.actualizar_titulo(modelo)
+
+    def actualizar_titulo(self, modelo=None):
+        # Satisfacción acumulada de todas las sesiones (y la del modelo), leída de los agregados
+        calificaciones = obtener_calificaciones()
+        total = calificaciones.resumen()
+        if total["satisfaccion"] is None:
+            return
+        titulo = f"🔮 Oráculo de Gemini - Satisfacción: {total['satisfaccion']:.1f}% 👍"
+        modelo = modelo or self.modelo_var.get()
+        del_modelo = calificaciones.resumen(modelo)
+        if del_modelo["satisfaccion"] is not None:
+            titulo += f" · {modelo}: {del_modelo['satisfaccion']:.1f}%"
+        self.root.title(titulo)
+
+    def mostrar_calificaciones(self):
+        # Agregados por modelo, sentimiento y día, sin recorrer el registro de calificaciones
+        calificaciones = obtener_calificaciones()
+        ventana = tk.Toplevel(self.root)
+        ventana.title("👍 Calificaciones")
+        ventana.geometry("600x450")
+        
+        tabla = ttk.Treeview(ventana, columns=("likes", "dislikes", "satisfaccion"))
+        tabla.heading("likes", text="👍")
+        tabla.heading("dislikes", text="👎")
+        tabla.heading("satisfaccion", text="Satisfacción")
+        for columna in ("likes", "dislikes", "satisfaccion"):
+            tabla.column(columna, width=90, anchor="e")
+        tabla.pack(fill="both", expand=True, padx=10, pady=10)
+        
+        def valores(resumen):
+            porcentaje = resumen["satisfaccion"]
+            return (resumen["likes"], resumen["dislikes"], f"{porcentaje:.1f}%" if porcentaje is not None else "—")
+        
+        tabla.insert("", tk.END, text="Total", values=valores(calificaciones.resumen()))
+        for titulo, dimension, ultimos in (("Por modelo", "modelo", None), ("Por sentimiento", "sentimiento", None),
+                                           ("Últimos 30 días", "dia", 30)):
+            grupo = tabla.insert("", tk.END, text=titulo, open=True)
+            for clave, resumen in calificaciones.por(dimension, ultimos).items():
+                tabla.insert(grupo, tk.END, text=clave, values=valores(resumen))
+        
+        def exportar_calificaciones():
+            archivo = filedialog.asksaveasfilename(
+                parent=ventana,
+                defaultextension=".csv",
+                filetypes=[("CSV", "*.csv"), ("JSON", "*.json")],
+                initialfile=f"calificaciones_{time.strftime('%Y%m%d')}",
+                title="Exportar calificaciones como"
+            )
+            if not archivo:
+                return
+            try:
+                calificaciones.exportar(archivo)
+                messagebox.showinfo("Éxito", f"Calificaciones exportadas a:\n{archivo}", parent=ventana)
+            except OSError as e:
+                messagebox.showerror("Error", f"Error al exportar las calificaciones:\n{str(e)}", parent=ventana)
+        
+        ttk.Button(ventana, text="📝 Exportar", command=exportar_calificaciones,
+                   style="Custom.TButton").pack(pady=(0, 10))
 
     def toggle_grabacion(self):
         if not self.is_recording:
-            # Iniciar grabación
+            # Iniciar grabación: termina sola cuando el detector de voz oye el silencio final
+            if self.voz is None:
+                from voz import EscuchaContinua
+                self.voz = EscuchaContinua()
             self.is_recording = True
-            self.grabar_btn.configure(state='disabled')
-            self.indicador_grabacion.configure(text="🎙️ Grabando...")
-            threading.Thread(target=self.grabar_audio, daemon=True).start()
+            self.indicador_grabacion.configure(text="🎙️ Escuchando...")
+            self.voz.escuchar(
+                lambda texto: self.planificador.entregar(self.mostrar_parcial, texto),
+                lambda texto: self.planificador.entregar(self.procesar_audio, texto),
+                lambda mensaje: self.planificador.entregar(self.mostrar_error_audio, mensaje))
         else:
-            # Detener grabación
-            self.is_recording = False
-            self.indicador_grabacion.configure(text="")
-            
-    def grabar_audio(self):
-        with sr.Microphone() as source:
-            self.recognizer.adjust_for_ambient_noise(source)
-            try:
-                audio = self.recognizer.listen(source, timeout=5)
-                texto = self.recognizer.recognize_google(audio, language="es-ES")
-                self.root.after(0, self.procesar_audio, texto)
-            except sr.WaitTimeoutError:
-                self.root.after(0, self.mostrar_error_audio, "No se detectó ninguna voz")
-            except sr.UnknownValueError:
-                self.root.after(0, self.mostrar_error_audio, "No se pudo entender el audio")
-            except sr.RequestError:
-                self.root.after(0, self.mostrar_error_audio, "Error al conectar con el servicio de reconocimiento")
-            except Exception as e:
-                self.root.after(0, self.mostrar_error_audio, f"Error: {str(e)}")
-            finally:
-                self.root.after(0, self.finalizar_grabacion)
-                
+            # Detener grabación: se reconoce lo dicho hasta ahora
+            self.voz.detener()
+            self.indicador_grabacion.configure(text="⏳ Reconociendo...")
+    
+    def mostrar_parcial(self, texto):
+        # Transcripción parcial mientras se habla
+        if not self.is_recording:
+            return
+        self.pregunta_entry.delete(0, tk.END)
+        self.pregunta_entry.insert(0, texto)
+        # El dictado cuenta como escritura: se especula en las pausas igual que al teclear
+        self.al_escribir()
+        
     def procesar_audio(self, texto):
+        self.finalizar_grabacion()
         self.pregunta_entry.delete(0, tk.END)
         self.pregunta_entry.insert(0, texto)
         self.hacer_pregunta()
         
     def mostrar_error_audio(self, mensaje):
+        self.finalizar_grabacion()
+        self.mostrar_aviso(mensaje)
+        
+    def mostrar_aviso(self, mensaje):
         self.indicador_grabacion.configure(text=f"❌ {mensaje}")
         self.root.after(2000, lambda: self.indicador_grabacion.configure(text=""))
         
     def finalizar_grabacion(self):
         self.is_recording = False
-        self.grabar_btn.configure(state='normal')
         self.indicador_grabacion.configure(text="")
     
     def exportar_conversacion(self):
         # Obtener la fecha y hora actual para el nombre del archivo
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         
-        # Preguntar al usuario qué formato desea usar
-        formatos = [
-            ("Archivo de texto", "*.txt"),
-            ("Documento PDF", "*.pdf")
-        ]
-        
         archivo = filedialog.asksaveasfilename(
             defaultextension=".txt",
-            filetypes=formatos,
+            filetypes=FORMATOS_EXPORTACION,
             initialfile=f"conversacion_gemini_{timestamp}",
             title="Guardar conversación como"
         )
@@ -441,95 +967,50 @@ class OracleGUI:
         if not archivo:
             return
         
-        # Obtener el contenido del área de texto
-        contenido = self.respuesta_text.get("1.0", tk.END)
+        # reportlab solo hace falta para PDF; si no está, ofrecer instalarlo
+        instalar = False
+        if archivo.endswith('.pdf') and importlib.util.find_spec('reportlab') is None:
+            if not messagebox.askyesno("Instalar Dependencia", 
+                                       "Se requiere instalar 'reportlab' para crear PDFs. " +
+                                       "¿Deseas instalarlo ahora?"):
+                return
+            instalar = True
+            self.transcripcion.agregar("sistema", "\n⚙️ Instalando reportlab...\n")
+        
+        # Copia hecha aquí, en el hilo de Tk: el almacén sigue cambiando mientras se exporta y las
+        # respuestas que aún se están recibiendo (completo=False) no entran
+        mensajes = [dict(mensaje) for mensaje in self.transcripcion.almacen if mensaje["completo"]]
+        total = len(mensajes)
+        
+        def al_progresar(hechos, total):
+            self.planificador.entregar(self.mostrar_progreso_exportacion, hechos, total)
+        
+        def tarea():
+            try:
+                if instalar:
+                    import subprocess
+                    subprocess.check_call([sys.executable, "-m", "pip", "install", "reportlab"])
+                    importlib.invalidate_caches()
+                exportar(mensajes, archivo, total, al_progresar)
+                self.planificador.entregar(self.exportacion_terminada, archivo, None)
+            except Exception as e:
+                self.planificador.entregar(self.exportacion_terminada, archivo, e)
         
-        try:
-            if archivo.endswith('.txt'):
-                # Exportar como TXT
-                with open(archivo, 'w', encoding='utf-8') as f:
-                    f.write("🔮 Conversación con Gemini 🔮\n")
-                    f.write("=" * 40 + "\n\n")
-                    f.write(contenido)
-                    
-            elif archivo.endswith('.pdf'):
-                try:
-                    from reportlab.lib.pagesizes import A4
-                    from reportlab.lib import colors
-                    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-                    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-                    
-                    # Crear el documento PDF
-                    doc = SimpleDocTemplate(archivo, pagesize=A4)
-                    story = []
-                    
-                    # Estilos
-                    styles = getSampleStyleSheet()
-                    title_style = ParagraphStyle(
-                        'CustomTitle',
-                        parent=styles['Title'],
-                        fontSize=24,
-                        spaceAfter=30
-                    )
-                    
-                    # Título
-                    story.append(Paragraph("🔮 Conversación con Gemini 🔮", title_style))
-                    story.append(Spacer(1, 12))
-                    
-                    # Contenido
-                    for linea in contenido.split('\n'):
-                        if linea.strip():
-                            if linea.startswith('❓'):
-                                # Estilo para preguntas
-                                style = ParagraphStyle(
-                                    'Pregunta',
-                                    parent=styles['Normal'],
-                                    textColor=colors.blue,
-                                    fontSize=12,
-                                    spaceAfter=8
-                                )
-                            elif linea.startswith('🤖'):
-                                # Estilo para respuestas
-                                style = ParagraphStyle(
-                                    'Respuesta',
-                                    parent=styles['Normal'],
-                                    textColor=colors.black,
-                                    fontSize=11,
-                                    spaceAfter=12,
-                                    leftIndent=20
-                                )
-                            else:
-                                # Estilo normal
-                                style = styles['Normal']
-                            
-                            story.append(Paragraph(linea, style))
-                            story.append(Spacer(1, 6))
-                    
-                    # Generar el PDF
-                    doc.build(story)
-                    
-                except ImportError:
-                    # Si reportlab no está instalado, sugerir instalación
-                    if messagebox.askyesno("Instalar Dependencia", 
-                                         "Se requiere instalar 'reportlab' para crear PDFs. " +
-                                         "¿Deseas instalarlo ahora?"):
-                        self.respuesta_text.configure(state='normal')
-                        self.respuesta_text.insert(tk.END, "\n⚙️ Instalando reportlab...\n")
-                        self.respuesta_text.configure(state='disabled')
-                        self.respuesta_text.see(tk.END)
-                        
-                        # Instalar reportlab usando pip
-                        import subprocess
-                        subprocess.check_call([sys.executable, "-m", "pip", "install", "reportlab"])
-                        
-                        # Reintentar la exportación
-                        self.exportar_conversacion()
-                        return
-            
+        self.exportar_btn.configure(state='disabled')
+        self.exportar_progreso.configure(maximum=max(total, 1), value=0)
+        self.exportar_progreso.pack(side="left", padx=5)
+        self.ejecutor_exportacion.submit(tarea)
+    
+    def mostrar_progreso_exportacion(self, hechos, total):
+        self.exportar_progreso.configure(value=hechos)
+    
+    def exportacion_terminada(self, archivo, error):
+        self.exportar_progreso.pack_forget()
+        self.exportar_btn.configure(state='normal')
+        if error is None:
             messagebox.showinfo("Éxito", f"Conversación exportada exitosamente a:\n{archivo}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al exportar la conversación:\n{str(e)}")
+        else:
+            messagebox.showerror("Error", f"Error al exportar la conversación:\n{str(error)}")
 
 def main():
     root = tk.Tk()
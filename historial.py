@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import pathlib
+import sqlite3
+import threading
+
+# Ruta por defecto del historial de conversaciones
+historial_path = pathlib.Path('.') / '.cache' / 'historial.sqlite3'
+
+# Campos de un mensaje que se guardan en disco
+COLUMNAS = ("rol", "modelo", "texto", "creado", "latencia", "sentimiento", "evaluacion", "imagenes")
+
+
+class AlmacenMensajes:
+    """Mensajes de la conversación, independientes de cómo y cuántos se estén mostrando"""
+
+    def __init__(self):
+        self.mensajes = []
+
+    def agregar(self, rol, texto="", **datos):
+        """Añade un mensaje ("usuario", "modelo" o "sistema") y lo devuelve con su id"""
+        mensaje = {"id": len(self.mensajes), "rol": rol, "texto": texto, "creado": time.time(),
+                   "sentimiento": None, "evaluacion": None, "completo": rol != "modelo"}
+        mensaje.update(datos)
+        self.mensajes.append(mensaje)
+        return mensaje
+
+    def obtener(self, mensaje_id):
+        return self.mensajes[mensaje_id]
+
+    def actualizar(self, mensaje_id, **datos):
+        self.mensajes[mensaje_id].update(datos)
+
+    def __len__(self):
+        return len(self.mensajes)
+
+    def __getitem__(self, indice):
+        return self.mensajes[indice]
+
+    def __iter__(self):
+        return iter(self.mensajes)
+
+
+def formatear_mensaje(mensaje):
+    """Texto de un mensaje tal como se muestra y se exporta"""
+    if mensaje["rol"] == "usuario":
+        return f"\n❓ Tú: {mensaje['texto']}\n"
+    if mensaje["rol"] == "modelo":
+        sentimiento = f" [{mensaje['sentimiento']}]" if mensaje["sentimiento"] else ""
+        return f"\n🤖 Gemini{sentimiento}: {mensaje['texto']}\n\n"
+    return mensaje["texto"]
+
+
+def consulta_fts(texto):
+    """Convierte lo que escribe el usuario en una consulta FTS5 sin operadores (todas las palabras)"""
+    palabras = [palabra.replace('"', '""') for palabra in texto.split()]
+    return " ".join(f'"{palabra}"' for palabra in palabras)
+
+
+class Historial:
+    """Conversaciones guardadas en SQLite, turno a turno, con un índice de texto completo (FTS5)"""
+
+    def __init__(self, ruta=historial_path):
+        self.lock = threading.Lock()
+        pathlib.Path(ruta).parent.mkdir(parents=True, exist_ok=True)
+        self.conexion = sqlite3.connect(str(ruta), check_same_thread=False)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        # En WAL basta con sincronizar en los checkpoints: cada mensaje no espera al disco
+        self.conexion.execute("PRAGMA synchronous=NORMAL")
+        self.conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS sesiones (
+                id INTEGER PRIMARY KEY,
+                origen TEXT NOT NULL,
+                creada REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mensajes (
+                id INTEGER PRIMARY KEY,
+                sesion INTEGER NOT NULL REFERENCES sesiones (id),
+                indice INTEGER NOT NULL,
+                rol TEXT NOT NULL,
+                modelo TEXT,
+                texto TEXT NOT NULL,
+                creado REAL NOT NULL,
+                latencia REAL,
+                sentimiento TEXT,
+                evaluacion INTEGER,
+                imagenes TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_mensajes_sesion ON mensajes (sesion, indice);
+            CREATE VIRTUAL TABLE IF NOT EXISTS mensajes_fts USING fts5(
+                texto, content='mensajes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS mensajes_ai AFTER INSERT ON mensajes BEGIN
+                INSERT INTO mensajes_fts (rowid, texto) VALUES (new.id, new.texto);
+            END;
+            CREATE TRIGGER IF NOT EXISTS mensajes_ad AFTER DELETE ON mensajes BEGIN
+                INSERT INTO mensajes_fts (mensajes_fts, rowid, texto) VALUES ('delete', old.id, old.texto);
+            END;
+            CREATE TRIGGER IF NOT EXISTS mensajes_au AFTER UPDATE OF texto ON mensajes BEGIN
+                INSERT INTO mensajes_fts (mensajes_fts, rowid, texto) VALUES ('delete', old.id, old.texto);
+                INSERT INTO mensajes_fts (rowid, texto) VALUES (new.id, new.texto);
+            END;
+        """)
+        self.conexion.commit()
+
+    def nueva_sesion(self, origen):
+        with self.lock:
+            cursor = self.conexion.execute(
+                "INSERT INTO sesiones (origen, creada) VALUES (?, ?)", (origen, time.time()))
+            self.conexion.commit()
+            return cursor.lastrowid
+
+    def guardar_mensaje(self, sesion, mensaje):
+        """Inserta un mensaje de la sesión y devuelve su fila"""
+        valores = [_columna(mensaje.get(columna)) for columna in COLUMNAS]
+        with self.lock:
+            cursor = self.conexion.execute(
+                f"INSERT INTO mensajes (sesion, indice, {', '.join(COLUMNAS)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in COLUMNAS)})",
+                [sesion, mensaje["id"]] + valores)
+            self.conexion.commit()
+            return cursor.lastrowid
+
+    def actualizar_mensaje(self, fila, **datos):
+        campos = [columna for columna in COLUMNAS if columna in datos]
+        if not campos:
+            return
+        with self.lock:
+            self.conexion.execute(
+                f"UPDATE mensajes SET {', '.join(f'{c} = ?' for c in campos)} WHERE id = ?",
+                [_columna(datos[c]) for c in campos] + [fila])
+            self.conexion.commit()
+
+    def buscar(self, texto, limite=50):
+        """Mensajes de cualquier sesión que contienen todas las palabras, los más relevantes primero"""
+        consulta = consulta_fts(texto)
+        if not consulta:
+            return []
+        with self.lock:
+            filas = self.conexion.execute("""
+                SELECT m.sesion, m.indice, m.rol, m.modelo, m.creado,
+                       snippet(mensajes_fts, 0, '«', '»', '…', 16) AS fragmento
+                FROM mensajes_fts JOIN mensajes m ON m.id = mensajes_fts.rowid
+                WHERE mensajes_fts MATCH ?
+                ORDER BY bm25(mensajes_fts)
+                LIMIT ?""", (consulta, limite)).fetchall()
+        return [dict(fila) for fila in filas]
+
+    def mensajes(self, sesion, por_pagina=500):
+        """Mensajes de una sesión en orden, como diccionarios, leídos por páginas"""
+        ultimo = -1
+        while True:
+            with self.lock:
+                filas = self.conexion.execute(
+                    "SELECT * FROM mensajes WHERE sesion = ? AND indice > ? ORDER BY indice LIMIT ?",
+                    (sesion, ultimo, por_pagina)).fetchall()
+            for fila in filas:
+                mensaje = dict(fila)
+                mensaje["imagenes"] = json.loads(mensaje["imagenes"]) if mensaje["imagenes"] else []
+                if mensaje["evaluacion"] is not None:
+                    mensaje["evaluacion"] = bool(mensaje["evaluacion"])
+                yield mensaje
+            if len(filas) < por_pagina:
+                return
+            ultimo = filas[-1]["indice"]
+
+    def contar(self, sesion):
+        with self.lock:
+            return self.conexion.execute(
+                "SELECT COUNT(*) FROM mensajes WHERE sesion = ?", (sesion,)).fetchone()[0]
+
+
+def _columna(valor):
+    # Las listas (huellas de imágenes) se guardan como JSON
+    if isinstance(valor, (list, tuple)):
+        return json.dumps(list(valor))
+    return valor
+
+
+class SesionHistorial(AlmacenMensajes):
+    """Almacén de mensajes que además escribe cada turno en el historial persistente.
+
+    Los fragmentos de streaming solo se acumulan en memoria; el texto llega a disco al completar la
+    respuesta. Los mensajes del sistema (bienvenida, avisos) no se guardan.
+    """
+
+    def __init__(self, origen="gui", historial=None):
+        super().__init__()
+        self.origen = origen
+        self.historial = historial
+        self.sesion = None
+        self.filas = []
+
+    def _historial(self):
+        if self.historial is None:
+            self.historial = obtener_historial()
+        return self.historial
+
+    def agregar(self, rol, texto="", **datos):
+        mensaje = super().agregar(rol, texto, **datos)
+        fila = None
+        if rol != "sistema":
+            try:
+                # La sesión se crea con su primer mensaje: abrir la aplicación no deja sesiones vacías
+                if self.sesion is None:
+                    self.sesion = self._historial().nueva_sesion(self.origen)
+                fila = self._historial().guardar_mensaje(self.sesion, mensaje)
+            except sqlite3.Error as e:
+                print(f"Error al guardar en el historial: {str(e)}")
+        self.filas.append(fila)
+        return mensaje
+
+    def actualizar(self, mensaje_id, **datos):
+        super().actualizar(mensaje_id, **datos)
+        fila = self.filas[mensaje_id]
+        if fila is None:
+            return
+        try:
+            self._historial().actualizar_mensaje(fila, **datos)
+        except sqlite3.Error as e:
+            print(f"Error al guardar en el historial: {str(e)}")
+
+
+_historial = None
+_historial_lock = threading.Lock()
+
+
+def obtener_historial():
+    """Devuelve el historial compartido del proceso, en HISTORIAL_RUTA si está definida"""
+    global _historial
+    if _historial is None:
+        with _historial_lock:
+            if _historial is None:
+                _historial = Historial(os.getenv('HISTORIAL_RUTA', str(historial_path)))
+    return _historial
@@ -0,0 +1,308 @@
+import io
+import os
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Lado máximo útil para el modelo: Gemini reescala internamente las imágenes más grandes
+LADO_MAXIMO = 3072
+CALIDAD_JPEG = 95
+# Por debajo de esta calidad se reduce la resolución en vez de seguir comprimiendo
+CALIDAD_MINIMA = 60
+# Tamaño máximo de cada imagen (o tesela) ya codificada
+MAX_BYTES_IMAGEN = 3 * 1024 * 1024
+
+# La API admite 20 MB por petición con los datos en línea (en base64 con REST); se deja margen
+PRESUPUESTO_PETICION = 16 * 1024 * 1024
+MAX_PARTES_PETICION = 16
+# Subpeticiones simultáneas cuando las imágenes no caben en una sola
+CONCURRENCIA_SUBPETICIONES = 2
+
+# Gemini trocea las imágenes en teselas de 768 px: si al reducir una imagen muy alargada su lado
+# corto quedara por debajo, se corta antes en teselas (con un pequeño solape) para no perder detalle
+LADO_TESELA = 768
+MAX_TESELAS = 8
+SOLAPE_TESELAS = 64
+
+# Lado del recorte con el que se eligen formato y calidad
+LADO_MUESTRA = 512
+
+TIPOS_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def formatos_imagen(preferido=None):
+    """Formatos candidatos según IMAGEN_FORMATO (auto, webp o jpeg) y lo que admita PIL"""
+    preferido = (preferido or os.getenv('IMAGEN_FORMATO', 'auto')).upper()
+    from PIL import features
+    webp = features.check('webp')
+    if preferido == "JPEG" or not webp:
+        return ["JPEG"]
+    return ["WEBP"] if preferido == "WEBP" else ["WEBP", "JPEG"]
+
+
+def _a_rgb(img):
+    # El modelo no necesita la transparencia: se compone sobre blanco (convert('RGB') la dejaría negra)
+    if img.mode in ('RGB', 'L'):
+        return img.copy()
+    if 'A' in img.getbands() or 'transparency' in img.info:
+        from PIL import Image
+        rgba = img.convert('RGBA')
+        fondo = Image.new('RGB', rgba.size, 'white')
+        fondo.paste(rgba, mask=rgba.getchannel('A'))
+        return fondo
+    return img.convert('RGB')
+
+
+def _guardar(img, formato, calidad):
+    salida = io.BytesIO()
+    if formato == "WEBP":
+        img.save(salida, format='WEBP', quality=calidad, method=4)
+    else:
+        img.save(salida, format='JPEG', quality=calidad)
+    return salida.getvalue()
+
+
+def _muestra(img):
+    # Recorte central a resolución completa: tiene la densidad de detalle real de la imagen
+    ancho, alto = min(img.width, LADO_MUESTRA), min(img.height, LADO_MUESTRA)
+    izquierda, arriba = (img.width - ancho) // 2, (img.height - alto) // 2
+    return img.crop((izquierda, arriba, izquierda + ancho, arriba + alto))
+
+
+def comprimir(img, formatos, calidad=CALIDAD_JPEG, max_bytes=MAX_BYTES_IMAGEN):
+    """Devuelve (formato, bytes) con el formato que menos ocupa y la mayor calidad (y si no basta,
+    resolución) que cabe en max_bytes.
+
+    Formato y calidad se eligen codificando un recorte pequeño y escalando por el área: la imagen
+    completa se codifica normalmente una sola vez.
+    """
+    from PIL import Image
+    formato = None
+    techo = calidad
+    correccion = 1.0
+    while True:
+        muestra = _muestra(img)
+        escala = img.width * img.height / (muestra.width * muestra.height)
+        if formato is None:
+            formato = min(formatos, key=lambda f: len(_guardar(muestra, f, calidad)))
+
+        def estimar(q):
+            return correccion * escala * len(_guardar(muestra, formato, q))
+
+        # La mayor calidad con la que se estima que cabe
+        elegida = None
+        if techo >= CALIDAD_MINIMA and estimar(techo) <= max_bytes:
+            elegida = techo
+        else:
+            bajo, alto = CALIDAD_MINIMA, techo - 1
+            while bajo <= alto:
+                medio = (bajo + alto) // 2
+                if estimar(medio) <= max_bytes:
+                    elegida, bajo = medio, medio + 1
+                else:
+                    alto = medio - 1
+        if elegida is None:
+            # Ni con la calidad mínima: el tamaño crece con el área, se reduce el lado en proporción
+            factor = max(0.5, 0.95 * math.sqrt(max_bytes / estimar(CALIDAD_MINIMA)))
+            img = img.resize((max(1, int(img.width * factor)), max(1, int(img.height * factor))), Image.LANCZOS)
+            techo = calidad
+            continue
+        datos = _guardar(img, formato, elegida)
+        if len(datos) <= max_bytes:
+            return formato, datos
+        # La estimación se quedó corta: se corrige con la medida real y se prueba por debajo
+        correccion *= len(datos) / estimar(elegida)
+        techo = elegida - 1
+
+
+def teselas(img, lado_maximo=LADO_MAXIMO):
+    """Corta a lo largo una imagen muy alargada (capturas largas, panorámicas); si no, la devuelve tal cual"""
+    ancho, alto = img.size
+    largo, corto = max(ancho, alto), min(ancho, alto)
+    if largo <= lado_maximo or corto * lado_maximo / largo >= LADO_TESELA:
+        return [img]
+    cantidad = min(MAX_TESELAS, math.ceil(largo / max(lado_maximo, corto)))
+    if cantidad <= 1:
+        return [img]
+    paso = largo / cantidad
+    resultado = []
+    for i in range(cantidad):
+        inicio = max(0, int(i * paso) - SOLAPE_TESELAS)
+        fin = min(largo, int((i + 1) * paso) + SOLAPE_TESELAS)
+        caja = (0, inicio, ancho, fin) if alto >= ancho else (inicio, 0, fin, alto)
+        resultado.append(img.crop(caja))
+    return resultado
+
+
+def preparar_imagen(ruta, lado_maximo=LADO_MAXIMO, calidad=CALIDAD_JPEG, max_bytes=MAX_BYTES_IMAGEN, formatos=None):
+    """Partes listas para enviar de una imagen: una, o varias teselas si es muy alargada.
+
+    Cada parte va en WebP o JPEG (el que menos ocupe) y no pasa de max_bytes.
+    """
+    from PIL import Image
+    formatos = formatos or formatos_imagen()
+    with Image.open(ruta) as img:
+        img.draft('RGB', (lado_maximo, lado_maximo))
+        img = _a_rgb(img)
+    partes = []
+    for tesela in teselas(img, lado_maximo):
+        if max(tesela.size) > lado_maximo:
+            tesela.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+        formato, datos = comprimir(tesela, formatos, calidad, max_bytes)
+        partes.append({"mime_type": TIPOS_MIME[formato], "data": datos})
+    return partes
+
+
+def estimar_bytes(parte):
+    """Bytes que ocupa una parte en la petición: las imágenes van en base64"""
+    if isinstance(parte, dict):
+        return 4 * math.ceil(len(parte["data"]) / 3) + 64
+    return len(str(parte).encode('utf-8')) + 16
+
+
+def contenido_imagenes(prompt, imagenes, piezas=None):
+    """Prompt seguido de las imágenes (listas de partes), con una etiqueta delante de cada una si hay
+    varias o están en teselas; piezas limita el contenido a las (imagen, parte) indicadas"""
+    if piezas is None:
+        piezas = [(i, j) for i, partes in enumerate(imagenes) for j in range(len(partes))]
+    contenido = [prompt]
+    etiquetar = len(imagenes) > 1 or any(len(partes) > 1 for partes in imagenes)
+    for i, j in piezas:
+        partes = imagenes[i]
+        if etiquetar:
+            detalle = f", parte {j + 1} de {len(partes)} (en orden de lectura)" if len(partes) > 1 else ""
+            contenido.append(f"Imagen {i + 1}{detalle}:")
+        contenido.append(partes[j])
+    return contenido
+
+
+def agrupar_imagenes(imagenes, presupuesto=PRESUPUESTO_PETICION, max_partes=MAX_PARTES_PETICION):
+    """Reparte las imágenes en grupos de (imagen, parte) que caben en una petición, en orden y sin
+    separar las teselas de una imagen salvo que no quepan juntas"""
+    grupos, actual, tamano = [], [], 0
+    for i, partes in enumerate(imagenes):
+        tamanos = [estimar_bytes(parte) for parte in partes]
+        if actual and (tamano + sum(tamanos) > presupuesto or len(actual) + len(partes) > max_partes):
+            grupos.append(actual)
+            actual, tamano = [], 0
+        for j, bytes_parte in enumerate(tamanos):
+            if actual and (tamano + bytes_parte > presupuesto or len(actual) >= max_partes):
+                grupos.append(actual)
+                actual, tamano = [], 0
+            actual.append((i, j))
+            tamano += bytes_parte
+    if actual:
+        grupos.append(actual)
+    return grupos
+
+
+def _rango(grupo):
+    primera, ultima = grupo[0][0] + 1, grupo[-1][0] + 1
+    return f"imagen {primera}" if primera == ultima else f"imágenes {primera}–{ultima}"
+
+
+def preparar_contenido_imagenes(nombre_modelo, prompt, imagenes, cancelado=None, usar_cache=True, medicion=None,
+                                reservado=0):
+    """Contenido para preguntar por las imágenes (listas de partes de preparar_imagen).
+
+    Si caben en una petición (IMAGEN_MAX_PETICION_MB, IMAGEN_MAX_POR_PETICION) es el prompt con las
+    imágenes. Si no, cada grupo se analiza en una subpetición y se devuelve una pregunta de texto que
+    pide combinar las respuestas parciales en una sola. reservado son los bytes que ya ocupa el resto
+    de la petición (p. ej. el historial de la conversación que va delante).
+    """
+    presupuesto = int(float(os.getenv('IMAGEN_MAX_PETICION_MB', PRESUPUESTO_PETICION / 1024 / 1024)) * 1024 * 1024)
+    max_partes = int(os.getenv('IMAGEN_MAX_POR_PETICION', MAX_PARTES_PETICION))
+    # Lo que ocupan las imágenes en el prompt, aunque luego vayan repartidas
+    presupuesto -= estimar_bytes(prompt) + 1024 + reservado
+    grupos = agrupar_imagenes(imagenes, presupuesto, max_partes)
+    if medicion is not None:
+        medicion["imagenes_bytes"] = sum(estimar_bytes(parte) for partes in imagenes for parte in partes)
+        medicion["subpeticiones"] = len(grupos)
+    if len(grupos) <= 1:
+        return contenido_imagenes(prompt, imagenes)
+
+    from cliente import generar
+
+    def analizar(indice, grupo):
+        indicacion = (f"{prompt}\n\n(Son demasiadas imágenes para una sola petición: aquí van las "
+                      f"{_rango(grupo)} de {len(imagenes)}, grupo {indice + 1} de {len(grupos)}. "
+                      f"Responde solo sobre estas; después se combinarán todas las respuestas.)")
+        return generar(nombre_modelo, contenido_imagenes(indicacion, imagenes, grupo), cancelado=cancelado,
+                       usar_cache=usar_cache, medicion={"origen": "subpeticion"})
+
+    with ThreadPoolExecutor(max_workers=min(CONCURRENCIA_SUBPETICIONES, len(grupos))) as ejecutor:
+        parciales = list(ejecutor.map(analizar, range(len(grupos)), grupos))
+    secciones = "\n\n".join(f"### {_rango(grupo).capitalize()}\n{parcial}"
+                             for grupo, parcial in zip(grupos, parciales))
+    return (f"Pregunta original: {prompt}\n\nLas {len(imagenes)} imágenes se analizaron en {len(grupos)} "
+            f"grupos y estas son las respuestas de cada uno:\n\n{secciones}\n\n"
+            f"Responde a la pregunta original sobre todas las imágenes combinando estas respuestas en una "
+            f"sola, sin mencionar los grupos.")
+
+
+def crear_miniatura(ruta, tamano=(100, 100)):
+    """Devuelve una miniatura ya decodificada sin cargar la imagen completa en memoria"""
+    from PIL import Image
+    with Image.open(ruta) as img:
+        # En JPEG decodifica directamente a 1/2, 1/4 u 1/8 de la resolución
+        img.draft('RGB', (tamano[0] * 2, tamano[1] * 2))
+        img.thumbnail(tamano)
+        # thumbnail() ya dejó los píxeles cargados; la copia se desvincula del archivo
+        return img.copy()
+
+
+class CacheCodificaciones:
+    """Imágenes ya preparadas para enviar (partes de preparar_imagen), indexadas por ruta y fecha de modificación"""
+
+    def __init__(self, max_entradas=64, lado_maximo=None, calidad=None, max_bytes=None, hilos=2):
+        self.max_entradas = max_entradas
+        self.lado_maximo = lado_maximo or int(os.getenv('IMAGEN_LADO_MAXIMO', LADO_MAXIMO))
+        self.calidad = calidad or int(os.getenv('IMAGEN_CALIDAD_JPEG', CALIDAD_JPEG))
+        self.max_bytes = max_bytes or int(float(os.getenv('IMAGEN_MAX_MB', MAX_BYTES_IMAGEN / 1024 / 1024))
+                                          * 1024 * 1024)
+        self.formato = os.getenv('IMAGEN_FORMATO', 'auto')
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos)
+
+    def _clave(self, ruta):
+        return (os.path.abspath(ruta), os.stat(ruta).st_mtime_ns, self.lado_maximo, self.calidad, self.max_bytes,
+                self.formato)
+
+    def _futuro(self, ruta):
+        # Devuelve la codificación en curso o terminada, lanzándola si no existe
+        clave = self._clave(ruta)
+        with self.lock:
+            futuro = self.entradas.get(clave)
+            if futuro is None:
+                futuro = self.ejecutor.submit(self._preparar, ruta)
+                self.entradas[clave] = futuro
+                while len(self.entradas) > self.max_entradas:
+                    self.entradas.popitem(last=False)
+            else:
+                self.entradas.move_to_end(clave)
+        return futuro
+
+    def _preparar(self, ruta):
+        return preparar_imagen(ruta, self.lado_maximo, self.calidad, self.max_bytes, formatos_imagen(self.formato))
+
+    def precargar(self, rutas):
+        """Codifica las imágenes en segundo plano para que estén listas al preguntar"""
+        for ruta in rutas:
+            try:
+                self._futuro(ruta)
+            except OSError as e:
+                print(f"Error al preparar imagen {ruta}: {str(e)}")
+
+    def obtener(self, ruta):
+        """Devuelve las partes listas para enviar al modelo, esperando si aún se está codificando"""
+        futuro = self._futuro(ruta)
+        try:
+            partes = futuro.result()
+        except Exception:
+            # No guardar el fallo: se reintentará en la próxima pregunta
+            with self.lock:
+                self.entradas = OrderedDict((k, f) for k, f in self.entradas.items() if f is not futuro)
+            raise
+        return partes
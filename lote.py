@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cliente import generar
+from resiliencia import es_reintentable, espera_reintento
+
+
+class LimitadorTokens:
+    """Cubeta de tokens: como mucho `por_segundo` peticiones sostenidas, con ráfagas de hasta `capacidad`"""
+
+    def __init__(self, por_segundo, capacidad=None):
+        self.por_segundo = por_segundo
+        self.capacidad = capacidad or max(1, por_segundo)
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def intentar(self):
+        """Toma un token si lo hay; devuelve 0, o los segundos que faltan para el siguiente"""
+        with self.lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.por_segundo)
+            self.ultimo = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.por_segundo
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible"""
+        while True:
+            espera = self.intentar()
+            if not espera:
+                return
+            time.sleep(espera)
+
+
+def con_reintentos(funcion, limitador=None, max_intentos=5, espera_base=1.0, espera_maxima=60.0):
+    """Ejecuta funcion() con reintentos y espera exponencial con jitter; devuelve (resultado, intentos)"""
+    intento = 0
+    while True:
+        intento += 1
+        if limitador is not None:
+            limitador.adquirir()
+        try:
+            return funcion(), intento
+        except Exception as e:
+            if intento >= max_intentos or not es_reintentable(e):
+                raise
+            time.sleep(espera_reintento(intento, espera_base, espera_maxima))
+
+
+class Checkpoint:
+    """Progreso reanudable con memoria acotada.
+
+    Guarda cuántas líneas iniciales están completas y, aparte, las completadas fuera de orden,
+    que nunca son más que las que caben en vuelo a la vez.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.prefijo = 0
+        self.sueltas = set()
+        if os.path.exists(ruta):
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            self.prefijo = datos.get("prefijo", 0)
+            self.sueltas = set(datos.get("sueltas", []))
+
+    def hecha(self, linea):
+        return linea < self.prefijo or linea in self.sueltas
+
+    def marcar(self, linea):
+        self.sueltas.add(linea)
+        while self.prefijo in self.sueltas:
+            self.sueltas.remove(self.prefijo)
+            self.prefijo += 1
+
+    def guardar(self):
+        temporal = self.ruta + ".tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump({"prefijo": self.prefijo, "sueltas": sorted(self.sueltas)}, f)
+        os.replace(temporal, self.ruta)
+
+
+def leer_prompts(ruta):
+    """Lee el JSONL de entrada línea a línea: {"id", "prompt", "imagenes": [...], "modelo"}"""
+    with open(ruta, encoding='utf-8') as f:
+        for numero, linea in enumerate(f):
+            yield numero, linea.strip()
+
+
+def preparar_contenido(registro, nombre_modelo, usar_cache=True):
+    prompt = registro["prompt"]
+    if not registro.get("imagenes"):
+        return prompt
+    # Solo se importa PIL si el lote trae imágenes; si no caben en una petición se reparten en subpeticiones
+    from imagenes import preparar_imagen, preparar_contenido_imagenes
+    return preparar_contenido_imagenes(nombre_modelo, prompt, [preparar_imagen(ruta) for ruta in registro["imagenes"]],
+                                       usar_cache=usar_cache)
+
+
+def procesar_lote(entrada, salida, modelo='gemini-2.0-flash', concurrencia=4, por_minuto=60,
+                  max_intentos=5, usar_cache=True, checkpoint=None):
+    """Procesa un JSONL de prompts y escribe los resultados en otro JSONL a medida que terminan.
+
+    Si no se puede escribir la salida el lote se detiene con ese error: el checkpoint queda en la
+    última línea guardada y la reanudación sigue desde ahí.
+    """
+    if por_minuto <= 0 or concurrencia <= 0:
+        raise ValueError("por_minuto y concurrencia deben ser mayores que 0")
+    checkpoint = Checkpoint(checkpoint or salida + ".checkpoint")
+    limitador = LimitadorTokens(por_minuto / 60.0, capacidad=concurrencia)
+    # Limita las líneas en vuelo para que la memoria no crezca con el tamaño de la entrada
+    en_vuelo = threading.BoundedSemaphore(concurrencia * 2)
+    lock = threading.Lock()
+    contadores = {"ok": 0, "errores": 0}
+    # Primer fallo al escribir la salida: deja de enviar líneas y se relanza al terminar las que están en vuelo
+    fallos = []
+    inicio = time.monotonic()
+
+    def procesar(numero, linea, archivo_salida):
+        try:
+            t0 = time.perf_counter()
+            registro = {}
+            nombre_modelo = modelo
+            try:
+                datos = json.loads(linea)
+                # Cualquier otro JSON válido ("texto", [..]) es un error de la línea, no del proceso
+                if not isinstance(datos, dict):
+                    raise ValueError("La línea debe ser un objeto JSON")
+                registro = datos
+                nombre_modelo = registro.get("modelo") or modelo
+                contenido = preparar_contenido(registro, nombre_modelo, usar_cache)
+                texto, intentos = con_reintentos(
+                    # Los reintentos van aquí, pasando por el limitador, y no dentro de generar()
+                    lambda: generar(nombre_modelo, contenido, usar_cache=usar_cache, medicion={"origen": "lote"},
+                                    reintentar=False),
+                    limitador, max_intentos)
+                resultado = {"respuesta": texto, "error": None, "intentos": intentos}
+            except Exception as e:
+                resultado = {"respuesta": None, "error": f"{type(e).__name__}: {str(e)}"}
+
+            fila = {"id": registro.get("id", numero), "linea": numero, "modelo": nombre_modelo}
+            fila.update(resultado)
+            fila["segundos"] = round(time.perf_counter() - t0, 3)
+
+            with lock:
+                archivo_salida.write(json.dumps(fila, ensure_ascii=False) + "\n")
+                archivo_salida.flush()
+                checkpoint.marcar(numero)
+                checkpoint.guardar()
+                contadores["ok" if fila["error"] is None else "errores"] += 1
+                total = contadores["ok"] + contadores["errores"]
+                if total % 10 == 0:
+                    ritmo = total / (time.monotonic() - inicio)
+                    print(f"✓ {total} procesadas ({contadores['errores']} errores) · {ritmo:.1f} preg/s",
+                          file=sys.stderr)
+        except Exception as e:
+            # Solo llega aquí un fallo al escribir la salida o el checkpoint
+            print(f"Error al guardar la línea {numero}: {str(e)}", file=sys.stderr)
+            fallos.append(e)
+        finally:
+            en_vuelo.release()
+
+    with open(salida, 'a', encoding='utf-8') as archivo_salida, \
+            ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        for numero, linea in leer_prompts(entrada):
+            if fallos:
+                break
+            if checkpoint.hecha(numero):
+                continue
+            if not linea:
+                # Las líneas vacías cuentan como hechas para no frenar el checkpoint
+                with lock:
+                    checkpoint.marcar(numero)
+                continue
+            en_vuelo.acquire()
+            ejecutor.submit(procesar, numero, linea, archivo_salida)
+
+    if fallos:
+        raise fallos[0]
+    print(f"🏁 Lote terminado: {contadores['ok']} correctas, {contadores['errores']} con error",
+          file=sys.stderr)
+    return contadores
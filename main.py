@@ -1,47 +1,157 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-import pathlib
+import time
+import argparse
+from cliente import cargar_entorno, precalentar, generar
+from cache_respuestas import obtener_cache
+from historial import SesionHistorial, obtener_historial
+from metricas import obtener_metricas
+from catalogo import obtener_catalogo
 
-# Cargar variables de entorno
-env_path = pathlib.Path('.') / '.env' / 'config.env'
-load_dotenv(env_path)
+# Cargar variables de entorno (el SDK se importa en segundo plano o al usarlo)
+cargar_entorno()
 
-# Configurar la API key
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Modelo a usar (Gemini 2.0 Flash)
+MODELO = 'gemini-2.0-flash'
 
-# Mostrar modelos disponibles
-print("Modelos disponibles:")
-for m in genai.list_models():
-    print(f"- {m.name}")
-
-# Crear un modelo (usando Gemini 2.0 Flash)
-model = genai.GenerativeModel('gemini-2.0-flash')
-
-def obtener_respuesta(prompt):
+def obtener_respuesta(prompt, al_recibir=None):
     try:
-        # Generar respuesta
-        response = model.generate_content(prompt)
-        return response.text
+        # Generar respuesta (desde la caché si ya se hizo la misma pregunta)
+        return generar(MODELO, prompt, al_recibir, medicion={"origen": "cli"})
     except Exception as e:
         return f"Error al generar respuesta: {str(e)}"
 
+def imprimir_metricas():
+    # Percentiles de las preguntas de esta sesión (el detalle queda en el archivo de métricas)
+    resumen = obtener_metricas().resumen("cli")
+    for campo, nombre in (("primer_token", "Primer token"), ("total", "Total")):
+        valores = resumen[campo]
+        if valores["n"]:
+            print(f"⏱ {nombre}: p50 {valores['p50']:.2f} s · p95 {valores['p95']:.2f} s · p99 {valores['p99']:.2f} s")
+
+def imprimir_fragmento(fragmento):
+    print(fragmento, end="", flush=True)
+
+def listar_modelos():
+    # Consulta de red solo bajo demanda (--modelos); el resultado queda en el catálogo en disco
+    catalogo = obtener_catalogo()
+    hilo = catalogo.refrescar(forzar=True)
+    hilo.join()
+    print("Modelos disponibles:")
+    for nombre in catalogo.nombres():
+        info = catalogo.info(nombre)
+        entrada = f"{info['tokens_entrada']:,}".replace(",", ".") if info.get("tokens_entrada") else "?"
+        print(f"- {nombre} · {entrada} tokens · {'imágenes' if info['vision'] else 'solo texto'}")
+
 def main():
+    # Preparar el SDK y el modelo mientras el usuario escribe la primera pregunta
+    precalentar(MODELO)
+    
     print("🔮 Bienvenido al Oráculo de Gemini 🔮")
-    print("Escribe 'salir' para terminar")
+    print("Escribe 'salir' para terminar (Ctrl+C interrumpe la respuesta en curso)")
+    
+    # Cada turno queda en el historial persistente
+    sesion = SesionHistorial("cli")
     
     while True:
         # Obtener input del usuario
         prompt = input("\n❓ Tu pregunta: ")
         
         if prompt.lower() == 'salir':
+            estadisticas = obtener_cache().estadisticas()
+            print(f"\n💾 Caché: {estadisticas['aciertos']} aciertos ({estadisticas['semanticos']} por parecido) / {estadisticas['fallos']} fallos")
+            imprimir_metricas()
             print("\n👋 ¡Hasta luego!")
             break
             
-        # Obtener y mostrar la respuesta
+        # Obtener y mostrar la respuesta a medida que se genera
         print("\n🤖 Respuesta:")
-        respuesta = obtener_respuesta(prompt)
-        print(respuesta)
+        sesion.agregar("usuario", prompt, modelo=MODELO)
+        inicio = time.perf_counter()
+        try:
+            respuesta = obtener_respuesta(prompt, imprimir_fragmento)
+        except KeyboardInterrupt:
+            print("\n⏹ Respuesta interrumpida")
+            continue
+        sesion.agregar("modelo", respuesta, modelo=MODELO, completo=True,
+                       latencia=round(time.perf_counter() - inicio, 3))
+        
+        # Los errores no se emiten por streaming
+        if respuesta.startswith("Error al generar respuesta:"):
+            print(respuesta)
+        else:
+            print()
+
+def buscar(consulta):
+    # Buscar en todas las conversaciones guardadas
+    resultados = obtener_historial().buscar(consulta)
+    if not resultados:
+        print("Sin resultados")
+    for resultado in resultados:
+        fecha = time.strftime("%Y-%m-%d %H:%M", time.localtime(resultado["creado"]))
+        icono = "❓" if resultado["rol"] == "usuario" else "🤖"
+        fragmento = " ".join(resultado["fragmento"].split())
+        print(f"{fecha} · sesión {resultado['sesion']} · {icono} {fragmento}")
+
+def exportar_sesion(sesion, archivo):
+    # Exportar una sesión guardada leyéndola del historial por páginas
+    from exportar import exportar
+    historial = obtener_historial()
+    total = exportar(historial.mensajes(sesion), archivo, historial.contar(sesion))
+    print(f"📝 {total} mensajes exportados a {archivo}")
+
+def exportar_calificaciones(archivo):
+    # Los agregados ya están calculados: no se recorre el registro de calificaciones
+    from calificaciones import obtener_calificaciones
+    calificaciones = obtener_calificaciones()
+    calificaciones.exportar(archivo)
+    resumen = calificaciones.resumen()
+    if resumen["satisfaccion"] is not None:
+        print(f"👍 {resumen['likes']} · 👎 {resumen['dislikes']} · Satisfacción: {resumen['satisfaccion']:.1f}%")
+    print(f"📝 Calificaciones exportadas a {archivo}")
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="🔮 Oráculo de Gemini")
+    parser.add_argument("--lote", metavar="ENTRADA.jsonl",
+                        help="procesar un archivo JSONL de prompts sin interfaz")
+    parser.add_argument("--salida", metavar="SALIDA.jsonl",
+                        help="archivo JSONL de resultados (por defecto ENTRADA.resultados.jsonl)")
+    parser.add_argument("--modelo", default=MODELO, help="modelo por defecto del lote")
+    parser.add_argument("--concurrencia", type=int, default=4, help="peticiones simultáneas")
+    parser.add_argument("--por-minuto", type=float, default=60, help="límite de peticiones por minuto")
+    parser.add_argument("--intentos", type=int, default=5, help="intentos máximos ante errores 429/5xx")
+    parser.add_argument("--sin-cache", action="store_true", help="no usar la caché de respuestas")
+    parser.add_argument("--servir", nargs="?", type=int, const=8080, metavar="PUERTO",
+                        help="servir el oráculo como API HTTP/SSE local (puerto 8080 por defecto)")
+    parser.add_argument("--anfitrion", default="127.0.0.1", help="dirección en la que escucha --servir")
+    parser.add_argument("--modelos", action="store_true", help="listar los modelos disponibles y salir")
+    parser.add_argument("--buscar", metavar="TEXTO",
+                        help="buscar en el historial de conversaciones y salir")
+    parser.add_argument("--exportar", nargs=2, metavar=("SESION", "ARCHIVO"),
+                        help="exportar una sesión del historial a .txt, .md, .jsonl o .pdf y salir")
+    parser.add_argument("--calificaciones", metavar="ARCHIVO",
+                        help="exportar las calificaciones agregadas por modelo, sentimiento y día a .csv o .json y salir")
+    args = parser.parse_args()
+    if args.por_minuto <= 0 or args.concurrencia <= 0:
+        parser.error("--por-minuto y --concurrencia deben ser mayores que 0")
+    return args
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parsear_argumentos()
+    if args.servir:
+        from servidor import servir
+        servir(args.anfitrion, args.servir)
+    elif args.modelos:
+        listar_modelos()
+    elif args.buscar:
+        buscar(args.buscar)
+    elif args.exportar:
+        exportar_sesion(int(args.exportar[0]), args.exportar[1])
+    elif args.calificaciones:
+        exportar_calificaciones(args.calificaciones)
+    elif args.lote:
+        from lote import procesar_lote
+        salida = args.salida or args.lote.rsplit(".", 1)[0] + ".resultados.jsonl"
+        procesar_lote(args.lote, salida, modelo=args.modelo, concurrencia=args.concurrencia,
+                      por_minuto=args.por_minuto, max_intentos=args.intentos,
+                      usar_cache=not args.sin_cache)
+    else:
+        main()
\ No newline at end of file
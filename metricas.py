@@ -0,0 +1,110 @@
+import os
+import json
+import math
+import time
+import pathlib
+import threading
+from collections import deque, Counter
+
+# Archivo por defecto donde se acumulan las mediciones (una línea JSON por petición)
+metricas_path = pathlib.Path('.') / '.cache' / 'metricas.jsonl'
+
+# Campos que se resumen con percentiles: tiempos en segundos y recuentos de tokens
+CAMPOS = ("espera", "codificacion", "primer_token", "total", "tokens_prompt", "tokens_respuesta")
+
+
+def percentil(ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Metricas:
+    """Mediciones por petición: una ventana deslizante para los percentiles y un JSONL con todas.
+
+    Cada medición es un diccionario con el origen (gui, chat, cli, lote, comparar, sentimiento,
+    resumen), el modelo, los campos de CAMPOS que se conozcan, si vino de la caché, si se unió a otra
+    petición idéntica en curso (coalescida) y la clase del error.
+    """
+
+    def __init__(self, ruta=metricas_path, ventana=500):
+        self.ruta = ruta
+        self.registros = deque(maxlen=ventana)
+        # Peticiones registradas desde el arranque, por origen
+        self.peticiones = Counter()
+        self.lock = threading.Lock()
+        self.archivo = None
+        # Se incrementa con cada medición para que la interfaz sepa cuándo redibujar
+        self.version = 0
+
+    def registrar(self, medicion):
+        registro = {"ts": round(time.time(), 3)}
+        for campo, valor in medicion.items():
+            registro[campo] = round(valor, 4) if isinstance(valor, float) else valor
+        with self.lock:
+            self.registros.append(registro)
+            self.peticiones[registro.get("origen")] += 1
+            self.version += 1
+            self._escribir(registro)
+
+    def _escribir(self, registro):
+        if not self.ruta:
+            return
+        try:
+            if self.archivo is None:
+                pathlib.Path(self.ruta).parent.mkdir(parents=True, exist_ok=True)
+                self.archivo = open(self.ruta, 'a', encoding='utf-8', buffering=1)
+            self.archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error al guardar métricas: {str(e)}")
+            self.ruta = None
+
+    def resumen(self, origen=None):
+        """p50/p95/p99 de cada campo en la ventana, tasas de caché y de coalescencia y errores por clase,
+        todo de las peticiones del origen indicado (o de todas)"""
+        with self.lock:
+            registros = [r for r in self.registros if origen is None or r.get("origen") == origen]
+            peticiones = sum(self.peticiones.values()) if origen is None else self.peticiones[origen]
+        errores = dict(Counter(r["error"] for r in registros if r.get("error")))
+        resumen = {"peticiones": peticiones, "ventana": len(registros), "errores": errores}
+        for campo in CAMPOS:
+            valores = sorted(r[campo] for r in registros if r.get(campo) is not None)
+            resumen[campo] = {"n": len(valores), "p50": percentil(valores, 50),
+                              "p95": percentil(valores, 95), "p99": percentil(valores, 99)}
+        resumen["tasa_cache"] = (sum(1 for r in registros if r.get("cache")) / len(registros)
+                                 if registros else 0.0)
+        resumen["tasa_coalescida"] = (sum(1 for r in registros if r.get("coalescida")) / len(registros)
+                                      if registros else 0.0)
+        return resumen
+
+    def percentil_de(self, campo, p, modelo=None, minimo=20):
+        """Percentil de un campo en las peticiones reales a la API de un modelo (sin caché, coalescidas,
+        errores ni respuestas del respaldo); None si hay menos de `minimo` mediciones"""
+        with self.lock:
+            valores = sorted(r[campo] for r in self.registros
+                             if r.get(campo) is not None and not r.get("cache") and not r.get("coalescida")
+                             and not r.get("error") and not r.get("respaldo")
+                             and (modelo is None or r.get("modelo") == modelo))
+        return percentil(valores, p) if len(valores) >= minimo else None
+
+    def cerrar(self):
+        with self.lock:
+            if self.archivo is not None:
+                self.archivo.close()
+                self.archivo = None
+
+
+_metricas = None
+_metricas_lock = threading.Lock()
+
+
+def obtener_metricas():
+    """Devuelve las métricas compartidas del proceso; METRICAS_RUTA vacía desactiva el archivo"""
+    global _metricas
+    if _metricas is None:
+        with _metricas_lock:
+            if _metricas is None:
+                _metricas = Metricas(os.getenv('METRICAS_RUTA', str(metricas_path)),
+                                     int(os.getenv('METRICAS_VENTANA', 500)))
+    return _metricas
@@ -0,0 +1,62 @@
+import os
+import time
+import asyncio
+import threading
+from cliente import generar_async
+
+
+class MotorAsync:
+    """Bucle asyncio en un hilo propio que envía una misma pregunta a varios modelos a la vez"""
+
+    def __init__(self, max_concurrencia=None):
+        self.max_concurrencia = max_concurrencia or int(os.getenv('MAX_MODELOS_SIMULTANEOS', 4))
+        self.loop = asyncio.new_event_loop()
+        self.hilo = threading.Thread(target=self._ejecutar_loop, name="motor-async", daemon=True)
+        self.hilo.start()
+        # El semáforo debe crearse dentro del bucle que lo va a usar
+        self.semaforo = asyncio.run_coroutine_threadsafe(self._crear_semaforo(), self.loop).result()
+
+    def _ejecutar_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _crear_semaforo(self):
+        return asyncio.Semaphore(self.max_concurrencia)
+
+    async def _consultar(self, nombre_modelo, contenido, usar_cache):
+        # Devuelve (modelo, texto, error, segundos); el límite de concurrencia se aplica aquí
+        llegada = time.perf_counter()
+        async with self.semaforo:
+            inicio = time.perf_counter()
+            try:
+                # Contenido propio de cada modelo (p. ej. imágenes repartidas en subpeticiones a ese
+                # modelo), preparado fuera del bucle porque bloquea
+                if callable(contenido):
+                    contenido = await self.loop.run_in_executor(None, contenido, nombre_modelo)
+                texto = await generar_async(nombre_modelo, contenido, usar_cache,
+                                            medicion={"origen": "comparar", "espera": inicio - llegada})
+                return nombre_modelo, texto, None, time.perf_counter() - inicio
+            except Exception as e:
+                return nombre_modelo, None, e, time.perf_counter() - inicio
+
+    async def _comparar(self, nombres_modelos, contenido, al_terminar_modelo, usar_cache):
+        tareas = [asyncio.ensure_future(self._consultar(nombre, contenido, usar_cache))
+                  for nombre in nombres_modelos]
+        resultados = []
+        for siguiente in asyncio.as_completed(tareas):
+            resultado = await siguiente
+            resultados.append(resultado)
+            if al_terminar_modelo is not None:
+                al_terminar_modelo(*resultado)
+        return resultados
+
+    def comparar(self, nombres_modelos, contenido, al_terminar_modelo=None, usar_cache=True):
+        """Lanza la pregunta a todos los modelos; al_terminar_modelo(modelo, texto, error, segundos)
+        se llama en cuanto cada uno termina; contenido puede ser una función contenido(modelo).
+        Devuelve un concurrent.futures.Future con la lista completa.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._comparar(nombres_modelos, contenido, al_terminar_modelo, usar_cache), self.loop)
+
+    def cerrar(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
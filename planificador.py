@@ -0,0 +1,161 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+
+# Estados de una solicitud
+EN_COLA = "en_cola"
+EN_CURSO = "en_curso"
+COMPLETADA = "completada"
+CANCELADA = "cancelada"
+CADUCADA = "caducada"
+FALLIDA = "fallida"
+
+ESTADOS_FINALES = {COMPLETADA, CANCELADA, CADUCADA, FALLIDA}
+
+
+class Solicitud:
+    """Trabajo encolado en el planificador, con su propio evento de cancelación"""
+
+    def __init__(self, id, descripcion, funcion, timeout, al_terminar, al_fallar):
+        self.id = id
+        self.descripcion = descripcion
+        self.funcion = funcion
+        self.timeout = timeout
+        self.al_terminar = al_terminar
+        self.al_fallar = al_fallar
+        self.estado = EN_COLA
+        self.cancelado = threading.Event()
+        self.creada = time.monotonic()
+        self.iniciada = None
+        self.terminada = None
+        # Datos que la función deja para quien recibe el resultado
+        self.datos = {}
+
+    @property
+    def espera(self):
+        """Segundos que pasó en la cola antes de empezar"""
+        if self.iniciada is None:
+            return time.monotonic() - self.creada
+        return self.iniciada - self.creada
+
+
+class Planificador:
+    """Ejecutor acotado con cola visible, cancelación y tiempo máximo por solicitud.
+
+    Los resultados no se entregan desde los hilos de trabajo: se dejan en una cola de salida
+    que el hilo de Tk vacía con bombear(), de modo que hay un único punto de entrega.
+    """
+
+    def __init__(self, max_workers=2, max_cola=20, timeout=None):
+        self.timeout = timeout if timeout is not None else float(os.getenv('TIEMPO_MAXIMO_PREGUNTA', 120))
+        self.entrada = queue.Queue(maxsize=max_cola)
+        self.salida = queue.Queue()
+        self.solicitudes = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        # Se incrementa con cada cambio de estado para que la interfaz sepa cuándo redibujar la cola
+        self.version = 0
+
+        self.hilos = []
+        for i in range(max_workers):
+            hilo = threading.Thread(target=self._trabajar, name=f"planificador-{i}", daemon=True)
+            hilo.start()
+            self.hilos.append(hilo)
+
+    def enviar(self, funcion, descripcion="", timeout=None, al_terminar=None, al_fallar=None):
+        """Encola funcion(solicitud); devuelve la solicitud o None si la cola está llena"""
+        solicitud = Solicitud(next(self.ids), descripcion, funcion,
+                              timeout if timeout is not None else self.timeout,
+                              al_terminar, al_fallar)
+        with self.lock:
+            try:
+                self.entrada.put_nowait(solicitud)
+            except queue.Full:
+                return None
+            self.solicitudes[solicitud.id] = solicitud
+            self.version += 1
+        return solicitud
+
+    def cancelar(self, solicitud_id):
+        """Cancela una solicitud en cola o en curso; el resultado tardío se descarta"""
+        with self.lock:
+            solicitud = self.solicitudes.get(solicitud_id)
+        if solicitud is None:
+            return False
+        solicitud.cancelado.set()
+        self._finalizar(solicitud, CANCELADA, None)
+        return True
+
+    def pendientes(self):
+        """Solicitudes en cola o en curso, en orden de llegada"""
+        with self.lock:
+            return list(self.solicitudes.values())
+
+    def entregar(self, callback, *args):
+        """Programa callback(*args) para ejecutarse en el hilo que llama a bombear()"""
+        self.salida.put((callback, args))
+
+    def bombear(self):
+        """Revisa los tiempos máximos y ejecuta las entregas pendientes; llamar desde el hilo de Tk"""
+        self._revisar_vencidas()
+        while True:
+            try:
+                callback, args = self.salida.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error al entregar resultado: {str(e)}")
+
+    def cerrar(self):
+        for solicitud in self.pendientes():
+            solicitud.cancelado.set()
+        for _ in self.hilos:
+            self.entrada.put(None)
+
+    def _revisar_vencidas(self):
+        ahora = time.monotonic()
+        for solicitud in self.pendientes():
+            if (solicitud.estado == EN_CURSO and solicitud.timeout
+                    and ahora - solicitud.iniciada > solicitud.timeout):
+                solicitud.cancelado.set()
+                self._finalizar(solicitud, CADUCADA, TimeoutError(
+                    f"Sin respuesta tras {solicitud.timeout:g} segundos"))
+
+    def _trabajar(self):
+        while True:
+            solicitud = self.entrada.get()
+            if solicitud is None:
+                break
+            with self.lock:
+                if solicitud.estado != EN_COLA:
+                    continue
+                solicitud.estado = EN_CURSO
+                solicitud.iniciada = time.monotonic()
+                self.version += 1
+            try:
+                resultado = solicitud.funcion(solicitud)
+            except Exception as e:
+                self._finalizar(solicitud, FALLIDA, e)
+            else:
+                self._finalizar(solicitud, COMPLETADA, resultado)
+
+    def _finalizar(self, solicitud, estado, resultado):
+        with self.lock:
+            # Solo cuenta el primer desenlace (p. ej. una cancelación gana al resultado tardío)
+            if solicitud.estado in ESTADOS_FINALES:
+                return
+            solicitud.estado = estado
+            solicitud.terminada = time.monotonic()
+            self.solicitudes.pop(solicitud.id, None)
+            self.version += 1
+
+        if estado == COMPLETADA:
+            if solicitud.al_terminar is not None:
+                self.entregar(solicitud.al_terminar, solicitud, resultado)
+        elif solicitud.al_fallar is not None:
+            self.entregar(solicitud.al_fallar, solicitud, resultado)
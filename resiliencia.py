@@ -0,0 +1,412 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import threading
+
+# Clases de error de la API
+CUOTA = "cuota"
+SERVIDOR = "servidor"
+TIEMPO = "tiempo"
+RED = "red"
+PERMISO = "permiso"
+PETICION = "peticion"
+BLOQUEO = "bloqueo"
+CIRCUITO = "circuito"
+DESCONOCIDO = "desconocido"
+
+# Errores pasajeros: se reintentan y cuentan para el cortacircuitos del modelo
+REINTENTABLES = {CUOTA, SERVIDOR, TIEMPO, RED}
+
+MENSAJES = {
+    CUOTA: "Cuota de la API agotada; espera un momento y vuelve a intentarlo",
+    SERVIDOR: "El servicio de Gemini no está disponible ahora mismo",
+    TIEMPO: "El modelo tardó demasiado en responder",
+    RED: "No se pudo conectar con Gemini",
+    PERMISO: ("Error de permisos: revisa tu API key. Para usar el análisis de imágenes se requiere una "
+              "cuenta de pago de Google AI Studio (más información: https://ai.google.dev/pricing)"),
+    PETICION: "La petición no es válida para este modelo",
+    BLOQUEO: "La respuesta fue bloqueada por los filtros de seguridad",
+    CIRCUITO: "El modelo está fallando y se ha dejado de usar unos segundos"
+}
+
+# Umbral de respaldo cuando aún no hay latencias medidas del modelo, y el mínimo admitido
+UMBRAL_RESPALDO = 10.0
+UMBRAL_RESPALDO_MINIMO = 1.0
+
+
+class ErrorGemini(Exception):
+    """Error de la API ya clasificado, con el modelo que lo produjo y el error original"""
+
+    def __init__(self, clase, modelo=None, original=None):
+        self.clase = clase
+        self.modelo = modelo
+        self.original = original
+        detalle = f" ({type(original).__name__}: {original})" if original is not None else ""
+        super().__init__(f"{MENSAJES.get(clase, str(original))}{detalle}" if clase != DESCONOCIDO
+                         else str(original))
+
+    @property
+    def reintentable(self):
+        return self.clase in REINTENTABLES
+
+
+def clasificar_error(error):
+    """Clase de un error del SDK, de google.api_core, de la red o del transporte REST"""
+    if isinstance(error, ErrorGemini):
+        return error.clase
+    codigo = getattr(error, 'code', None)
+    codigo = codigo if isinstance(codigo, int) else None
+    nombre = type(error).__name__
+    texto = str(error)
+    if codigo == 429 or nombre in ("TooManyRequests", "ResourceExhausted") or "RESOURCE_EXHAUSTED" in texto:
+        return CUOTA
+    if codigo in (401, 403) or nombre in ("PermissionDenied", "Unauthenticated") or \
+            "PERMISSION_DENIED" in texto or "API_KEY_INVALID" in texto:
+        return PERMISO
+    if codigo == 504 or isinstance(error, TimeoutError) or "DEADLINE_EXCEEDED" in texto or \
+            nombre in ("DeadlineExceeded", "Timeout", "ReadTimeout", "ConnectTimeout"):
+        return TIEMPO
+    if (codigo is not None and codigo >= 500) or "UNAVAILABLE" in texto or "INTERNAL" in texto:
+        return SERVIDOR
+    if isinstance(error, ConnectionError) or nombre in ("ConnectionError", "ProtocolError", "ChunkedEncodingError"):
+        return RED
+    if nombre in ("BlockedPromptException", "StopCandidateException") or "SAFETY" in texto:
+        return BLOQUEO
+    if codigo in (400, 404) or nombre in ("InvalidArgument", "NotFound", "BadRequest", "FailedPrecondition"):
+        return PETICION
+    return DESCONOCIDO
+
+
+def es_reintentable(error):
+    """Errores de cuota (429), del servidor (5xx), de plazo o de red, que suelen resolverse reintentando"""
+    return clasificar_error(error) in REINTENTABLES
+
+
+def espera_reintento(intento, espera_base=1.0, espera_maxima=60.0):
+    """Espera exponencial con jitter completo, para no sincronizar los reintentos de todos los hilos"""
+    return random.uniform(0, min(espera_maxima, espera_base * 2 ** (intento - 1)))
+
+
+class Circuito:
+    """Cortacircuitos de un modelo: tras `umbral` fallos seguidos deja de usarse durante `enfriamiento`
+    segundos; pasado ese tiempo deja pasar una única petición de prueba"""
+
+    def __init__(self, umbral=5, enfriamiento=30.0):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.probando = False
+        self.lock = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.fallos < self.umbral:
+            return "cerrado"
+        return "abierto" if time.monotonic() < self.abierto_hasta else "semiabierto"
+
+    def permite(self):
+        with self.lock:
+            if self.fallos < self.umbral:
+                return True
+            if time.monotonic() < self.abierto_hasta or self.probando:
+                return False
+            self.probando = True
+            return True
+
+    def exito(self):
+        with self.lock:
+            self.fallos = 0
+            self.probando = False
+
+    def fallo(self):
+        with self.lock:
+            self.fallos += 1
+            self.probando = False
+            if self.fallos >= self.umbral:
+                self.abierto_hasta = time.monotonic() + self.enfriamiento
+
+    def liberar(self):
+        # La petición de prueba terminó sin decir nada de la salud del modelo (cancelada, petición inválida...)
+        with self.lock:
+            self.probando = False
+
+
+class _Cancelacion:
+    # Cancelada por quien llama o por la carrera de respaldo
+    def __init__(self, externa):
+        self.propia = threading.Event()
+        self.externa = externa
+
+    def set(self):
+        self.propia.set()
+
+    def is_set(self):
+        return self.propia.is_set() or (self.externa is not None and self.externa.is_set())
+
+
+def _esperar(segundos, cancelado):
+    # Espera interrumpible por la cancelación
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        if cancelado is not None and cancelado.is_set():
+            return False
+        time.sleep(min(0.1, max(0.0, fin - time.monotonic())))
+    return True
+
+
+class ClienteResiliente:
+    """Reintentos, plazos por modelo, respaldo y cortacircuitos alrededor de las llamadas a la API.
+
+    Si hay modelo de respaldo y el principal no da señales (primer fragmento o respuesta) en el umbral,
+    se lanza la misma petición al respaldo y gana el primero que responda; el umbral por defecto es
+    el p95 del primer token del modelo. Un modelo con el circuito abierto se salta y se usa el respaldo.
+    """
+
+    def __init__(self, max_intentos=3, plazo=120.0, plazos=None, respaldo=None, umbral_respaldo=None,
+                 umbral_fallos=5, enfriamiento=30.0, espera_base=1.0, espera_maxima=20.0):
+        self.max_intentos = max_intentos
+        self.plazo_defecto = plazo
+        self.plazos = plazos or {}
+        self.modelo_respaldo = respaldo
+        self.umbral_fijo = umbral_respaldo
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.circuitos = {}
+        self.lock = threading.Lock()
+
+    def circuito(self, modelo):
+        with self.lock:
+            circuito = self.circuitos.get(modelo)
+            if circuito is None:
+                circuito = self.circuitos[modelo] = Circuito(self.umbral_fallos, self.enfriamiento)
+            return circuito
+
+    def plazo(self, modelo):
+        return self.plazos.get(modelo, self.plazo_defecto)
+
+    def respaldo(self, modelo):
+        if not self.modelo_respaldo or self.modelo_respaldo == modelo:
+            return None
+        return self.modelo_respaldo
+
+    def umbral_respaldo(self, modelo):
+        if self.umbral_fijo:
+            return self.umbral_fijo
+        from metricas import obtener_metricas
+        p95 = obtener_metricas().percentil_de("primer_token", 95, modelo)
+        return max(UMBRAL_RESPALDO_MINIMO, p95) if p95 is not None else UMBRAL_RESPALDO
+
+    def _elegir(self, modelo, con_respaldo):
+        # El modelo pedido si su circuito lo permite; si no, el respaldo
+        if self.circuito(modelo).permite():
+            return modelo
+        respaldo = self.respaldo(modelo) if con_respaldo else None
+        if respaldo is not None and self.circuito(respaldo).permite():
+            return respaldo
+        raise ErrorGemini(CIRCUITO, modelo)
+
+    def _anotar(self, modelo, error):
+        circuito = self.circuito(modelo)
+        if error is None:
+            circuito.exito()
+        elif clasificar_error(error) in REINTENTABLES:
+            circuito.fallo()
+        else:
+            circuito.liberar()
+
+    def ejecutar(self, modelo, llamar, al_recibir=None, cancelado=None, con_respaldo=True, reintentar=True):
+        """Ejecuta llamar(modelo, al_recibir, cancelado, plazo) con todas las protecciones.
+
+        Devuelve (resultado, modelo que respondió, intentos) o lanza ErrorGemini.
+        """
+        limite = time.monotonic() + self.plazo(modelo)
+        emitido = []
+
+        def recibir(fragmento):
+            emitido.append(True)
+            al_recibir(fragmento)
+
+        intento = 0
+        while True:
+            intento += 1
+            nombre = self._elegir(modelo, con_respaldo)
+            respaldo = self.respaldo(nombre) if con_respaldo and nombre == modelo else None
+            try:
+                if respaldo is not None and self.circuito(respaldo).estado != "abierto":
+                    resultado, usado = self._carrera(nombre, respaldo, llamar, recibir if al_recibir else None,
+                                                     cancelado, limite)
+                else:
+                    resultado = self._llamar(nombre, llamar, recibir if al_recibir else None, cancelado, limite)
+                    usado = nombre
+                return resultado, usado, intento
+            except Exception as e:
+                error = e if isinstance(e, ErrorGemini) else ErrorGemini(clasificar_error(e), nombre, e)
+                # Con texto ya entregado no se puede repetir la respuesta sin duplicarlo
+                if not reintentar or not error.reintentable or emitido or intento >= self.max_intentos or \
+                        (cancelado is not None and cancelado.is_set()):
+                    raise error
+                espera = espera_reintento(intento, self.espera_base, self.espera_maxima)
+                if time.monotonic() + espera >= limite or not _esperar(espera, cancelado):
+                    raise error
+
+    def _llamar(self, nombre, llamar, al_recibir, cancelado, limite):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise ErrorGemini(TIEMPO, nombre)
+        try:
+            resultado = llamar(nombre, al_recibir, cancelado, restante)
+        except Exception as e:
+            self._anotar(nombre, e)
+            raise
+        except BaseException:
+            # Ctrl+C o salida del proceso: no dice nada del modelo, pero la prueba del circuito debe soltarse
+            self.circuito(nombre).liberar()
+            raise
+        if cancelado is not None and cancelado.is_set():
+            # Interrumpida (p. ej. perdió la carrera): no dice si el modelo está sano
+            self.circuito(nombre).liberar()
+        else:
+            self._anotar(nombre, None)
+        return resultado
+
+    def _carrera(self, nombre, respaldo, llamar, al_recibir, cancelado, limite):
+        # Gana el primero que emite un fragmento (o que termina, sin streaming); el otro se cancela
+        eventos = queue.Queue()
+        lock = threading.Lock()
+        estado = {"ganador": None}
+        cancelaciones = {}
+
+        def lanzar(n):
+            cancelacion = cancelaciones[n] = _Cancelacion(cancelado)
+
+            def recibir(fragmento):
+                with lock:
+                    if estado["ganador"] is None:
+                        estado["ganador"] = n
+                        eventos.put(("gana", n, None, None))
+                    elif estado["ganador"] != n:
+                        return
+                al_recibir(fragmento)
+
+            def tarea():
+                try:
+                    resultado = self._llamar(n, llamar, recibir if al_recibir else None, cancelacion, limite)
+                    eventos.put(("fin", n, resultado, None))
+                except Exception as e:
+                    eventos.put(("fin", n, None, e))
+
+            threading.Thread(target=tarea, name=f"respaldo-{n}", daemon=True).start()
+
+        def cancelar_resto(ganador):
+            for n, cancelacion in cancelaciones.items():
+                if n != ganador:
+                    cancelacion.set()
+
+        def lanzar_respaldo():
+            # Se decide al lanzarlo: el circuito del respaldo pudo abrirse mientras tanto
+            pendiente["respaldo"] = False
+            if self.circuito(respaldo).permite():
+                lanzar(respaldo)
+                return True
+            return False
+
+        lanzar(nombre)
+        pendiente = {"respaldo": True}
+        momento_respaldo = time.monotonic() + self.umbral_respaldo(nombre)
+        errores = {}
+        while True:
+            hasta = min(limite, momento_respaldo) if pendiente["respaldo"] else limite
+            try:
+                tipo, n, resultado, error = eventos.get(timeout=max(0.0, hasta - time.monotonic()))
+            except queue.Empty:
+                if time.monotonic() >= limite:
+                    cancelar_resto(None)
+                    raise ErrorGemini(TIEMPO, nombre)
+                lanzar_respaldo()
+                continue
+            if tipo == "gana":
+                cancelar_resto(n)
+                continue
+            if error is None:
+                with lock:
+                    if estado["ganador"] is None:
+                        estado["ganador"] = n
+                if estado["ganador"] == n:
+                    cancelar_resto(n)
+                    return resultado, n
+                continue
+            errores[n] = error
+            if estado["ganador"] == n:
+                cancelar_resto(n)
+                raise error
+            if len(errores) == len(cancelaciones):
+                # El principal falló pronto: el respaldo se lanza ya en vez de esperar al umbral
+                if pendiente["respaldo"] and es_reintentable(error) and lanzar_respaldo():
+                    continue
+                raise errores.get(nombre, error)
+
+    async def ejecutar_async(self, modelo, llamar, con_respaldo=True):
+        """Versión asíncrona sin carrera: await llamar(modelo, plazo) con reintentos, plazo y cortacircuitos"""
+        limite = time.monotonic() + self.plazo(modelo)
+        intento = 0
+        while True:
+            intento += 1
+            nombre = self._elegir(modelo, con_respaldo)
+            restante = limite - time.monotonic()
+            try:
+                if restante <= 0:
+                    raise ErrorGemini(TIEMPO, nombre)
+                resultado = await asyncio.wait_for(llamar(nombre, restante), restante)
+                self._anotar(nombre, None)
+                return resultado, nombre, intento
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = ErrorGemini(TIEMPO, nombre, e)
+                self._anotar(nombre, e)
+                error = e if isinstance(e, ErrorGemini) else ErrorGemini(clasificar_error(e), nombre, e)
+                if not error.reintentable or intento >= self.max_intentos:
+                    raise error
+                espera = espera_reintento(intento, self.espera_base, self.espera_maxima)
+                if time.monotonic() + espera >= limite:
+                    raise error
+                await asyncio.sleep(espera)
+            except BaseException:
+                # Tarea cancelada o Ctrl+C: suelta la prueba del circuito sin contarla como fallo
+                self.circuito(nombre).liberar()
+                raise
+
+
+def _leer_plazos(texto):
+    # "gemini-2.5-pro=180,gemini-2.0-flash=30" -> {"gemini-2.5-pro": 180.0, ...}
+    plazos = {}
+    for parte in texto.split(","):
+        modelo, _, segundos = parte.partition("=")
+        if modelo.strip() and segundos.strip():
+            plazos[modelo.strip()] = float(segundos)
+    return plazos
+
+
+_resiliencia = None
+_resiliencia_lock = threading.Lock()
+
+
+def obtener_resiliencia():
+    """Devuelve el cliente resiliente compartido del proceso, configurado con las variables de entorno"""
+    global _resiliencia
+    if _resiliencia is None:
+        with _resiliencia_lock:
+            if _resiliencia is None:
+                _resiliencia = ClienteResiliente(
+                    max_intentos=int(os.getenv('REINTENTOS_MAXIMOS', 3)),
+                    plazo=float(os.getenv('PLAZO_PETICION', 120)),
+                    plazos=_leer_plazos(os.getenv('PLAZOS_MODELOS', '')),
+                    respaldo=os.getenv('MODELO_RESPALDO') or None,
+                    umbral_respaldo=float(os.getenv('UMBRAL_RESPALDO') or 0) or None,
+                    umbral_fallos=int(os.getenv('CIRCUITO_FALLOS', 5)),
+                    enfriamiento=float(os.getenv('CIRCUITO_ENFRIAMIENTO', 30)))
+    return _resiliencia
@@ -0,0 +1,185 @@
+import os
+import re
+import unicodedata
+
+# Emociones que reconoce el Detector de Almas
+EMOCIONES = {
+    "FELIZ": "😊",
+    "TRISTE": "😢",
+    "ENOJADO": "😠",
+    "SORPRENDIDO": "😮",
+    "NEUTRAL": "😐",
+    "SARCÁSTICO": "😏"
+}
+
+SENTIMIENTO_NEUTRAL = "NEUTRAL 😐"
+
+
+def etiqueta(emocion):
+    """Devuelve la emoción con su emoji, p. ej. 'FELIZ 😊'"""
+    return f"{emocion} {EMOCIONES[emocion]}"
+
+
+def normalizar(texto):
+    """Pasa el texto a minúsculas y sin tildes para comparar con el léxico"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+class ClasificadorLexico:
+    """Clasificador local por palabras clave; no hace ninguna llamada de red"""
+
+    LEXICO = {
+        "FELIZ": {
+            "feliz", "felices", "alegre", "alegria", "genial", "excelente", "fantastico",
+            "maravilloso", "encanta", "encantado", "gracias", "perfecto", "estupendo",
+            "me alegra", "bien", "buenisimo", "divertido", "disfruta", "exito", "felicidades",
+            "happy", "great", "glad", "awesome", "wonderful", "love"
+        },
+        # "solo", "siento" o "error" son corrientes en respuestas neutras ("solo necesitas...", "este
+        # error ocurre..."): únicamente cuentan dentro de expresiones
+        "TRISTE": {
+            "triste", "tristeza", "lamento", "lamentablemente", "lo siento", "me siento mal",
+            "me siento solo", "me siento sola", "desafortunadamente", "dolor", "llorar", "deprimido",
+            "melancolia", "pena", "no puedo", "imposible",
+            "sad", "sorry", "unfortunately", "loss"
+        },
+        "ENOJADO": {
+            "enojado", "enfadado", "furioso", "odio", "rabia", "molesto", "indignante",
+            "inaceptable", "harto", "irritante", "basta", "ridiculo", "estupido",
+            "angry", "hate", "furious", "annoying"
+        },
+        "SORPRENDIDO": {
+            "sorprendente", "sorpresa", "increible", "asombroso", "impresionante", "wow",
+            "vaya", "guau", "inesperado", "curiosamente", "sabias que", "dato curioso",
+            "amazing", "surprising", "unexpected"
+        },
+        "SARCÁSTICO": {
+            "claro que si", "obviamente", "como no", "que sorpresa", "si, claro",
+            "por supuesto que no", "que original", "felicidades por nada",
+            "yeah right", "obviously"
+        }
+    }
+
+    NEGACIONES = {"no", "nunca", "jamas", "tampoco", "ni", "not", "never"}
+
+    def __init__(self, umbral=2):
+        # Puntuación mínima para salir de NEUTRAL
+        self.umbral = umbral
+        self.simples = {}
+        self.compuestas = {}
+        for emocion, palabras in self.LEXICO.items():
+            for palabra in palabras:
+                destino = self.compuestas if " " in palabra or "," in palabra else self.simples
+                destino.setdefault(palabra, emocion)
+
+    def clasificar(self, texto):
+        texto = normalizar(texto)
+        puntos = dict.fromkeys(self.LEXICO, 0)
+
+        # Expresiones de varias palabras
+        for expresion, emocion in self.compuestas.items():
+            puntos[emocion] += 2 * texto.count(expresion)
+
+        # Palabras sueltas, ignorando las que van justo después de una negación
+        tokens = re.findall(r"[a-zñ]+", texto)
+        for i, token in enumerate(tokens):
+            emocion = self.simples.get(token)
+            if emocion is None:
+                continue
+            if any(t in self.NEGACIONES for t in tokens[max(0, i - 2):i]):
+                continue
+            puntos[emocion] += 1
+
+        # Las exclamaciones refuerzan la emoción dominante
+        if texto.count("!") >= 2:
+            puntos["SORPRENDIDO"] += 1
+
+        emocion, mejor = max(puntos.items(), key=lambda par: par[1])
+        if mejor < self.umbral:
+            return SENTIMIENTO_NEUTRAL
+
+        # Un empate entre emociones opuestas no es concluyente
+        if sum(1 for valor in puntos.values() if valor == mejor) > 1:
+            return SENTIMIENTO_NEUTRAL
+        return etiqueta(emocion)
+
+
+class ClasificadorTransformers:
+    """Clasificador local con un modelo de emociones de Hugging Face (sin red tras la descarga)"""
+
+    MAPEO = {
+        "joy": "FELIZ",
+        "sadness": "TRISTE",
+        "fear": "TRISTE",
+        "anger": "ENOJADO",
+        "disgust": "ENOJADO",
+        "surprise": "SORPRENDIDO",
+        "others": "NEUTRAL"
+    }
+
+    def __init__(self, nombre_modelo="pysentimiento/robertuito-emotion-analysis"):
+        # Importación diferida: transformers es una dependencia opcional y pesada
+        from transformers import pipeline
+        self.pipeline = pipeline("text-classification", model=nombre_modelo, truncation=True)
+
+    def clasificar(self, texto):
+        resultado = self.pipeline(texto[:2000])[0]
+        emocion = self.MAPEO.get(resultado["label"].lower(), "NEUTRAL")
+        return etiqueta(emocion)
+
+
+class ClasificadorGemini:
+    """Clasificador remoto: pide la emoción al modelo (una llamada extra a la API)"""
+
+    # Sus llamadas ya quedan medidas en cliente.generar()
+    remoto = True
+
+    def __init__(self, nombre_modelo=None):
+        self.nombre_modelo = nombre_modelo or os.getenv('SENTIMIENTO_MODELO', 'gemini-2.0-flash')
+
+    def clasificar(self, texto):
+        prompt_sentimiento = f"""Analiza el sentimiento emocional del siguiente texto y responde SOLO con una de estas emociones:
+        - FELIZ 😊
+        - TRISTE 😢
+        - ENOJADO 😠
+        - SORPRENDIDO 😮
+        - NEUTRAL 😐
+        - SARCÁSTICO 😏
+
+        Texto a analizar: {texto}
+
+        Responde solo con la emoción y su emoji, nada más."""
+
+        # Pasa por generar() para que la llamada quede en la caché y en las métricas. Sin caché semántica:
+        # la plantilla pesa más que el texto y dos textos opuestos parecerían la misma pregunta
+        from cliente import generar
+        respuesta = normalizar(generar(self.nombre_modelo, prompt_sentimiento, similares=False,
+                                       medicion={"origen": "sentimiento"}))
+        for emocion in EMOCIONES:
+            if normalizar(emocion) in respuesta:
+                return etiqueta(emocion)
+        return SENTIMIENTO_NEUTRAL
+
+
+# Backends disponibles; se elige con SENTIMIENTO_BACKEND en .env/config.env
+CLASIFICADORES = {
+    "lexico": ClasificadorLexico,
+    "transformers": ClasificadorTransformers,
+    "gemini": ClasificadorGemini
+}
+
+
+def registrar_clasificador(nombre, fabrica):
+    """Añade un backend; la fábrica debe devolver un objeto con método clasificar(texto)"""
+    CLASIFICADORES[nombre] = fabrica
+
+
+def crear_clasificador(nombre=None):
+    """Crea el clasificador configurado, usando el léxico local si el backend no está disponible"""
+    nombre = nombre or os.getenv('SENTIMIENTO_BACKEND', 'lexico')
+    try:
+        return CLASIFICADORES[nombre]()
+    except Exception as e:
+        print(f"Error al crear el clasificador '{nombre}', usando el léxico local: {str(e)}")
+        return ClasificadorLexico()
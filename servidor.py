@@ -0,0 +1,341 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import binascii
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cliente import generar, precalentar
+from lote import LimitadorTokens
+from catalogo import obtener_catalogo
+from metricas import obtener_metricas
+from sentimiento import crear_clasificador
+from resiliencia import obtener_resiliencia, CUOTA, CIRCUITO, TIEMPO, PETICION, BLOQUEO
+
+MODELO_POR_DEFECTO = 'gemini-2.0-flash'
+
+# Tamaño máximo del cuerpo de una petición (las imágenes van en base64 dentro del JSON)
+MAX_CUERPO = 20 * 1024 * 1024
+
+# Segundos que una conexión keep-alive puede quedar inactiva
+TIEMPO_INACTIVO = 30
+
+# Clientes distintos de los que se recuerda el límite de peticiones
+MAX_CLIENTES = 10000
+
+ESTADOS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout"
+}
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, codigo, mensaje, cabeceras=None):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.mensaje = mensaje
+        self.cabeceras = cabeceras or {}
+
+
+class ServidorOraculo:
+    """API HTTP local del oráculo para muchos usuarios desde un solo proceso.
+
+    POST /preguntar    {"prompt", "modelo", "imagenes": [{"mime_type", "data" (base64)}], "sentimiento",
+                       "usar_cache", "stream"}; con "stream": true o Accept: text/event-stream responde
+                       con eventos SSE (fragmento, fin, error)
+    POST /sentimiento  {"texto"}
+    GET  /modelos, /metricas, /salud
+
+    Las llamadas a Gemini van a un grupo de hilos acotado que comparte el cliente del SDK (y sus
+    conexiones), la caché de respuestas y la coalescencia de peticiones idénticas. Cada cliente (su
+    IP) tiene su propio límite de peticiones por minuto; la cabecera X-Cliente es solo una etiqueta
+    para las métricas, salvo si llega de uno de los proxies de confianza (SERVIDOR_PROXIES), que
+    atienden a varios clientes desde la misma IP.
+    """
+
+    def __init__(self, anfitrion="127.0.0.1", puerto=8080, concurrencia=None, por_minuto=None, rafaga=None,
+                 proxies=None):
+        self.anfitrion = anfitrion
+        self.puerto = puerto
+        self.concurrencia = concurrencia or int(os.getenv('SERVIDOR_CONCURRENCIA', 16))
+        self.por_minuto = por_minuto or float(os.getenv('SERVIDOR_POR_MINUTO', 30))
+        self.rafaga = rafaga or int(os.getenv('SERVIDOR_RAFAGA', 5))
+        if proxies is None:
+            proxies = [ip.strip() for ip in os.getenv('SERVIDOR_PROXIES', '').split(',') if ip.strip()]
+        self.proxies = set(proxies)
+        self.ejecutor = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="servidor")
+        self.limitadores = OrderedDict()
+        self.clasificador = None
+        self.lock_clasificador = threading.Lock()
+        self.servidor = None
+
+    def limitar(self, cliente):
+        """Consume una petición del cliente o lanza un 429 con Retry-After"""
+        limitador = self.limitadores.get(cliente)
+        if limitador is None:
+            limitador = LimitadorTokens(self.por_minuto / 60.0, capacidad=self.rafaga)
+            self.limitadores[cliente] = limitador
+            while len(self.limitadores) > MAX_CLIENTES:
+                self.limitadores.popitem(last=False)
+        else:
+            self.limitadores.move_to_end(cliente)
+        espera = limitador.intentar()
+        if espera:
+            raise ErrorHTTP(429, "Demasiadas peticiones", {"Retry-After": str(max(1, round(espera)))})
+
+    def clasificar(self, texto):
+        # Un único clasificador para todos los clientes; el lock protege a los que no son reentrantes
+        with self.lock_clasificador:
+            if self.clasificador is None:
+                self.clasificador = crear_clasificador()
+            return self.clasificador.clasificar(texto)
+
+    async def iniciar(self):
+        """Abre el puerto y devuelve la URL del servidor"""
+        self.servidor = await asyncio.start_server(self._atender, self.anfitrion, self.puerto)
+        self.puerto = self.servidor.sockets[0].getsockname()[1]
+        precalentar(MODELO_POR_DEFECTO)
+        obtener_catalogo().refrescar()
+        return f"http://{self.anfitrion}:{self.puerto}"
+
+    async def servir(self):
+        if self.servidor is None:
+            await self.iniciar()
+        async with self.servidor:
+            await self.servidor.serve_forever()
+
+    async def _leer_peticion(self, lector):
+        # Devuelve (método, ruta, cabeceras, cuerpo) o None si el cliente cerró la conexión
+        try:
+            linea = await asyncio.wait_for(lector.readline(), TIEMPO_INACTIVO)
+        except asyncio.TimeoutError:
+            return None
+        if not linea.strip():
+            return None
+        try:
+            metodo, ruta, _ = linea.decode('latin-1').split(" ", 2)
+        except ValueError:
+            raise ErrorHTTP(400, "Línea de petición no válida")
+        cabeceras = {}
+        while True:
+            linea = await lector.readline()
+            if linea in (b"\r\n", b"\n", b""):
+                break
+            nombre, _, valor = linea.decode('latin-1').partition(":")
+            cabeceras[nombre.strip().lower()] = valor.strip()
+        try:
+            longitud = int(cabeceras.get("content-length") or 0)
+        except ValueError:
+            longitud = -1
+        if longitud < 0:
+            raise ErrorHTTP(400, "Content-Length no válido")
+        if longitud > MAX_CUERPO:
+            raise ErrorHTTP(413, f"El cuerpo supera {MAX_CUERPO // (1024 * 1024)} MB")
+        cuerpo = await lector.readexactly(longitud) if longitud else b""
+        return metodo.upper(), ruta.split("?", 1)[0], cabeceras, cuerpo
+
+    async def _atender(self, lector, escritor):
+        try:
+            while True:
+                try:
+                    peticion = await self._leer_peticion(lector)
+                except ErrorHTTP as e:
+                    await self._responder(escritor, e.codigo, {"error": e.mensaje}, cerrar=True)
+                    return
+                if peticion is None:
+                    return
+                metodo, ruta, cabeceras, cuerpo = peticion
+                cerrar = cabeceras.get("connection", "").lower() == "close"
+                seguir = await self._despachar(escritor, metodo, ruta, cabeceras, cuerpo, cerrar)
+                if cerrar or not seguir:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Error en el servidor: {str(e)}")
+        finally:
+            escritor.close()
+
+    async def _despachar(self, escritor, metodo, ruta, cabeceras, cuerpo, cerrar):
+        # Devuelve si la conexión puede seguir abierta para otra petición
+        # Un cliente que cambie la cabecera no consigue un límite nuevo: cuenta su IP
+        direccion = escritor.get_extra_info("peername")[0]
+        cliente = cabeceras.get("x-cliente") or direccion
+        limitado = cliente if direccion in self.proxies else direccion
+        try:
+            if ruta == "/salud":
+                await self._responder(escritor, 200, {"ok": True}, cerrar=cerrar)
+            elif ruta == "/modelos":
+                catalogo = obtener_catalogo()
+                await self._responder(escritor, 200, {"modelos": [catalogo.info(n) for n in catalogo.nombres()]},
+                                      cerrar=cerrar)
+            elif ruta == "/metricas":
+                await self._responder(escritor, 200, obtener_metricas().resumen("servidor"), cerrar=cerrar)
+            elif ruta in ("/preguntar", "/sentimiento"):
+                if metodo != "POST":
+                    raise ErrorHTTP(405, "Usa POST")
+                try:
+                    datos = json.loads(cuerpo or b"{}")
+                except ValueError:
+                    raise ErrorHTTP(400, "El cuerpo debe ser JSON")
+                if not isinstance(datos, dict):
+                    raise ErrorHTTP(400, "El cuerpo debe ser un objeto JSON")
+                self.limitar(limitado)
+                if ruta == "/sentimiento":
+                    return await self._sentimiento(escritor, datos, cerrar)
+                if datos.get("stream") or "text/event-stream" in cabeceras.get("accept", ""):
+                    await self._preguntar_stream(escritor, datos, cliente)
+                    return False
+                return await self._preguntar(escritor, datos, cliente, cerrar)
+            else:
+                raise ErrorHTTP(404, f"Ruta desconocida: {ruta}")
+        except ErrorHTTP as e:
+            await self._responder(escritor, e.codigo, {"error": e.mensaje}, e.cabeceras, cerrar)
+        return True
+
+    def _preparar(self, datos):
+        # Modelo y contenido de la pregunta; las imágenes solo se envían a modelos que las aceptan
+        prompt = datos.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ErrorHTTP(400, "Falta el prompt")
+        imagenes = []
+        for imagen in datos.get("imagenes") or []:
+            try:
+                imagenes.append({"mime_type": imagen.get("mime_type", "image/jpeg"),
+                                 "data": base64.b64decode(imagen["data"], validate=True)})
+            except (KeyError, TypeError, AttributeError, binascii.Error):
+                raise ErrorHTTP(400, "Imagen no válida: se espera {mime_type, data en base64}")
+        nombre_modelo = datos.get("modelo") or MODELO_POR_DEFECTO
+        if imagenes:
+            nombre_modelo = obtener_catalogo().modelo_para_imagenes(nombre_modelo)
+            if nombre_modelo is None:
+                raise ErrorHTTP(400, "Ningún modelo disponible admite imágenes")
+        contenido = [prompt] + imagenes if imagenes else prompt
+        return nombre_modelo, contenido, bool(datos.get("usar_cache", True))
+
+    def _generar(self, nombre_modelo, contenido, usar_cache, cliente, al_recibir=None, cancelado=None):
+        return generar(nombre_modelo, contenido, al_recibir, cancelado, usar_cache,
+                       medicion={"origen": "servidor", "cliente": cliente})
+
+    async def _preguntar(self, escritor, datos, cliente, cerrar):
+        nombre_modelo, contenido, usar_cache = self._preparar(datos)
+        loop = asyncio.get_running_loop()
+        inicio = time.perf_counter()
+        try:
+            texto = await loop.run_in_executor(self.ejecutor, self._generar, nombre_modelo, contenido,
+                                               usar_cache, cliente)
+        except Exception as e:
+            raise _error_upstream(e)
+        respuesta = {"respuesta": texto, "modelo": nombre_modelo, "segundos": round(time.perf_counter() - inicio, 3)}
+        if datos.get("sentimiento"):
+            respuesta["sentimiento"] = await loop.run_in_executor(self.ejecutor, self.clasificar, texto)
+        await self._responder(escritor, 200, respuesta, cerrar=cerrar)
+        return True
+
+    async def _preguntar_stream(self, escritor, datos, cliente):
+        nombre_modelo, contenido, usar_cache = self._preparar(datos)
+        loop = asyncio.get_running_loop()
+        cola = asyncio.Queue()
+        cancelado = threading.Event()
+        inicio = time.perf_counter()
+
+        def al_recibir(fragmento):
+            loop.call_soon_threadsafe(cola.put_nowait, fragmento)
+
+        futuro = loop.run_in_executor(self.ejecutor, self._generar, nombre_modelo, contenido, usar_cache,
+                                      cliente, al_recibir, cancelado)
+        escritor.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                        "Cache-Control: no-cache\r\nConnection: close\r\n\r\n").encode('utf-8'))
+        try:
+            while True:
+                siguiente = asyncio.ensure_future(cola.get())
+                hechos, _ = await asyncio.wait({siguiente, futuro}, return_when=asyncio.FIRST_COMPLETED)
+                if siguiente not in hechos:
+                    siguiente.cancel()
+                    break
+                await self._evento(escritor, "fragmento", {"texto": siguiente.result()})
+            # Los fragmentos entregados justo antes del final
+            while not cola.empty():
+                await self._evento(escritor, "fragmento", {"texto": cola.get_nowait()})
+            try:
+                texto = futuro.result()
+            except Exception as e:
+                await self._evento(escritor, "error", {"error": _error_upstream(e).mensaje})
+                return
+            final = {"modelo": nombre_modelo, "segundos": round(time.perf_counter() - inicio, 3)}
+            if datos.get("sentimiento"):
+                final["sentimiento"] = await loop.run_in_executor(self.ejecutor, self.clasificar, texto)
+            await self._evento(escritor, "fin", final)
+        finally:
+            # Si el cliente se fue a mitad, la petición a Gemini se corta (salvo que otros la compartan)
+            cancelado.set()
+
+    async def _sentimiento(self, escritor, datos, cerrar):
+        texto = datos.get("texto")
+        if not isinstance(texto, str) or not texto.strip():
+            raise ErrorHTTP(400, "Falta el texto")
+        sentimiento = await asyncio.get_running_loop().run_in_executor(self.ejecutor, self.clasificar, texto)
+        await self._responder(escritor, 200, {"sentimiento": sentimiento}, cerrar=cerrar)
+        return True
+
+    async def _evento(self, escritor, evento, datos):
+        escritor.write(f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n".encode('utf-8'))
+        await escritor.drain()
+
+    async def _responder(self, escritor, codigo, datos, cabeceras=None, cerrar=False):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+        lineas = [f"HTTP/1.1 {codigo} {ESTADOS.get(codigo, '')}",
+                  "Content-Type: application/json; charset=utf-8",
+                  f"Content-Length: {len(cuerpo)}",
+                  f"Connection: {'close' if cerrar else 'keep-alive'}"]
+        lineas += [f"{nombre}: {valor}" for nombre, valor in (cabeceras or {}).items()]
+        escritor.write(("\r\n".join(lineas) + "\r\n\r\n").encode('utf-8') + cuerpo)
+        await escritor.drain()
+
+    def cerrar(self):
+        if self.servidor is not None:
+            self.servidor.close()
+        self.ejecutor.shutdown(wait=False, cancel_futures=True)
+
+
+def _error_upstream(error):
+    # Según la clase de resiliencia.ErrorGemini: cuota 429, circuito abierto 503, plazo agotado 504,
+    # petición no válida o bloqueada 400 y el resto de fallos de la API 502
+    clase = getattr(error, 'clase', None)
+    if clase == CUOTA:
+        return ErrorHTTP(429, f"Cuota de Gemini agotada: {str(error)}", {"Retry-After": "30"})
+    if clase == CIRCUITO:
+        espera = max(1, round(obtener_resiliencia().enfriamiento))
+        return ErrorHTTP(503, f"Modelo no disponible: {str(error)}", {"Retry-After": str(espera)})
+    if clase == TIEMPO:
+        return ErrorHTTP(504, f"Tiempo agotado: {str(error)}")
+    if clase in (PETICION, BLOQUEO):
+        return ErrorHTTP(400, f"Petición rechazada por el modelo: {str(error)}")
+    return ErrorHTTP(502, f"Error al generar respuesta: {str(error)}")
+
+
+def servir(anfitrion="127.0.0.1", puerto=8080, concurrencia=None, por_minuto=None):
+    """Arranca el servidor y atiende peticiones hasta Ctrl+C"""
+    servidor = ServidorOraculo(anfitrion, puerto, concurrencia, por_minuto)
+
+    async def principal():
+        url = await servidor.iniciar()
+        print(f"🌐 Oráculo sirviendo en {url} (Ctrl+C para salir)")
+        await servidor.servir()
+
+    try:
+        asyncio.run(principal())
+    except KeyboardInterrupt:
+        print("\n👋 Servidor detenido")
+    finally:
+        servidor.cerrar()
@@ -0,0 +1,236 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Modelos que anuncia el servidor: (nombre, admite imágenes, tokens de entrada, tokens de salida)
+MODELOS_FALSOS = [
+    ("gemini-2.0-flash", True, 1048576, 8192),
+    ("gemini-2.5-flash", True, 1048576, 65536),
+    ("gemini-2.5-pro", True, 1048576, 65536),
+    ("gemini-1.5-flash-latest", True, 1048576, 8192),
+    ("text-embedding-004", False, 2048, 1)
+]
+
+RUTA_METODO = re.compile(r"^/(?P<version>v1\w*)/models/(?P<modelo>[^:/?]+):(?P<metodo>\w+)")
+
+TEXTO_BASE = ("El oráculo responde con calma a cada pregunta que le llega, sin prisa y con detalle. ")
+
+
+class ServidorFalso:
+    """Sustituto local del endpoint REST de Gemini para pruebas y benchmarks sin red.
+
+    Responde a generateContent, streamGenerateContent (array JSON por fragmentos, como el transporte
+    REST del SDK), countTokens y la lista de modelos, con latencia, tamaño de fragmento y tasa de
+    errores configurables. Se usa con GEMINI_API_ENDPOINT=http://127.0.0.1:<puerto>.
+    """
+
+    def __init__(self, puerto=0, latencia=0.2, latencia_fragmento=0.02, tamano_fragmento=40,
+                 longitud=400, tasa_errores=0.0, semilla=None, anfitrion="127.0.0.1"):
+        self.latencia = latencia
+        self.latencia_fragmento = latencia_fragmento
+        self.tamano_fragmento = tamano_fragmento
+        self.longitud = longitud
+        self.tasa_errores = tasa_errores
+        self.azar = random.Random(semilla)
+        self.lock = threading.Lock()
+        self.peticiones = 0
+        self.errores = 0
+
+        servidor = self
+
+        class Manejador(_Manejador):
+            falso = servidor
+
+        self.http = ThreadingHTTPServer((anfitrion, puerto), Manejador)
+        self.http.daemon_threads = True
+        self.hilo = None
+
+    @property
+    def url(self):
+        anfitrion, puerto = self.http.server_address[:2]
+        return f"http://{anfitrion}:{puerto}"
+
+    def iniciar(self):
+        """Arranca el servidor en un hilo y devuelve su URL"""
+        self.hilo = threading.Thread(target=self.http.serve_forever, name="servidor-falso", daemon=True)
+        self.hilo.start()
+        return self.url
+
+    def detener(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+    def _sortear_error(self):
+        with self.lock:
+            self.peticiones += 1
+            if self.tasa_errores and self.azar.random() < self.tasa_errores:
+                self.errores += 1
+                return self.azar.choice([(429, "RESOURCE_EXHAUSTED"), (500, "INTERNAL"), (503, "UNAVAILABLE")])
+        return None
+
+    def texto_respuesta(self, prompt):
+        # Respuesta determinista que depende del prompt, para que la caché se comporte como con la API
+        cabecera = f"Sobre «{prompt[:60]}»: "
+        cuerpo = TEXTO_BASE * (self.longitud // len(TEXTO_BASE) + 1)
+        return (cabecera + cuerpo)[:max(self.longitud, len(cabecera))]
+
+
+def _textos(cuerpo):
+    # Textos de las partes del último turno y número de imágenes de toda la petición
+    textos, imagenes = [], 0
+    # countTokens puede recibir la petición completa envuelta en generateContentRequest
+    cuerpo = cuerpo.get("generateContentRequest", cuerpo)
+    for contenido in cuerpo.get("contents", []):
+        for parte in contenido.get("parts", []):
+            if "text" in parte:
+                textos.append(parte["text"])
+            elif "inlineData" in parte or "inline_data" in parte:
+                imagenes += 1
+    return textos, imagenes
+
+
+def _tokens(textos, imagenes):
+    return sum(max(1, len(t) // 4) for t in textos) + imagenes * 258
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    falso = None
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _json(self, codigo, datos):
+        cuerpo = json.dumps(datos).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _error(self, codigo, estado):
+        self._json(codigo, {"error": {"code": codigo, "message": f"Error simulado ({estado})", "status": estado}})
+
+    def _fragmento(self, datos):
+        # Un trozo de la codificación chunked de HTTP/1.1
+        cuerpo = datos.encode('utf-8')
+        self.wfile.write(f"{len(cuerpo):X}\r\n".encode('ascii') + cuerpo + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/models"):
+            self._json(200, {"models": [_descripcion_modelo(*modelo) for modelo in MODELOS_FALSOS]})
+            return
+        coincidencia = re.match(r"^/v1\w*/models/([^/?]+)", self.path)
+        if coincidencia:
+            for modelo in MODELOS_FALSOS:
+                if modelo[0] == coincidencia.group(1):
+                    self._json(200, _descripcion_modelo(*modelo))
+                    return
+        self._error(404, "NOT_FOUND")
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        try:
+            cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+        except ValueError:
+            self._error(400, "INVALID_ARGUMENT")
+            return
+        coincidencia = RUTA_METODO.match(self.path)
+        if coincidencia is None:
+            self._error(404, "NOT_FOUND")
+            return
+
+        falso = self.falso
+        metodo = coincidencia.group("metodo")
+        textos, imagenes = _textos(cuerpo)
+        tokens_prompt = _tokens(textos, imagenes)
+
+        if metodo == "countTokens":
+            self._json(200, {"totalTokens": tokens_prompt})
+            return
+        if metodo not in ("generateContent", "streamGenerateContent"):
+            self._error(404, "NOT_FOUND")
+            return
+
+        time.sleep(falso.latencia)
+        error = falso._sortear_error()
+        if error is not None:
+            self._error(*error)
+            return
+
+        texto = falso.texto_respuesta(textos[-1] if textos else "")
+        uso = {"promptTokenCount": tokens_prompt, "candidatesTokenCount": max(1, len(texto) // 4),
+               "totalTokenCount": tokens_prompt + max(1, len(texto) // 4)}
+
+        if metodo == "generateContent":
+            self._json(200, _respuesta(texto, uso))
+            return
+
+        # Streaming: array JSON enviado elemento a elemento con codificación chunked
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        paso = max(1, falso.tamano_fragmento)
+        trozos = [texto[i:i + paso] for i in range(0, len(texto), paso)]
+        for indice, trozo in enumerate(trozos):
+            if indice:
+                time.sleep(falso.latencia_fragmento)
+            ultimo = indice == len(trozos) - 1
+            elemento = json.dumps(_respuesta(trozo, uso if ultimo else None, ultimo))
+            self._fragmento(("[" if indice == 0 else ",\r\n") + elemento)
+        self._fragmento("]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _respuesta(texto, uso=None, final=True):
+    candidato = {"content": {"parts": [{"text": texto}], "role": "model"}, "index": 0}
+    if final:
+        candidato["finishReason"] = "STOP"
+    respuesta = {"candidates": [candidato]}
+    if uso is not None:
+        respuesta["usageMetadata"] = uso
+    return respuesta
+
+
+def _descripcion_modelo(nombre, vision, entrada, salida):
+    metodos = ["embedContent"] if nombre.startswith("text-embedding") else ["generateContent", "countTokens"]
+    return {
+        "name": f"models/{nombre}",
+        "baseModelId": nombre,
+        "version": "001",
+        "displayName": nombre,
+        "description": f"Modelo simulado{' con visión' if vision else ''}",
+        "inputTokenLimit": entrada,
+        "outputTokenLimit": salida,
+        "supportedGenerationMethods": metodos
+    }
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de Gemini")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.2, help="segundos hasta el primer fragmento")
+    parser.add_argument("--latencia-fragmento", type=float, default=0.02, help="segundos entre fragmentos")
+    parser.add_argument("--fragmento", type=int, default=40, help="caracteres por fragmento")
+    parser.add_argument("--longitud", type=int, default=400, help="caracteres de cada respuesta")
+    parser.add_argument("--errores", type=float, default=0.0, help="fracción de peticiones que fallan (429/5xx)")
+    parser.add_argument("--semilla", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parsear_argumentos()
+    servidor = ServidorFalso(args.puerto, args.latencia, args.latencia_fragmento, args.fragmento,
+                             args.longitud, args.errores, args.semilla)
+    print(f"🧪 Servidor falso de Gemini en {servidor.url} (Ctrl+C para salir)")
+    try:
+        servidor.http.serve_forever()
+    except KeyboardInterrupt:
+        servidor.detener()
@@ -0,0 +1,45 @@
+import os
+import sys
+import pathlib
+import pytest
+
+# Los módulos del proyecto están en la raíz del repositorio, sin paquete
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# Instancias compartidas del proceso (obtener_X) que cada prueba debe crear de nuevo
+SINGLETONS = ["cache_respuestas._cache", "cache_semantica._semantica", "calificaciones._calificaciones",
+              "historial._historial", "metricas._metricas", "resiliencia._resiliencia"]
+
+
+@pytest.fixture(autouse=True)
+def entorno_aislado(tmp_path, monkeypatch):
+    """Cada prueba escribe cachés, métricas e historial en su propio directorio temporal"""
+    monkeypatch.setenv("CACHE_RUTA", str(tmp_path / "respuestas.sqlite3"))
+    monkeypatch.setenv("HISTORIAL_RUTA", str(tmp_path / "historial.sqlite3"))
+    monkeypatch.setenv("CALIFICACIONES_RUTA", str(tmp_path / "calificaciones.jsonl"))
+    monkeypatch.setenv("METRICAS_RUTA", "")
+    monkeypatch.setenv("GEMINI_API_KEY", os.getenv("GEMINI_API_KEY", "local"))
+    for singleton in SINGLETONS:
+        monkeypatch.setattr(singleton, None)
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def _servidor_sesion():
+    # El SDK se configura una sola vez por proceso: el endpoint falso vale para toda la sesión
+    pytest.importorskip("google.generativeai")
+    from servidor_falso import ServidorFalso
+    servidor = ServidorFalso(latencia=0.05, latencia_fragmento=0.0, semilla=1)
+    os.environ["GEMINI_API_ENDPOINT"] = servidor.iniciar()
+    yield servidor
+    servidor.detener()
+
+
+@pytest.fixture
+def servidor_falso(_servidor_sesion):
+    """Servidor falso de Gemini sin errores; cada prueba puede cambiar su latencia o tasa de errores"""
+    servidor = _servidor_sesion
+    servidor.latencia, servidor.tasa_errores = 0.05, 0.0
+    servidor.peticiones = servidor.errores = 0
+    yield servidor
+    servidor.latencia, servidor.tasa_errores = 0.05, 0.0
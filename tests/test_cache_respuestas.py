@@ -0,0 +1,110 @@
+import pytest
+import cache_respuestas
+from cache_respuestas import CacheRespuestas
+
+
+class Reloj:
+    """Sustituye a time.time en la caché para avanzar el tiempo a mano"""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(cache_respuestas.time, "time", reloj)
+    return reloj
+
+
+def crear(tmp_path, **limites):
+    return CacheRespuestas(ruta=tmp_path / "cache.sqlite3", **limites)
+
+
+def test_clave_distingue_modelo_y_contenido():
+    clave = CacheRespuestas.clave("gemini-2.0-flash", "¿Qué es Python?")
+    assert clave == CacheRespuestas.clave("gemini-2.0-flash", "¿Qué es Python?")
+    assert clave != CacheRespuestas.clave("gemini-1.5-pro", "¿Qué es Python?")
+    assert clave != CacheRespuestas.clave("gemini-2.0-flash", "¿Qué es Java?")
+    assert clave != CacheRespuestas.clave("gemini-2.0-flash", "¿Qué es Python?", {"temperature": 0})
+
+
+def test_entrada_caducada_es_un_fallo(tmp_path, reloj):
+    cache = crear(tmp_path, ttl=60)
+    cache.guardar("a", "modelo", "respuesta")
+    reloj.ahora += 59
+    assert cache.obtener("a") == "respuesta"
+    reloj.ahora += 2
+    assert cache.obtener("a") is None
+    estadisticas = cache.estadisticas()
+    assert (estadisticas["aciertos"], estadisticas["fallos"]) == (1, 1)
+
+
+def test_acceder_no_alarga_la_caducidad(tmp_path, reloj):
+    cache = crear(tmp_path, ttl=60)
+    cache.guardar("a", "modelo", "respuesta")
+    reloj.ahora += 50
+    assert cache.obtener("a") == "respuesta"
+    reloj.ahora += 50
+    assert cache.obtener("a") is None
+
+
+def test_guardar_borra_las_caducadas(tmp_path, reloj):
+    cache = crear(tmp_path, ttl=60)
+    cache.guardar("vieja", "modelo", "respuesta")
+    reloj.ahora += 120
+    cache.guardar("nueva", "modelo", "respuesta")
+    assert cache.estadisticas()["entradas"] == 1
+
+
+def test_ttl_cero_no_caduca(tmp_path, reloj):
+    cache = crear(tmp_path, ttl=0)
+    cache.guardar("a", "modelo", "respuesta")
+    reloj.ahora += 10 ** 9
+    assert cache.obtener("a") == "respuesta"
+
+
+def test_expulsa_la_menos_usada_por_entradas(tmp_path, reloj):
+    cache = crear(tmp_path, max_entradas=3)
+    for clave in "abc":
+        reloj.ahora += 1
+        cache.guardar(clave, "modelo", clave)
+    # Leer "a" la convierte en la más reciente: la menos usada pasa a ser "b"
+    reloj.ahora += 1
+    assert cache.obtener("a") == "a"
+    reloj.ahora += 1
+    cache.guardar("d", "modelo", "d")
+    assert cache.obtener("b") is None
+    assert [cache.obtener(clave) for clave in "acd"] == ["a", "c", "d"]
+    assert cache.estadisticas()["entradas"] == 3
+
+
+def test_expulsa_la_menos_usada_por_tamano(tmp_path, reloj):
+    cache = crear(tmp_path, max_bytes=250)
+    for clave in "abc":
+        reloj.ahora += 1
+        cache.guardar(clave, "modelo", "x" * 100)
+    estadisticas = cache.estadisticas()
+    assert (estadisticas["entradas"], estadisticas["bytes"]) == (2, 200)
+    assert cache.obtener("a") is None
+    assert cache.obtener("c") == "x" * 100
+
+
+def test_sobrescribir_no_duplica(tmp_path, reloj):
+    cache = crear(tmp_path, max_entradas=2)
+    cache.guardar("a", "modelo", "uno")
+    reloj.ahora += 1
+    cache.guardar("a", "modelo", "dos")
+    assert cache.obtener("a") == "dos"
+    assert cache.estadisticas()["entradas"] == 1
+
+
+def test_segunda_pregunta_no_llega_al_servidor(servidor_falso):
+    from cliente import generar
+    primera = generar("gemini-2.0-flash", "¿Qué es la caché?", similares=False)
+    assert generar("gemini-2.0-flash", "¿Qué es la caché?", similares=False) == primera
+    assert servidor_falso.peticiones == 1
+    assert cache_respuestas.obtener_cache().estadisticas()["aciertos"] == 1
@@ -0,0 +1,37 @@
+import pytest
+from cache_semantica import VectorizadorHash
+
+UMBRAL = 0.9
+
+
+def similitud(vectorizador, a, b):
+    x, y = vectorizador.vectorizar(a), vectorizador.vectorizar(b)
+    return sum(valor * y.get(indice, 0.0) for indice, valor in x.items())
+
+
+@pytest.mark.parametrize("a, b", [
+    ("¿Por qué el cielo es azul?", "¿Es el cielo azul?"),
+    ("¿Para qué sirve Python?", "¿Sirve Python?"),
+    ("¿Quién es Mercurio?", "¿Qué es Mercurio?"),
+    ("¿Qué es Mercurio?", "¿Qué es Madrid?"),
+])
+def test_preguntas_distintas_quedan_bajo_el_umbral(a, b):
+    assert similitud(VectorizadorHash(), a, b) < UMBRAL
+
+
+@pytest.mark.parametrize("a, b", [
+    ("¿Qué es la fotosíntesis en las plantas?", "Explícame la fotosíntesis en plantas"),
+    ("¿Qué son los agujeros negros?", "¿Qué es un agujero negro?"),
+])
+def test_reformulaciones_superan_el_umbral(a, b):
+    assert similitud(VectorizadorHash(), a, b) >= UMBRAL
+
+
+def test_temas_de_una_palabra_no_colisionan():
+    vectorizador = VectorizadorHash()
+    temas = [f"tema{i}x" for i in range(2000)]
+    vistos = set()
+    for tema in temas:
+        (indice,) = vectorizador.vectorizar(f"¿Qué es {tema}?")
+        assert indice not in vistos
+        vistos.add(indice)
@@ -0,0 +1,133 @@
+import json
+import time
+import random
+import types
+import pytest
+import calificaciones
+from calificaciones import RegistroCalificaciones, DIMENSIONES, SIN_SENTIMIENTO
+
+MODELOS = ["gemini-2.0-flash", "gemini-2.5-pro"]
+SENTIMIENTOS = ["POSITIVO", "NEGATIVO", "NEUTRAL"]
+
+
+def recalcular(ruta):
+    """Agregados calculados desde cero: la última calificación de cada respuesta del registro"""
+    vigentes = {}
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            evento = json.loads(linea)
+            vigentes[evento["c"]] = (evento["v"], evento["m"], evento["s"], evento["d"])
+    totales = [0, 0]
+    agregados = {dimension: {} for dimension in DIMENSIONES}
+    for valor, *claves in vigentes.values():
+        indice = 0 if valor else 1
+        totales[indice] += 1
+        for dimension, clave in zip(DIMENSIONES, claves):
+            agregados[dimension].setdefault(clave, [0, 0])[indice] += 1
+    return totales, agregados
+
+
+def comprobar(registro):
+    totales, agregados = recalcular(registro.ruta)
+    assert registro.totales == totales
+    assert registro.agregados == agregados
+
+
+@pytest.fixture
+def dias(monkeypatch):
+    """Reloj de calificaciones que se puede mover de día sin tocar el time del resto del proceso"""
+    reloj = types.SimpleNamespace(ahora=time.time())
+    monkeypatch.setattr(calificaciones, "time", types.SimpleNamespace(
+        time=lambda: reloj.ahora, strftime=time.strftime, localtime=time.localtime))
+    return reloj
+
+
+def calificar_al_azar(registro, azar, respuestas, veces, dias):
+    for _ in range(veces):
+        respuesta = azar.choice(respuestas)
+        if azar.random() < 0.1:
+            dias.ahora += 86400
+        if azar.random() < 0.3:
+            registro.reclasificar(respuesta, azar.choice(SENTIMIENTOS))
+        else:
+            modelo = registro.activas.get(respuesta, [None, azar.choice(MODELOS)])[1]
+            registro.calificar(respuesta, modelo, azar.random() < 0.6,
+                               azar.choice(SENTIMIENTOS + [None]))
+
+
+def test_agregados_incrementales_igual_que_recalcular(tmp_path, dias):
+    registro = RegistroCalificaciones(tmp_path / "calificaciones.jsonl")
+    calificar_al_azar(registro, random.Random(1), list(range(40)), 400, dias)
+    comprobar(registro)
+    assert len(registro.agregados["dia"]) > 1
+    resumen = registro.resumen()
+    assert resumen["likes"] + resumen["dislikes"] == len(registro.activas)
+
+
+def test_cambiar_la_calificacion_mueve_de_grupo(tmp_path, dias):
+    registro = RegistroCalificaciones(tmp_path / "calificaciones.jsonl")
+    registro.calificar(1, "gemini-2.0-flash", True)
+    assert registro.agregados["sentimiento"] == {SIN_SENTIMIENTO: [1, 0]}
+    registro.reclasificar(1, "POSITIVO")
+    dias.ahora += 86400
+    registro.calificar(1, "gemini-2.0-flash", False, "POSITIVO")
+    # El día sigue siendo el de la primera calificación
+    assert len(registro.agregados["dia"]) == 1
+    assert registro.agregados["sentimiento"] == {"POSITIVO": [0, 1]}
+    assert registro.resumen("gemini-2.0-flash") == {"likes": 0, "dislikes": 1, "satisfaccion": 0.0}
+    comprobar(registro)
+
+
+def test_repetir_la_misma_calificacion_no_escribe(tmp_path):
+    ruta = tmp_path / "calificaciones.jsonl"
+    registro = RegistroCalificaciones(ruta)
+    registro.calificar(1, "gemini-2.0-flash", True, "POSITIVO")
+    registro.calificar(1, "gemini-2.0-flash", True, "POSITIVO")
+    assert len(ruta.read_text(encoding='utf-8').splitlines()) == 1
+
+
+@pytest.mark.parametrize("cerrar", [True, False])
+def test_reabrir_continua_desde_el_resumen(tmp_path, dias, cerrar):
+    ruta = tmp_path / "calificaciones.jsonl"
+    azar = random.Random(2)
+    primero = RegistroCalificaciones(ruta, cada=7)
+    calificar_al_azar(primero, azar, list(range(20)), 150, dias)
+    if cerrar:
+        primero.cerrar()
+
+    # Sin cerrar, el resumen va por detrás del registro y se leen solo las líneas que faltan
+    segundo = RegistroCalificaciones(ruta, cada=7)
+    assert segundo.posicion == ruta.stat().st_size
+    comprobar(segundo)
+
+    calificar_al_azar(segundo, azar, list(range(100, 120)), 150, dias)
+    segundo.cerrar()
+    comprobar(RegistroCalificaciones(ruta))
+
+
+def test_linea_a_medio_escribir_se_descarta(tmp_path):
+    ruta = tmp_path / "calificaciones.jsonl"
+    registro = RegistroCalificaciones(ruta, cada=100)
+    registro.calificar(1, "gemini-2.0-flash", True)
+    registro.calificar(2, "gemini-2.0-flash", False)
+    with open(ruta, 'ab') as f:
+        f.write(b'{"t":1,"c":3,"v":1')
+
+    reabierto = RegistroCalificaciones(ruta)
+    assert reabierto.totales == [1, 1]
+    comprobar(reabierto)
+    reabierto.calificar(3, "gemini-2.0-flash", True)
+    comprobar(RegistroCalificaciones(ruta))
+
+
+def test_registro_sustituido_invalida_el_resumen(tmp_path):
+    ruta = tmp_path / "calificaciones.jsonl"
+    registro = RegistroCalificaciones(ruta)
+    for respuesta in range(5):
+        registro.calificar(respuesta, "gemini-2.0-flash", True)
+    registro.cerrar()
+    ruta.write_text("", encoding='utf-8')
+
+    reabierto = RegistroCalificaciones(ruta)
+    assert reabierto.totales == [0, 0]
+    assert reabierto.agregados == {dimension: {} for dimension in DIMENSIONES}
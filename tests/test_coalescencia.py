@@ -0,0 +1,165 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from coalescencia import Coalescedor
+
+
+class Lider:
+    """Función para el coalescedor que no termina hasta que la prueba lo permite"""
+
+    def __init__(self, resultado="respuesta", error=None, fragmentos=()):
+        self.resultado = resultado
+        self.error = error
+        self.fragmentos = fragmentos
+        self.empezada = threading.Event()
+        self.seguir = threading.Event()
+        self.llamadas = 0
+
+    def __call__(self, publicar, cancelado):
+        self.llamadas += 1
+        for fragmento in self.fragmentos:
+            publicar(fragmento)
+        self.empezada.set()
+        assert self.seguir.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.resultado
+
+
+def esperar_unidas(coalescedor, unidas):
+    for _ in range(500):
+        if coalescedor.unidas >= unidas:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"solo se unieron {coalescedor.unidas} llamadas")
+
+
+def test_llamadas_simultaneas_comparten_una_sola_ejecucion():
+    coalescedor = Coalescedor()
+    funcion = Lider()
+    with ThreadPoolExecutor(5) as ejecutor:
+        lider = ejecutor.submit(coalescedor.ejecutar, "clave", funcion)
+        assert funcion.empezada.wait(5)
+        unidas = [ejecutor.submit(coalescedor.ejecutar, "clave", funcion) for _ in range(4)]
+        esperar_unidas(coalescedor, 4)
+        funcion.seguir.set()
+        assert lider.result() == ("respuesta", False)
+        assert [futuro.result() for futuro in unidas] == [("respuesta", True)] * 4
+    assert funcion.llamadas == 1
+    assert coalescedor.vuelos == {}
+
+
+def test_claves_distintas_no_se_unen():
+    coalescedor = Coalescedor()
+    resultados = [coalescedor.ejecutar(clave, lambda publicar, cancelado, c=clave: c) for clave in "ab"]
+    assert resultados == [("a", False), ("b", False)]
+    assert coalescedor.unidas == 0
+
+
+def test_quien_llega_tarde_recibe_los_fragmentos_desde_el_principio():
+    coalescedor = Coalescedor()
+    funcion = Lider(fragmentos=["uno ", "dos "])
+    recibidos = []
+    with ThreadPoolExecutor(2) as ejecutor:
+        lider = ejecutor.submit(coalescedor.ejecutar, "clave", funcion)
+        assert funcion.empezada.wait(5)
+        unida = ejecutor.submit(coalescedor.ejecutar, "clave", funcion, recibidos.append)
+        esperar_unidas(coalescedor, 1)
+        funcion.seguir.set()
+        lider.result()
+        unida.result()
+    assert recibidos == ["uno ", "dos "]
+
+
+def test_el_error_del_lider_llega_a_todos_y_no_envenena_la_clave():
+    coalescedor = Coalescedor()
+    funcion = Lider(error=RuntimeError("caída"))
+    with ThreadPoolExecutor(4) as ejecutor:
+        lider = ejecutor.submit(coalescedor.ejecutar, "clave", funcion)
+        assert funcion.empezada.wait(5)
+        unidas = [ejecutor.submit(coalescedor.ejecutar, "clave", funcion) for _ in range(3)]
+        esperar_unidas(coalescedor, 3)
+        funcion.seguir.set()
+        for futuro in [lider] + unidas:
+            with pytest.raises(RuntimeError, match="caída"):
+                futuro.result()
+    assert funcion.llamadas == 1
+
+    # Tras el fallo, la siguiente llamada con la misma clave se ejecuta de nuevo
+    assert coalescedor.ejecutar("clave", lambda publicar, cancelado: "bien") == ("bien", False)
+
+
+def test_cancelar_una_unida_no_cancela_la_llamada():
+    coalescedor = Coalescedor()
+    funcion = Lider()
+    cancelado = threading.Event()
+    with ThreadPoolExecutor(2) as ejecutor:
+        lider = ejecutor.submit(coalescedor.ejecutar, "clave", funcion)
+        assert funcion.empezada.wait(5)
+        unida = ejecutor.submit(coalescedor.ejecutar, "clave", funcion, None, cancelado)
+        esperar_unidas(coalescedor, 1)
+        cancelado.set()
+        with pytest.raises(InterruptedError):
+            unida.result(5)
+        # El líder no pasó evento de cancelación: la llamada conjunta sigue viva
+        assert not coalescedor.vuelos["clave"].cancelado.is_set()
+        funcion.seguir.set()
+        assert lider.result() == ("respuesta", False)
+
+
+def test_version_asincrona_comparte_la_llamada_y_el_error():
+    coalescedor = Coalescedor()
+    llamadas = []
+
+    async def funcion(error=None):
+        llamadas.append(True)
+        await asyncio.sleep(0.05)
+        if error is not None:
+            raise error
+        return "respuesta"
+
+    async def probar():
+        resultados = await asyncio.gather(*[coalescedor.ejecutar_async("clave", funcion) for _ in range(4)])
+        assert sorted(resultados, key=lambda r: r[1]) == [("respuesta", False)] + [("respuesta", True)] * 3
+
+        fallidas = await asyncio.gather(
+            *[coalescedor.ejecutar_async("otra", lambda: funcion(ValueError("caída"))) for _ in range(3)],
+            return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in fallidas)
+        assert await coalescedor.ejecutar_async("otra", funcion) == ("respuesta", False)
+
+    asyncio.run(probar())
+    assert len(llamadas) == 3
+
+
+def test_preguntas_iguales_llegan_una_vez_al_servidor(servidor_falso):
+    from cliente import generar
+    servidor_falso.latencia = 0.3
+    with ThreadPoolExecutor(5) as ejecutor:
+        textos = list(ejecutor.map(
+            lambda _: generar("gemini-2.0-flash", "¿Cuántas lunas tiene Marte?", usar_cache=False), range(5)))
+    assert len(set(textos)) == 1
+    assert servidor_falso.peticiones == 1
+
+
+def test_fallo_compartido_contra_el_servidor(servidor_falso, monkeypatch):
+    from cliente import generar
+    from resiliencia import ErrorGemini
+    monkeypatch.setenv("REINTENTOS_MAXIMOS", "1")
+    servidor_falso.latencia, servidor_falso.tasa_errores = 0.3, 1.0
+
+    def preguntar(_):
+        try:
+            return generar("gemini-2.0-flash", "¿Qué hay en Plutón?", usar_cache=False)
+        except ErrorGemini as e:
+            return e
+
+    with ThreadPoolExecutor(4) as ejecutor:
+        resultados = list(ejecutor.map(preguntar, range(4)))
+    assert all(isinstance(resultado, ErrorGemini) for resultado in resultados)
+    assert servidor_falso.peticiones == 1
+
+    servidor_falso.tasa_errores = 0.0
+    assert generar("gemini-2.0-flash", "¿Qué hay en Plutón?", usar_cache=False)
+    assert servidor_falso.peticiones == 2
@@ -0,0 +1,218 @@
+import time
+import asyncio
+import threading
+import pytest
+from resiliencia import Circuito, ClienteResiliente, ErrorGemini, CIRCUITO, PETICION, SERVIDOR
+
+
+# Enfriamiento corto del cortacircuitos en las pruebas
+ENFRIAMIENTO = 0.2
+
+
+def enfriar():
+    time.sleep(ENFRIAMIENTO + 0.01)
+
+
+def crear(**opciones):
+    opciones.setdefault("espera_base", 0.0)
+    return ClienteResiliente(**opciones)
+
+
+def test_circuito_cerrado_abierto_semiabierto_cerrado():
+    circuito = Circuito(umbral=3, enfriamiento=ENFRIAMIENTO)
+    for _ in range(2):
+        circuito.fallo()
+    assert circuito.estado == "cerrado" and circuito.permite()
+
+    circuito.fallo()
+    assert circuito.estado == "abierto"
+    assert not circuito.permite()
+
+    enfriar()
+    assert circuito.estado == "semiabierto"
+    # Una sola petición de prueba a la vez
+    assert circuito.permite()
+    assert not circuito.permite()
+
+    circuito.exito()
+    assert circuito.estado == "cerrado" and circuito.permite()
+
+
+def test_prueba_fallida_vuelve_a_abrir():
+    circuito = Circuito(umbral=1, enfriamiento=ENFRIAMIENTO)
+    circuito.fallo()
+    enfriar()
+    assert circuito.permite()
+    circuito.fallo()
+    assert circuito.estado == "abierto"
+    assert not circuito.permite()
+    enfriar()
+    assert circuito.permite()
+
+
+def test_liberar_suelta_la_prueba_sin_cerrar():
+    circuito = Circuito(umbral=1, enfriamiento=ENFRIAMIENTO)
+    circuito.fallo()
+    enfriar()
+    assert circuito.permite()
+    circuito.liberar()
+    assert circuito.estado == "semiabierto"
+    assert circuito.permite()
+
+
+def test_reintenta_errores_pasajeros():
+    cliente = crear(max_intentos=3)
+    llamadas = []
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        llamadas.append(nombre)
+        if len(llamadas) < 3:
+            raise ErrorGemini(SERVIDOR, nombre)
+        return "respuesta"
+
+    assert cliente.ejecutar("principal", llamar) == ("respuesta", "principal", 3)
+    assert cliente.circuito("principal").fallos == 0
+
+
+def test_errores_de_peticion_ni_se_reintentan_ni_abren_el_circuito():
+    cliente = crear(max_intentos=3, umbral_fallos=1)
+    llamadas = []
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        llamadas.append(nombre)
+        raise ErrorGemini(PETICION, nombre)
+
+    with pytest.raises(ErrorGemini) as error:
+        cliente.ejecutar("principal", llamar)
+    assert error.value.clase == PETICION
+    assert len(llamadas) == 1
+    assert cliente.circuito("principal").estado == "cerrado"
+
+
+def test_circuito_abierto_no_llama_y_usa_el_respaldo():
+    cliente = crear(max_intentos=1, umbral_fallos=2, enfriamiento=ENFRIAMIENTO, respaldo="respaldo")
+    llamadas = []
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        llamadas.append(nombre)
+        if nombre == "principal":
+            raise ErrorGemini(SERVIDOR, nombre)
+        return "del respaldo"
+
+    for _ in range(2):
+        with pytest.raises(ErrorGemini):
+            cliente._llamar("principal", llamar, None, None, time.monotonic() + 60)
+    assert cliente.circuito("principal").estado == "abierto"
+
+    llamadas.clear()
+    assert cliente.ejecutar("principal", llamar) == ("del respaldo", "respaldo", 1)
+    assert llamadas == ["respaldo"]
+    with pytest.raises(ErrorGemini) as error:
+        cliente.ejecutar("principal", llamar, con_respaldo=False)
+    assert error.value.clase == CIRCUITO
+    assert llamadas == ["respaldo"]
+
+
+def test_interrupcion_en_la_prueba_suelta_el_circuito():
+    cliente = crear(umbral_fallos=1, enfriamiento=ENFRIAMIENTO)
+    cliente.circuito("principal").fallo()
+    enfriar()
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        cliente.ejecutar("principal", llamar)
+    assert not cliente.circuito("principal").probando
+    assert cliente.ejecutar("principal", lambda *_: "bien") == ("bien", "principal", 1)
+    assert cliente.circuito("principal").estado == "cerrado"
+
+
+def test_tarea_async_cancelada_suelta_el_circuito():
+    cliente = crear(umbral_fallos=1, enfriamiento=ENFRIAMIENTO)
+    cliente.circuito("principal").fallo()
+    enfriar()
+
+    async def llamar(nombre, plazo):
+        await asyncio.sleep(10)
+
+    async def probar():
+        tarea = asyncio.ensure_future(cliente.ejecutar_async("principal", llamar))
+        await asyncio.sleep(0.01)
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+
+    asyncio.run(probar())
+    assert not cliente.circuito("principal").probando
+
+
+class Lento:
+    """Modelo principal que no responde hasta que lo cancelan"""
+
+    def __init__(self):
+        self.cancelado = threading.Event()
+
+    def __call__(self, cancelado):
+        while not cancelado.is_set():
+            threading.Event().wait(0.01)
+        self.cancelado.set()
+        return "tarde"
+
+
+def test_carrera_gana_el_respaldo_y_cancela_al_principal():
+    cliente = crear(respaldo="respaldo", umbral_respaldo=0.05)
+    lento = Lento()
+    recibidos = []
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        if nombre == "principal":
+            return lento(cancelado)
+        al_recibir("hola")
+        return "del respaldo"
+
+    resultado = cliente.ejecutar("principal", llamar, recibidos.append)
+    assert resultado == ("del respaldo", "respaldo", 1)
+    assert recibidos == ["hola"]
+    assert lento.cancelado.wait(5)
+    # Perder la carrera no cuenta como fallo del principal
+    assert cliente.circuito("principal").fallos == 0
+
+
+def test_carrera_sin_streaming_gana_el_primero_en_terminar():
+    cliente = crear(respaldo="respaldo", umbral_respaldo=0.05)
+    lento = Lento()
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        return lento(cancelado) if nombre == "principal" else "del respaldo"
+
+    assert cliente.ejecutar("principal", llamar) == ("del respaldo", "respaldo", 1)
+    assert lento.cancelado.wait(5)
+
+
+def test_principal_rapido_no_lanza_el_respaldo():
+    cliente = crear(respaldo="respaldo", umbral_respaldo=5)
+    llamadas = []
+
+    def llamar(nombre, al_recibir, cancelado, plazo):
+        llamadas.append(nombre)
+        return "del principal"
+
+    assert cliente.ejecutar("principal", llamar) == ("del principal", "principal", 1)
+    assert llamadas == ["principal"]
+
+
+def test_circuito_contra_el_servidor(servidor_falso, monkeypatch):
+    from cliente import generar
+    monkeypatch.setenv("REINTENTOS_MAXIMOS", "1")
+    monkeypatch.setenv("CIRCUITO_FALLOS", "2")
+    servidor_falso.tasa_errores = 1.0
+
+    for pregunta in ("uno", "dos"):
+        with pytest.raises(ErrorGemini) as error:
+            generar("gemini-2.0-flash", pregunta, usar_cache=False)
+        assert error.value.reintentable
+    with pytest.raises(ErrorGemini) as error:
+        generar("gemini-2.0-flash", "tres", usar_cache=False)
+    assert error.value.clase == CIRCUITO
+    assert servidor_falso.peticiones == 2
@@ -0,0 +1,273 @@
+import tkinter as tk
+from tkinter import ttk
+from historial import AlmacenMensajes
+
+# Mensajes que se mantienen dibujados a la vez en el widget de texto
+VENTANA_MENSAJES = 60
+
+# Controles de evaluación que se reutilizan entre las respuestas visibles
+TAMANO_POOL_EVALUACION = 12
+
+# Texto que acompaña a cada evaluación
+TEXTO_EVALUACION = {
+    True: "¡Gracias por tu evaluación positiva! 🌟",
+    False: "Gracias por tu retroalimentación 📝",
+    None: ""
+}
+
+
+class Transcripcion(ttk.Frame):
+    """Vista virtualizada de la conversación.
+
+    Solo se dibuja una ventana de mensajes alrededor de lo visible; al desplazarse hasta un borde
+    la ventana se corre media página. Añadir un mensaje al final recorta el primero de la ventana,
+    y los botones de evaluación salen de un pool fijo que se coloca sobre las respuestas visibles,
+    así que el coste de insertar y desplazarse no depende de la longitud de la conversación.
+    """
+
+    def __init__(self, master, almacen=None, al_evaluar=None, ventana=VENTANA_MENSAJES,
+                 tamano_pool=TAMANO_POOL_EVALUACION, **opciones_texto):
+        super().__init__(master)
+        self.almacen = almacen if almacen is not None else AlmacenMensajes()
+        self.al_evaluar = al_evaluar
+        self.ventana = ventana
+
+        self.texto = tk.Text(self, wrap=tk.WORD, **opciones_texto)
+        self.barra = ttk.Scrollbar(self, orient="vertical", command=self._desplazar)
+        self.texto.configure(yscrollcommand=self._actualizar_barra, state='disabled')
+        self.texto.grid(row=0, column=0, sticky="nsew")
+        self.barra.grid(row=0, column=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        # Hueco bajo cada respuesta sobre el que se colocan los botones de evaluación
+        self.texto.tag_configure("hueco", spacing1=4, spacing3=12)
+
+        # Mensajes dibujados: [inicio, fin) del almacén
+        self.inicio = 0
+        self.fin = 0
+        self.marcas = {}
+        self.movimiento_pendiente = None
+        self.reposicion_pendiente = None
+
+        self.pool = [self._crear_controles() for _ in range(tamano_pool)]
+        self.texto.bind("<Configure>", lambda e: self._programar_reposicion())
+
+    # --- API para la interfaz ---
+
+    def agregar(self, rol, texto="", **datos):
+        """Guarda un mensaje y lo dibuja si la ventana está siguiendo el final; devuelve su id"""
+        mensaje = self.almacen.agregar(rol, texto, **datos)
+        if self.fin == len(self.almacen) - 1:
+            en_fondo = self.texto.yview()[1] >= 0.999
+            self.texto.configure(state='normal')
+            self._insertar(mensaje)
+            self.fin += 1
+            while self.fin - self.inicio > self.ventana:
+                self._recortar_inicio()
+            self.texto.configure(state='disabled')
+            if en_fondo:
+                self.texto.see(tk.END)
+        elif rol == "usuario":
+            # Una pregunta nueva vuelve al final aunque se estuviera leyendo el historial
+            self._renderizar(len(self.almacen) - self.ventana)
+        self._actualizar_barra(*self.texto.yview())
+        return mensaje["id"]
+
+    def anexar(self, mensaje_id, fragmento):
+        """Añade un fragmento de streaming al final de un mensaje"""
+        mensaje = self.almacen.obtener(mensaje_id)
+        mensaje["texto"] += fragmento
+        if self._visible(mensaje_id):
+            en_fondo = self.texto.yview()[1] >= 0.999
+            self._editar(f"fin_{mensaje_id}", fragmento)
+            if en_fondo:
+                self.texto.see(tk.END)
+
+    def completar(self, mensaje_id, texto, **datos):
+        """Fija el texto definitivo de una respuesta y muestra sus botones de evaluación"""
+        mostrado = self.almacen.obtener(mensaje_id)["texto"]
+        self.almacen.actualizar(mensaje_id, texto=texto, completo=True, **datos)
+        if self._visible(mensaje_id):
+            self.texto.configure(state='normal')
+            if texto.startswith(mostrado):
+                # Lo no emitido por streaming va al final
+                self.texto.insert(f"fin_{mensaje_id}", texto[len(mostrado):])
+            else:
+                self.texto.delete(f"cuerpo_{mensaje_id}", f"fin_{mensaje_id}")
+                self.texto.insert(f"fin_{mensaje_id}", texto)
+            self.texto.configure(state='disabled')
+            self._programar_reposicion()
+
+    def fijar_sentimiento(self, mensaje_id, sentimiento):
+        self.almacen.actualizar(mensaje_id, sentimiento=sentimiento)
+        if self._visible(mensaje_id):
+            self._editar(f"sentimiento_{mensaje_id}", f" [{sentimiento}]")
+
+    def fijar_evaluacion(self, mensaje_id, es_positiva):
+        self.almacen.actualizar(mensaje_id, evaluacion=es_positiva)
+        for controles in self.pool:
+            if controles.mensaje_id == mensaje_id:
+                controles.etiqueta.configure(text=TEXTO_EVALUACION[es_positiva])
+
+    # --- Dibujo de la ventana ---
+
+    def _visible(self, mensaje_id):
+        return self.inicio <= mensaje_id < self.fin
+
+    def _editar(self, indice, texto):
+        self.texto.configure(state='normal')
+        self.texto.insert(indice, texto)
+        self.texto.configure(state='disabled')
+
+    def _marcar(self, mensaje_id, nombre, gravedad=tk.LEFT):
+        marca = f"{nombre}_{mensaje_id}"
+        self.texto.mark_set(marca, "end-1c")
+        self.texto.mark_gravity(marca, gravedad)
+        self.marcas.setdefault(mensaje_id, []).append(marca)
+
+    def _insertar(self, mensaje):
+        # Dibuja un mensaje al final con sus marcas; el texto debe estar en estado normal
+        mensaje_id = mensaje["id"]
+        self._marcar(mensaje_id, "ini")
+        if mensaje["rol"] == "usuario":
+            self.texto.insert(tk.END, f"\n❓ Tú: {mensaje['texto']}\n")
+        elif mensaje["rol"] == "modelo":
+            self.texto.insert(tk.END, "\n🤖 Gemini")
+            self._marcar(mensaje_id, "sentimiento")
+            if mensaje["sentimiento"]:
+                self.texto.insert(tk.END, f" [{mensaje['sentimiento']}]")
+            self.texto.insert(tk.END, ": ")
+            self._marcar(mensaje_id, "cuerpo")
+            self.texto.insert(tk.END, mensaje["texto"])
+            self._marcar(mensaje_id, "fin")
+            self.texto.insert(tk.END, "\n")
+            self._marcar(mensaje_id, "hueco")
+            self.texto.insert(tk.END, " \n", "hueco")
+            # A partir de aquí lo insertado en la marca queda antes de ella
+            self.texto.mark_gravity(f"fin_{mensaje_id}", tk.RIGHT)
+        else:
+            self.texto.insert(tk.END, mensaje["texto"])
+
+    def _olvidar_marcas(self, mensaje_id):
+        for marca in self.marcas.pop(mensaje_id, []):
+            self.texto.mark_unset(marca)
+
+    def _recortar_inicio(self):
+        # Quita el primer mensaje dibujado: solo se borra su propio texto
+        siguiente = f"ini_{self.inicio + 1}" if self.inicio + 1 < self.fin else tk.END
+        self.texto.delete("1.0", siguiente)
+        self._olvidar_marcas(self.inicio)
+        self.inicio += 1
+
+    def _renderizar(self, inicio, ancla=None, arriba=True):
+        # Redibuja la ventana desde `inicio` y deja el mensaje `ancla` a la vista
+        total = len(self.almacen)
+        inicio = max(0, min(inicio, total - self.ventana))
+        self.texto.configure(state='normal')
+        self.texto.delete("1.0", tk.END)
+        for mensaje_id in list(self.marcas):
+            self._olvidar_marcas(mensaje_id)
+        self.inicio = inicio
+        self.fin = min(total, inicio + self.ventana)
+        for indice in range(self.inicio, self.fin):
+            self._insertar(self.almacen[indice])
+        self.texto.configure(state='disabled')
+
+        if ancla is None or not self._visible(ancla):
+            self.texto.see(tk.END)
+        elif arriba:
+            self.texto.yview(f"ini_{ancla}")
+        else:
+            self.texto.see(f"ini_{ancla}")
+        self._programar_reposicion()
+
+    def _mover_ventana(self, direccion):
+        self.movimiento_pendiente = None
+        primero, ultimo = self.texto.yview()
+        # La vista pudo moverse desde que se programó el cambio
+        if (direccion < 0 and primero > 0.0) or (direccion > 0 and ultimo < 1.0):
+            return
+        paso = max(1, self.ventana // 2)
+        if direccion < 0 and self.inicio > 0:
+            self._renderizar(self.inicio - paso, ancla=self.inicio, arriba=True)
+        elif direccion > 0 and self.fin < len(self.almacen):
+            self._renderizar(self.inicio + paso, ancla=self.fin - 1, arriba=False)
+
+    # --- Barra de desplazamiento sobre todo el almacén ---
+
+    def _actualizar_barra(self, primero, ultimo):
+        primero, ultimo = float(primero), float(ultimo)
+        total = len(self.almacen)
+        dibujados = self.fin - self.inicio
+        if total == 0 or dibujados == 0:
+            self.barra.set(0.0, 1.0)
+        else:
+            self.barra.set((self.inicio + primero * dibujados) / total,
+                           (self.inicio + ultimo * dibujados) / total)
+
+        # Al llegar a un borde de la ventana, correrla (fuera de este callback de Tk)
+        if self.movimiento_pendiente is None:
+            if primero <= 0.0 and self.inicio > 0:
+                self.movimiento_pendiente = self.after_idle(self._mover_ventana, -1)
+            elif ultimo >= 1.0 and self.fin < total:
+                self.movimiento_pendiente = self.after_idle(self._mover_ventana, 1)
+        self._programar_reposicion()
+
+    def _desplazar(self, *args):
+        if args[0] != "moveto":
+            # Desplazamiento por líneas o páginas: lo resuelve el propio Text
+            self.texto.yview(*args)
+            return
+        total = len(self.almacen)
+        if total == 0:
+            return
+        posicion = min(max(float(args[1]), 0.0), 1.0) * total
+        objetivo = min(int(posicion), total - 1)
+        if self._visible(objetivo):
+            dibujados = self.fin - self.inicio
+            self.texto.yview_moveto((posicion - self.inicio) / dibujados)
+        else:
+            self._renderizar(objetivo - self.ventana // 2, ancla=objetivo, arriba=True)
+
+    # --- Pool de controles de evaluación ---
+
+    def _crear_controles(self):
+        controles = ttk.Frame(self.texto)
+        controles.mensaje_id = None
+        ttk.Button(controles, text="👍", width=3,
+                   command=lambda: self._evaluar(controles, True)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(controles, text="👎", width=3,
+                   command=lambda: self._evaluar(controles, False)).pack(side=tk.LEFT, padx=2)
+        controles.etiqueta = ttk.Label(controles, text="")
+        controles.etiqueta.pack(side=tk.LEFT, padx=5)
+        return controles
+
+    def _evaluar(self, controles, es_positiva):
+        if controles.mensaje_id is not None and self.al_evaluar is not None:
+            self.al_evaluar(controles.mensaje_id, es_positiva)
+
+    def _programar_reposicion(self):
+        if self.reposicion_pendiente is None:
+            self.reposicion_pendiente = self.after_idle(self._reposicionar)
+
+    def _reposicionar(self):
+        # Asigna los controles del pool a las respuestas completas que están a la vista
+        self.reposicion_pendiente = None
+        libres = list(self.pool)
+        for indice in range(self.inicio, self.fin):
+            if not libres:
+                break
+            mensaje = self.almacen[indice]
+            if mensaje["rol"] != "modelo" or not mensaje["completo"]:
+                continue
+            caja = self.texto.bbox(f"hueco_{mensaje['id']}")
+            if caja is None:
+                continue
+            controles = libres.pop(0)
+            if controles.mensaje_id != mensaje["id"]:
+                controles.mensaje_id = mensaje["id"]
+                controles.etiqueta.configure(text=TEXTO_EVALUACION[mensaje["evaluacion"]])
+            controles.place(x=caja[0], y=caja[1])
+        for controles in libres:
+            controles.mensaje_id = None
+            controles.place_forget()
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import math
+import time
+import array
+import queue
+import threading
+from collections import deque
+
+# Formato de captura: 16 kHz, 16 bits, mono y tramas de 30 ms (lo que esperan Vosk y webrtcvad)
+FRECUENCIA = 16000
+MUESTRAS_TRAMA = 480
+MS_TRAMA = 30
+
+# Tramas que se guardan antes de detectar la voz para no cortar la primera sílaba
+TRAMAS_PREVIAS = 10
+
+# Máximo de tramas que se descartan al reutilizar el micrófono (lo que grabó mientras nadie leía)
+MAX_TRAMAS_ACUMULADAS = 200
+
+
+def energia(trama):
+    """Energía RMS de una trama PCM de 16 bits"""
+    muestras = array.array('h', trama)
+    if sys.byteorder == 'big':
+        muestras.byteswap()
+    if not muestras:
+        return 0.0
+    return math.sqrt(sum(m * m for m in muestras) / len(muestras))
+
+
+class DetectorVoz:
+    """Detección de actividad de voz local por energía sobre el ruido de fondo.
+
+    El ruido se calibra con las primeras tramas y se sigue ajustando en los silencios, así que la
+    calibración se conserva de una pulsación del micrófono a la siguiente. Si webrtcvad está
+    instalado, además tiene que reconocer la trama como voz.
+    """
+
+    def __init__(self, factor=3.0, minimo=200.0, ms_inicio=90, ms_silencio=700, tramas_calibracion=10):
+        self.factor = factor
+        self.minimo = minimo
+        self.tramas_inicio = max(1, ms_inicio // MS_TRAMA)
+        self.tramas_silencio = max(1, ms_silencio // MS_TRAMA)
+        self.tramas_calibracion = tramas_calibracion
+        self.ruido = None
+        self.muestras_ruido = []
+        try:
+            import webrtcvad
+            self.vad = webrtcvad.Vad(2)
+        except ImportError:
+            self.vad = None
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.hablando = False
+        self.seguidas = 0
+
+    @property
+    def calibrado(self):
+        return self.ruido is not None
+
+    def _es_voz(self, trama, nivel):
+        if nivel <= max(self.minimo, self.ruido * self.factor):
+            return False
+        return self.vad is None or self.vad.is_speech(trama, FRECUENCIA)
+
+    def procesar(self, trama):
+        """Devuelve "inicio" al empezar a hablar, "fin" tras el silencio final y None en otro caso"""
+        nivel = energia(trama)
+        if self.ruido is None:
+            self.muestras_ruido.append(nivel)
+            if len(self.muestras_ruido) >= self.tramas_calibracion:
+                self.ruido = sum(self.muestras_ruido) / len(self.muestras_ruido)
+                self.muestras_ruido = []
+            return None
+
+        es_voz = self._es_voz(trama, nivel)
+        if not self.hablando:
+            # El ruido de fondo se sigue midiendo mientras no se habla
+            if not es_voz:
+                self.ruido = 0.95 * self.ruido + 0.05 * nivel
+            self.seguidas = self.seguidas + 1 if es_voz else 0
+            if self.seguidas >= self.tramas_inicio:
+                self.hablando = True
+                self.seguidas = 0
+                return "inicio"
+            return None
+
+        self.seguidas = 0 if es_voz else self.seguidas + 1
+        if self.seguidas >= self.tramas_silencio:
+            self.reiniciar()
+            return "fin"
+        return None
+
+
+class ReconocedorVosk:
+    """Reconocimiento local y sin red con Vosk, con transcripciones parciales mientras se habla.
+
+    Necesita la carpeta de un modelo ya descargado (VOZ_MODELO_VOSK): sin ella no se descarga nada.
+    """
+
+    def __init__(self, ruta_modelo=None):
+        ruta_modelo = ruta_modelo or os.getenv('VOZ_MODELO_VOSK')
+        if not ruta_modelo:
+            raise ValueError("VOZ_MODELO_VOSK no está definida: descarga un modelo de "
+                             "https://alphacephei.com/vosk/models e indica su carpeta")
+        # Importación diferida: vosk es una dependencia opcional
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        self.modelo = Model(ruta_modelo)
+
+    def iniciar(self):
+        from vosk import KaldiRecognizer
+        self.kaldi = KaldiRecognizer(self.modelo, FRECUENCIA)
+        self.frases = []
+
+    def aceptar(self, trama):
+        # Vosk cierra frases por su cuenta en las pausas; el parcial es lo cerrado más lo que está en curso
+        if self.kaldi.AcceptWaveform(trama):
+            self.frases.append(json.loads(self.kaldi.Result()).get("text", ""))
+            return " ".join(f for f in self.frases if f)
+        parcial = json.loads(self.kaldi.PartialResult()).get("partial", "")
+        return " ".join(f for f in self.frases + [parcial] if f)
+
+    def terminar(self):
+        self.frases.append(json.loads(self.kaldi.FinalResult()).get("text", ""))
+        return " ".join(f for f in self.frases if f)
+
+
+class ReconocedorGoogle:
+    """Reconocimiento remoto de speech_recognition: envía la frase completa al terminar (sin parciales)"""
+
+    def __init__(self, idioma="es-ES"):
+        import speech_recognition as sr
+        self.sr = sr
+        self.reconocedor = sr.Recognizer()
+        self.idioma = idioma
+
+    def iniciar(self):
+        self.tramas = []
+
+    def aceptar(self, trama):
+        self.tramas.append(trama)
+        return None
+
+    def terminar(self):
+        audio = self.sr.AudioData(b"".join(self.tramas), FRECUENCIA, 2)
+        try:
+            return self.reconocedor.recognize_google(audio, language=self.idioma)
+        except self.sr.UnknownValueError:
+            return ""
+        except self.sr.RequestError:
+            raise ConnectionError("Error al conectar con el servicio de reconocimiento")
+
+
+# Backends disponibles; se elige con VOZ_BACKEND en .env/config.env
+RECONOCEDORES = {
+    "vosk": ReconocedorVosk,
+    "google": ReconocedorGoogle
+}
+
+
+def registrar_reconocedor(nombre, fabrica):
+    """Añade un backend; la fábrica debe devolver un objeto con iniciar(), aceptar(trama) y terminar()"""
+    RECONOCEDORES[nombre] = fabrica
+
+
+def crear_reconocedor(nombre=None):
+    """Crea el reconocedor configurado, usando el de Google si el backend local no está disponible"""
+    nombre = nombre or os.getenv('VOZ_BACKEND', 'vosk')
+    try:
+        return RECONOCEDORES[nombre]()
+    except Exception as e:
+        print(f"Error al crear el reconocedor '{nombre}', usando el de Google: {str(e)}")
+        return ReconocedorGoogle()
+
+
+class EscuchaContinua:
+    """Hilo de captura persistente: micrófono, detector de voz y reconocedor se crean una sola vez.
+
+    escuchar() abre una sesión que termina sola tras el silencio final (o con detener()). Las
+    funciones de aviso se llaman desde el hilo de captura. El micrófono se cierra al terminar cada
+    sesión o, con `mantener_abierto` (VOZ_MANTENER_ABIERTO), tras esos segundos sin sesiones.
+    """
+
+    def __init__(self, reconocedor=None, detector=None, espera_maxima=5.0, frase_maxima=30.0,
+                 mantener_abierto=None):
+        self.reconocedor = reconocedor
+        self.detector = detector or DetectorVoz(ms_silencio=int(os.getenv('VOZ_SILENCIO_MS', 700)))
+        self.espera_maxima = espera_maxima
+        self.frase_maxima = frase_maxima
+        if mantener_abierto is None:
+            mantener_abierto = float(os.getenv('VOZ_MANTENER_ABIERTO', 0))
+        self.mantener_abierto = mantener_abierto
+        self.ordenes = queue.Queue()
+        self.parar = threading.Event()
+        self.microfono = None
+        self.fuente = None
+        self.hilo = threading.Thread(target=self._bucle, name="captura-voz", daemon=True)
+        self.hilo.start()
+
+    def escuchar(self, al_parcial, al_final, al_error):
+        self.parar.clear()
+        self.ordenes.put((al_parcial, al_final, al_error))
+
+    def detener(self):
+        """Termina la sesión en curso y reconoce lo que se haya dicho hasta ahora"""
+        self.parar.set()
+
+    def cerrar(self):
+        self.parar.set()
+        self.ordenes.put(None)
+
+    def _abrir(self):
+        if self.fuente is None:
+            import speech_recognition as sr
+            self.microfono = sr.Microphone(sample_rate=FRECUENCIA, chunk_size=MUESTRAS_TRAMA)
+            self.fuente = self.microfono.__enter__()
+        else:
+            self._descartar_acumulado(self.fuente)
+        return self.fuente
+
+    def _descartar_acumulado(self, fuente):
+        # Lo grabado mientras el micrófono seguía abierto sin leer llega al instante; el audio en vivo
+        # tarda lo que dura una trama: se descarta hasta la primera lectura que tiene que esperar
+        for _ in range(MAX_TRAMAS_ACUMULADAS):
+            inicio = time.perf_counter()
+            fuente.stream.read(MUESTRAS_TRAMA)
+            if time.perf_counter() - inicio > MS_TRAMA / 2000:
+                return
+
+    def _cerrar_microfono(self):
+        if self.microfono is not None:
+            try:
+                self.microfono.__exit__(None, None, None)
+            except Exception as e:
+                print(f"Error al cerrar el micrófono: {str(e)}")
+        self.microfono = None
+        self.fuente = None
+
+    def _bucle(self):
+        while True:
+            try:
+                esperar = self.mantener_abierto if self.fuente is not None and self.mantener_abierto > 0 else None
+                orden = self.ordenes.get(timeout=esperar)
+            except queue.Empty:
+                self._cerrar_microfono()
+                continue
+            if orden is None:
+                self._cerrar_microfono()
+                return
+            self._sesion(*orden)
+            if self.mantener_abierto <= 0:
+                self._cerrar_microfono()
+
+    def _sesion(self, al_parcial, al_final, al_error):
+        try:
+            if self.reconocedor is None:
+                # Un modelo local puede tardar en cargar: se hace aquí, fuera del hilo de Tk
+                self.reconocedor = crear_reconocedor()
+            fuente = self._abrir()
+
+            self.detector.reiniciar()
+            self.reconocedor.iniciar()
+            previas = deque(maxlen=TRAMAS_PREVIAS)
+            hablando = False
+            ultimo_parcial = ""
+            inicio = time.monotonic()
+            while not self.parar.is_set():
+                trama = fuente.stream.read(MUESTRAS_TRAMA)
+                evento = self.detector.procesar(trama)
+                if not hablando:
+                    previas.append(trama)
+                    if evento == "inicio":
+                        hablando = True
+                        inicio = time.monotonic()
+                        tramas = list(previas)
+                    elif time.monotonic() - inicio > self.espera_maxima:
+                        al_error("No se detectó ninguna voz")
+                        return
+                    else:
+                        continue
+                else:
+                    tramas = [trama]
+
+                for trama_voz in tramas:
+                    parcial = self.reconocedor.aceptar(trama_voz)
+                    if parcial and parcial != ultimo_parcial:
+                        ultimo_parcial = parcial
+                        al_parcial(parcial)
+                if evento == "fin" or time.monotonic() - inicio > self.frase_maxima:
+                    break
+
+            if not hablando:
+                al_error("Grabación detenida")
+                return
+            texto = self.reconocedor.terminar()
+            if texto:
+                al_final(texto)
+            else:
+                al_error("No se pudo entender el audio")
+        except Exception as e:
+            # Un micrófono en mal estado se vuelve a abrir en la próxima sesión
+            self._cerrar_microfono()
+            al_error(f"Error: {str(e)}")